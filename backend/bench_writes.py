@@ -0,0 +1,287 @@
+"""
+Write-path benchmark for ndb and the data loaders.
+
+Creates a throwaway database on the Postgres server from .env (DB_HOST,
+DB_USER, ...), builds the hospital schema in it, and measures how fast rows
+get in through each write path:
+
+  connect_per_row    new psycopg2 connection + INSERT + commit per row
+                     (what every insert_* call used to do)
+  single_row         insert_* on the pool, committing every row
+  single_row_txn     insert_* on the pool, all rows in one transaction()
+  batched            insert_*_many (multi-row VALUES, RETURNING ids)
+  copy               copy_rows (COPY ... FROM STDIN)
+
+for a narrow table (patient_symptoms) and a wide one (document_references).
+Results (rows/sec, p50/p99 latency) are printed to stdout as JSON (progress
+goes to stderr) so runs can be diffed between versions:
+
+    python bench_writes.py --rows 20000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+import ndb
+
+
+NARROW_TABLE = "patient_symptoms"
+WIDE_TABLE = "document_references"
+
+# Per-table hooks: single-row insert, batched insert, column spec.
+TABLES = {
+    NARROW_TABLE: (ndb.insert_patient_symptom, ndb.insert_patient_symptoms_many, ndb.PATIENT_SYMPTOM_COLUMNS),
+    WIDE_TABLE: (ndb.insert_document_reference, ndb.insert_document_references_many, ndb.DOCUMENT_REFERENCE_COLUMNS),
+}
+
+WIDE_CONTENT = ("Patient reviewed during ward round. Vitals stable. " * 40)[:2000]
+
+
+# --------------------------
+# THROWAWAY DATABASE
+# --------------------------
+def _admin_conn():
+    conn = psycopg2.connect(**{**ndb._connect_kwargs(), "dbname": "postgres"})
+    conn.autocommit = True
+    return conn
+
+
+def create_bench_db(name):
+    conn = _admin_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name};")
+            cur.execute(f"CREATE DATABASE {name};")
+    finally:
+        conn.close()
+
+    ndb.close_pool()
+    ndb.DB_NAME = name
+    ndb.create_tables()
+
+
+def drop_bench_db(name):
+    ndb.close_pool()
+    conn = _admin_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name};")
+    finally:
+        conn.close()
+
+
+def seed_parents():
+    """Minimal parent rows so the benchmarked tables satisfy their FKs."""
+    patient_id = ndb.insert_patient(name="Bench Patient", gender="female", birth_date="1980-01-01")
+    doctor_id = ndb.insert_doctor(
+        "doc-bench", "Bench Doctor", "General", "", "", "OPD", "MBBS", 10
+    )
+    symptom_id = ndb.insert_symptom("Bench symptom", "Benchmark only")
+    appt_id = ndb.insert_appointment(patient_id, doctor_id, "2025-01-15")
+    return dict(patient_id=patient_id, symptom_id=symptom_id, encounter_id=appt_id)
+
+
+def make_rows(table, parents, n):
+    if table == NARROW_TABLE:
+        return [
+            dict(patient_id=parents["patient_id"], symptom_id=parents["symptom_id"], noted_on="2025-01-15")
+            for _ in range(n)
+        ]
+    return [
+        dict(
+            patient_id=parents["patient_id"], encounter_id=parents["encounter_id"],
+            title="Nurse Notes", content=WIDE_CONTENT, author="Bench Nurse",
+            date="2025-01-15 10:00:00", fhir_id=f"doc-{i:08d}",
+        )
+        for i in range(n)
+    ]
+
+
+def truncate(table):
+    with ndb.transaction() as conn, conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {table} RESTART IDENTITY;")
+
+
+# --------------------------
+# WRITE PATHS
+# --------------------------
+def run_connect_per_row(table, rows):
+    columns = TABLES[table][2]
+    column_list = ", ".join(name for name, _ in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    latencies = []
+    for row in rows:
+        start = time.perf_counter()
+        conn = ndb.get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}) RETURNING 1;",
+            ndb._row_values(columns, row),
+        )
+        cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+        latencies.append(time.perf_counter() - start)
+    return latencies, "row"
+
+
+def run_single_row(table, rows):
+    insert_one = TABLES[table][0]
+    latencies = []
+    for row in rows:
+        start = time.perf_counter()
+        insert_one(**row)
+        latencies.append(time.perf_counter() - start)
+    return latencies, "row"
+
+
+def run_single_row_txn(table, rows):
+    insert_one = TABLES[table][0]
+    latencies = []
+    with ndb.transaction():
+        for row in rows:
+            start = time.perf_counter()
+            insert_one(**row)
+            latencies.append(time.perf_counter() - start)
+    return latencies, "row"
+
+
+def run_batched(table, rows, batch_size):
+    insert_many = TABLES[table][1]
+    latencies = []
+    for i in range(0, len(rows), batch_size):
+        start = time.perf_counter()
+        insert_many(rows[i:i + batch_size], page_size=batch_size)
+        latencies.append(time.perf_counter() - start)
+    return latencies, "batch"
+
+
+def run_copy(table, rows, batch_size):
+    columns = TABLES[table][2]
+    latencies = []
+    for i in range(0, len(rows), batch_size):
+        start = time.perf_counter()
+        with ndb.transaction() as conn, conn.cursor() as cur:
+            ndb.copy_rows(cur, table, columns, rows[i:i + batch_size])
+        latencies.append(time.perf_counter() - start)
+    return latencies, "batch"
+
+
+# --------------------------
+# REPORTING
+# --------------------------
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(table, method, rows, fn):
+    truncate(table)
+    start = time.perf_counter()
+    latencies, unit = fn(table, rows)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "table": table,
+        "method": method,
+        "rows": len(rows),
+        "seconds": round(elapsed, 4),
+        "rows_per_sec": round(len(rows) / elapsed, 1) if elapsed else None,
+        "latency_unit": unit,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+    }
+    if unit == "batch":
+        # Amortised per-row latency so batched paths compare with per-row ones.
+        result["per_row_us"] = round(elapsed / len(rows) * 1e6, 2)
+    print(f"  {table:<20} {method:<16} {result['rows_per_sec']:>12} rows/s", file=sys.stderr, flush=True)
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def _server_version():
+    with ndb.transaction() as conn, conn.cursor() as cur:
+        cur.execute("SHOW server_version;")
+        return cur.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ndb write paths.")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows for the batched/COPY/txn paths")
+    parser.add_argument(
+        "--slow-rows", type=int, default=1_000,
+        help="rows for the commit-per-row paths (connect_per_row, single_row)",
+    )
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    parser.add_argument("--db-name", default=f"medicalbot_bench_{os.getpid()}")
+    parser.add_argument("--keep-db", action="store_true", help="don't drop the benchmark database")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    paths = [
+        ("connect_per_row", args.slow_rows, run_connect_per_row),
+        ("single_row", args.slow_rows, run_single_row),
+        ("single_row_txn", args.rows, run_single_row_txn),
+        ("batched", args.rows, lambda t, r: run_batched(t, r, args.batch_size)),
+        ("copy", args.rows, lambda t, r: run_copy(t, r, args.batch_size)),
+    ]
+
+    print(f"Creating benchmark database {args.db_name}...", file=sys.stderr, flush=True)
+    create_bench_db(args.db_name)
+    try:
+        parents = seed_parents()
+        results = []
+        for table in TABLES:
+            for method, n, fn in paths:
+                results.append(measure(table, method, make_rows(table, parents, n), fn))
+
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "git_revision": _git_revision(),
+                "postgres_version": _server_version(),
+                "python_version": platform.python_version(),
+                "db_host": ndb.DB_HOST,
+                "pool_max": ndb.DB_POOL_MAX,
+                "batch_size": args.batch_size,
+            },
+            "results": results,
+        }
+    finally:
+        if not args.keep_db:
+            drop_bench_db(args.db_name)
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
+import argparse
+import bisect
+import os
 import random
+from concurrent.futures import ProcessPoolExecutor
 from faker import Faker
 from datetime import datetime, timedelta
-from symptoms import REAL_DISEASES,SYMPTOMS
+from symptoms import sync_diseases, sync_symptoms
 # Import all insert functions from db.py
 from ndb import (
-    insert_patient, insert_doctor, insert_appointment, insert_disease,
-    insert_patient_condition, insert_symptom, insert_patient_symptom,
-    insert_treatment, insert_patient_treatment, insert_medicine,
-    insert_prescription, insert_billing, insert_staff,
-    insert_diagnostic_report, insert_document_reference,
+    insert_patient, insert_appointment,
+    insert_patient_condition, insert_patient_symptom,
+    insert_patient_treatment,
+    insert_prescription, insert_billing,
+    insert_diagnostic_report, insert_document_reference, transaction,
+    insert_doctors_many,
+    insert_treatments_many, insert_medicines_many, insert_staff_many,
+    reserve_ids, copy_rows, close_pool, ensure_partitions, refresh_summary_views,
+    PATIENT_COLUMNS, APPOINTMENT_COLUMNS, PATIENT_CONDITION_COLUMNS,
+    PATIENT_SYMPTOM_COLUMNS, PATIENT_TREATMENT_COLUMNS, PRESCRIPTION_COLUMNS,
+    BILLING_COLUMNS, DIAGNOSTIC_REPORT_COLUMNS, DOCUMENT_REFERENCE_COLUMNS,
 )
 
 fake = Faker()
@@ -24,41 +34,95 @@ NUM_TREATMENTS = 200
 NUM_MEDICINES = 500
 NUM_STAFF = 100
 
+# Patients generated (and COPYed) per transaction in --mode copy. Peak
+# memory is bounded by this, not by the total number of patients.
+COPY_CHUNK_SIZE = 1000
+
+# Default number of shards. Fixed (not derived from --workers) so the same
+# --seed produces the same data on any machine.
+DEFAULT_SHARDS = 64
+
+# Scale profiles. "skew" is the Zipf exponent used for doctor, disease and
+# date choices (None = uniform random.choice like the original generator).
+PROFILES = {
+    "small": dict(
+        patients=NUM_PATIENTS, doctors=NUM_DOCTORS, treatments=NUM_TREATMENTS,
+        medicines=NUM_MEDICINES, staff=NUM_STAFF, skew=None,
+    ),
+    "medium": dict(
+        patients=50_000, doctors=400, treatments=1_000,
+        medicines=2_000, staff=500, skew=1.1,
+    ),
+    "large": dict(
+        patients=2_000_000, doctors=5_000, treatments=5_000,
+        medicines=10_000, staff=5_000, skew=1.1,
+    ),
+}
+PROFILES["custom"] = dict(PROFILES["small"])
+
+# Per-process generation state. Set by _seed_shard() so that every shard is
+# reproducible from (base seed, shard index) no matter which worker runs it.
+SKEW = None
+AS_OF = datetime.now()
+
 
 # --------------------------
 # HELPERS
 # --------------------------
-def random_date(days=365):
-    return (datetime.now() - timedelta(days=random.randint(1, days))).strftime("%Y-%m-%d")
+_zipf_cache = {}
+
+
+def _zipf_cum_weights(n, s):
+    key = (n, s)
+    if key not in _zipf_cache:
+        total = 0.0
+        cum = []
+        for rank in range(1, n + 1):
+            total += 1.0 / (rank ** s)
+            cum.append(total)
+        _zipf_cache[key] = cum
+    return _zipf_cache[key]
+
+
+def _zipf_index(n):
+    """Index in [0, n) drawn with Zipf(SKEW) weights: index 0 is the hottest."""
+    cum = _zipf_cum_weights(n, SKEW)
+    return bisect.bisect_left(cum, random.random() * cum[-1])
+
+
+def pick(seq):
+    """random.choice, or a Zipf-skewed choice when the profile sets a skew."""
+    if not SKEW:
+        return random.choice(seq)
+    return seq[_zipf_index(len(seq))]
+
+
+def random_days_ago(days, skewed=False):
+    """1..days; with skewed=True recent days are favoured when the profile sets a skew."""
+    if not (skewed and SKEW):
+        return random.randint(1, days)
+    return _zipf_index(days) + 1
+
+
+def random_date(days=365, skewed=False):
+    return (AS_OF - timedelta(days=random_days_ago(days, skewed))).strftime("%Y-%m-%d")
 
 def random_timestamp(days=1000):
     """Generate a random timestamp within the last <days> days."""
-    dt = datetime.now() - timedelta(
-        days=random.randint(1, days),
+    dt = AS_OF - timedelta(
+        days=random_days_ago(days),
         hours=random.randint(0, 23),
         minutes=random.randint(0, 59),
         seconds=random.randint(0, 59)
     )
     return dt.strftime("%Y-%m-%d %H:%M:%S")
 
-# --------------------------
-# STORAGE
-# --------------------------
-patients = []
-doctors = []
-diseases = []
-symptoms = []
-treatments = []
-medicines = []
-appointments = []
 
 # --------------------------
-# GENERATE PATIENTS
+# FAKE RECORDS (shared by both load modes)
 # --------------------------
-print("Creating patients...")
-
-for _ in range(NUM_PATIENTS):
-    p_id = insert_patient(
+def fake_patient():
+    return dict(
         name=fake.name(),
         gender=random.choice(["male", "female"]),
         birth_date=random_date(20000),
@@ -71,16 +135,10 @@ for _ in range(NUM_PATIENTS):
         created_at=random_timestamp(2000),
         updated_at=random_timestamp(500)
     )
-    patients.append(p_id)
 
 
-# --------------------------
-# GENERATE DOCTORS
-# --------------------------
-print("Creating doctors...")
-
-for _ in range(NUM_DOCTORS):
-    d_id = insert_doctor(
+def fake_doctor():
+    return dict(
         fhir_id=f"doc-{fake.uuid4()[:8]}",
         name=fake.name(),
         specialization=random.choice(["Cardiology", "Neurology", "General", "Orthopedic", "Dermatology"]),
@@ -90,179 +148,341 @@ for _ in range(NUM_DOCTORS):
         qualification=random.choice(["MBBS", "MBBS MD", "MBBS MS"]),
         years_of_experience=random.randint(1, 35)
     )
-    doctors.append(d_id)
-
-
-# --------------------------
-# DISEASES
-# --------------------------
-print("Creating diseases...")
-
-for d in REAL_DISEASES:
-    dis_id = insert_disease(
-        name=d,
-        description=f"A condition known as {d}."
-    )
-    diseases.append(dis_id)
 
 
-# --------------------------
-# SYMPTOMS
-# --------------------------
-# REAL SYMPTOMS
-print("Creating real symptoms...")
+def fake_visit(patient_id, ref):
+    """
+    One appointment for `patient_id` plus every record hanging off it.
+    Diagnostic report / document reference rows get their encounter_id
+    filled in by the caller once the appointment id is known.
+    """
+    doctor = pick(ref["doctors"])
+    appt_date = random_date(365, skewed=True)
 
-for (name, desc) in SYMPTOMS:
-    sym_id = insert_symptom(
-        name=name,
-        description=desc    # use real description from dataset
-    )
-    symptoms.append(sym_id)
+    amount = random.randint(500, 5000)
+    discount = amount * 0.10
+    tax = amount * 0.05
 
-# --------------------------
-# TREATMENTS
-# --------------------------
-print("Creating treatments...")
-
-for _ in range(NUM_TREATMENTS):
-    t_id = insert_treatment(
-        name=fake.word().capitalize(),
-        description=fake.text()
-    )
-    treatments.append(t_id)
-
-
-# --------------------------
-# MEDICINES
-# --------------------------
-print("Creating medicines...")
-
-for _ in range(NUM_MEDICINES):
-    m_id = insert_medicine(
-        name=fake.word().capitalize(),
-        type=random.choice(["Tablet", "Syrup", "Injection", "Capsule"]),
-        description=fake.text()
-    )
-    medicines.append(m_id)
-
-
-# --------------------------
-# STAFF
-# --------------------------
-print("Creating staff...")
-
-roles = ["Nurse", "Receptionist", "Lab Technician", "Pharmacist", "Manager"]
-
-for _ in range(NUM_STAFF):
-    insert_staff(
-        name=fake.name(),
-        role=random.choice(roles),
-        phone=fake.phone_number(),
-        email=fake.email()
-    )
-
-
-# --------------------------
-# APPOINTMENTS + RELATED DATA
-# --------------------------
-print("Creating appointments & related records...")
-
-for p in patients:
-
-    for _ in range(random.randint(1, 3)):
-
-        doctor = random.choice(doctors)
-        appt_date = random_date(365)
-
-        # Appointment
-        appt_id = insert_appointment(
-            patient_id=p,
+    return {
+        "appointment": dict(
+            patient_id=patient_id,
             practitioner_id=doctor,
             encounter_date=appt_date,
             status="finished",
             fhir_id=f"enc-{fake.uuid4()[:8]}"
-        )
-        appointments.append(appt_id)
-
-        # Condition
-        insert_patient_condition(
-            patient_id=p,
-            disease_id=random.choice(diseases),
+        ),
+        "condition": dict(
+            patient_id=patient_id,
+            disease_id=pick(ref["diseases"]),
             code=f"C{random.randint(100,999)}",
             description=fake.sentence(),
             onset_date=random_date(2000),
             status=random.choice(["active", "resolved"]),
             fhir_id=f"cond-{fake.uuid4()[:8]}"
-        )
-
-        # Patient Symptoms
-        for _ in range(random.randint(1, 4)):
-            insert_patient_symptom(
-                patient_id=p,
-                symptom_id=random.choice(symptoms),
+        ),
+        "symptoms": [
+            dict(
+                patient_id=patient_id,
+                symptom_id=random.choice(ref["symptoms"]),
                 noted_on=random_date(365)
             )
-
-        # Treatment
-        tr = random.choice(treatments)
-        insert_patient_treatment(
+            for _ in range(random.randint(1, 4))
+        ],
+        "treatment": dict(
             name=fake.word().capitalize(),
             description=fake.text(),
-            patient_id=p,
-            treatment_id=tr,
+            patient_id=patient_id,
+            treatment_id=random.choice(ref["treatments"]),
             doctor_id=doctor,
             start_date=random_date(300),
             end_date=random_date(200),
             notes=fake.text()
-            )
-
-
-        # Prescription
-        insert_prescription(
-            patient_id=p,
+        ),
+        "prescription": dict(
+            patient_id=patient_id,
             doctor_id=doctor,
-            medicine_id=random.choice(medicines),
+            medicine_id=random.choice(ref["medicines"]),
             dosage="1 tablet",
             frequency="Twice a day",
             duration="5 days",
             instructions="Take after meals",
             prescribed_on=appt_date
-        )
-
-        # Billing
-        amount = random.randint(500, 5000)
-        discount = amount * 0.10
-        tax = amount * 0.05
-
-        insert_billing(
-            patient_id=p,
+        ),
+        "billing": dict(
+            patient_id=patient_id,
             amount=amount,
             discount=discount,
             tax=tax,
             total_amount=amount - discount + tax,
             payment_status=random.choice(["paid", "pending"])
-        )
-
-        # Diagnostic Report
-        insert_diagnostic_report(
-            patient_id=p,
-            encounter_id=appt_id,
+        ),
+        "diagnostic_report": dict(
+            patient_id=patient_id,
             code=f"DX-{random.randint(100,999)}",
             conclusion=fake.sentence(),
             issued=appt_date,
             fhir_id=f"rep-{fake.uuid4()[:8]}"
-        )
-
-        # Document Reference
-        insert_document_reference(
-            patient_id=p,
-            encounter_id=appt_id,
+        ),
+        "document_reference": dict(
+            patient_id=patient_id,
             title="Nurse Notes",
             content=fake.text(),
             author=fake.name(),
             date=appt_date,
             fhir_id=f"doc-{fake.uuid4()[:8]}"
+        ),
+    }
+
+
+# --------------------------
+# REFERENCE DATA
+# --------------------------
+def create_reference_data(profile):
+    """Create doctors, diseases, symptoms, treatments, medicines and staff."""
+    ref = {}
+
+    print("Creating doctors...")
+    ref["doctors"] = insert_doctors_many(fake_doctor() for _ in range(profile["doctors"]))
+
+    # REAL diseases / symptoms are synced (not re-inserted), so repeated
+    # runs reuse the same rows and ids.
+    print("Syncing diseases and real symptoms...")
+    with transaction() as conn, conn.cursor() as cur:
+        ref["diseases"] = list(sync_diseases(cur).values())
+        ref["symptoms"] = list(sync_symptoms(cur).values())
+
+    print("Creating treatments...")
+    ref["treatments"] = insert_treatments_many(
+        dict(name=fake.word().capitalize(), description=fake.text())
+        for _ in range(profile["treatments"])
+    )
+
+    print("Creating medicines...")
+    ref["medicines"] = insert_medicines_many(
+        dict(
+            name=fake.word().capitalize(),
+            type=random.choice(["Tablet", "Syrup", "Injection", "Capsule"]),
+            description=fake.text()
         )
+        for _ in range(profile["medicines"])
+    )
+
+    print("Creating staff...")
+    roles = ["Nurse", "Receptionist", "Lab Technician", "Pharmacist", "Manager"]
+    insert_staff_many(
+        dict(
+            name=fake.name(),
+            role=random.choice(roles),
+            phone=fake.phone_number(),
+            email=fake.email()
+        )
+        for _ in range(profile["staff"])
+    )
+
+    return ref
+
+
+# --------------------------
+# ROW MODE: one INSERT per record
+# --------------------------
+def load_rows(num_patients, ref):
+    print("Creating patients, appointments & related records...")
+
+    for _ in range(num_patients):
+        # Everything generated for one patient commits (or rolls back) together
+        # on a single pooled connection.
+        with transaction():
+            p = insert_patient(**fake_patient())
+
+            for _ in range(random.randint(1, 3)):
+                visit = fake_visit(p, ref)
+
+                appt_id = insert_appointment(**visit["appointment"])
+                insert_patient_condition(**visit["condition"])
+                for ps in visit["symptoms"]:
+                    insert_patient_symptom(**ps)
+                insert_patient_treatment(**visit["treatment"])
+                insert_prescription(**visit["prescription"])
+                insert_billing(**visit["billing"])
+                insert_diagnostic_report(encounter_id=appt_id, **visit["diagnostic_report"])
+                insert_document_reference(encounter_id=appt_id, **visit["document_reference"])
+
+
+# --------------------------
+# COPY MODE: stream chunks through COPY ... FROM STDIN
+# --------------------------
+def load_copy(num_patients, ref, chunk_size=COPY_CHUNK_SIZE, label=""):
+    """
+    Generate patients in chunks of `chunk_size`. Patient and appointment ids
+    are reserved from their sequences up front so every child row can carry
+    its foreign keys, then each table is COPYed in FK order. One transaction
+    per chunk; only one chunk is ever held in memory.
+    """
+    print(f"{label}Streaming {num_patients} patients via COPY (chunks of {chunk_size})...")
+    done = 0
+
+    while done < num_patients:
+        n = min(chunk_size, num_patients - done)
+
+        with transaction() as conn, conn.cursor() as cur:
+            patients = []
+            visits = []
+            for patient_id in reserve_ids(cur, "patients", "patient_id", n):
+                patients.append(dict(patient_id=patient_id, **fake_patient()))
+                visits.extend(
+                    fake_visit(patient_id, ref) for _ in range(random.randint(1, 3))
+                )
+
+            appt_ids = reserve_ids(cur, "appointments", "appointment_id", len(visits))
+            for appt_id, visit in zip(appt_ids, visits):
+                visit["appointment"]["appointment_id"] = appt_id
+                visit["diagnostic_report"]["encounter_id"] = appt_id
+                visit["document_reference"]["encounter_id"] = appt_id
+
+            copy_rows(cur, "patients", PATIENT_COLUMNS, patients, id_column="patient_id")
+            copy_rows(
+                cur, "appointments", APPOINTMENT_COLUMNS,
+                (v["appointment"] for v in visits), id_column="appointment_id",
+            )
+            copy_rows(cur, "patient_conditions", PATIENT_CONDITION_COLUMNS, (v["condition"] for v in visits))
+            copy_rows(
+                cur, "patient_symptoms", PATIENT_SYMPTOM_COLUMNS,
+                (ps for v in visits for ps in v["symptoms"]),
+            )
+            copy_rows(cur, "patient_treatments", PATIENT_TREATMENT_COLUMNS, (v["treatment"] for v in visits))
+            copy_rows(cur, "prescriptions", PRESCRIPTION_COLUMNS, (v["prescription"] for v in visits))
+            copy_rows(cur, "billing", BILLING_COLUMNS, (v["billing"] for v in visits))
+            copy_rows(cur, "diagnostic_reports", DIAGNOSTIC_REPORT_COLUMNS, (v["diagnostic_report"] for v in visits))
+            copy_rows(cur, "document_references", DOCUMENT_REFERENCE_COLUMNS, (v["document_reference"] for v in visits))
+
+        done += n
+        print(f"{label}  {done}/{num_patients} patients loaded")
+
+
+# --------------------------
+# SHARDED GENERATION
+# --------------------------
+def _seed_shard(seed, shard_index, skew, as_of):
+    global SKEW, AS_OF
+    shard_seed = seed * 1_000_003 + shard_index
+    random.seed(shard_seed)
+    fake.seed_instance(shard_seed)
+    SKEW = skew
+    AS_OF = as_of
+
+
+def _load_shard(shard_index, num_patients, ref, opts):
+    """Worker entry point: generate and load one shard of patients."""
+    _seed_shard(opts["seed"], shard_index, opts["skew"], opts["as_of"])
+    label = f"[shard {shard_index}] "
+    if opts["mode"] == "copy":
+        load_copy(num_patients, ref, chunk_size=opts["chunk_size"], label=label)
+    else:
+        load_rows(num_patients, ref)
+    close_pool()
+    return num_patients
+
+
+def _shard_sizes(total, shards):
+    base, extra = divmod(total, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def load_sharded(num_patients, ref, opts):
+    """
+    Split patient generation into shards and run them on a process pool.
+    Shard i always uses seed (seed, i), so output is reproducible for a given
+    --seed/--shards/--as-of regardless of --workers or scheduling.
+    """
+    workers = max(1, opts["workers"])
+    shards = max(1, min(opts["shards"] or DEFAULT_SHARDS, num_patients))
+    sizes = _shard_sizes(num_patients, shards)
+
+    if workers == 1:
+        for i, n in enumerate(sizes):
+            _load_shard(i, n, ref, opts)
+        return
+
+    # Don't hand pooled connections to forked workers; each builds its own.
+    close_pool()
+    print(f"Loading {num_patients} patients in {shards} shards on {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_load_shard, i, n, ref, opts)
+            for i, n in enumerate(sizes)
+        ]
+        loaded = sum(f.result() for f in futures)
+    print(f"Loaded {loaded} patients.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic hospital data.")
+    parser.add_argument(
+        "--profile", choices=sorted(PROFILES), default="small",
+        help="scale profile; any --patients/--doctors/... flag overrides it",
+    )
+    parser.add_argument(
+        "--mode", choices=["rows", "copy"], default="rows",
+        help="rows: one INSERT per record; copy: stream chunks through COPY",
+    )
+    parser.add_argument("--patients", type=int)
+    parser.add_argument("--doctors", type=int)
+    parser.add_argument("--treatments", type=int)
+    parser.add_argument("--medicines", type=int)
+    parser.add_argument("--staff", type=int)
+    parser.add_argument(
+        "--skew", type=float,
+        help="Zipf exponent for doctor/disease/date choices (0 = uniform)",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="generator processes")
+    parser.add_argument("--shards", type=int, help=f"number of shards (default: {DEFAULT_SHARDS})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--as-of", type=datetime.fromisoformat,
+        help="anchor date for generated dates (default: now); fix it for reproducible runs",
+    )
+    parser.add_argument("--chunk-size", type=int, default=COPY_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    profile = dict(PROFILES[args.profile])
+    for key in ("patients", "doctors", "treatments", "medicines", "staff"):
+        if getattr(args, key) is not None:
+            profile[key] = getattr(args, key)
+    if args.skew is not None:
+        profile["skew"] = args.skew or None
+
+    opts = dict(
+        mode=args.mode,
+        seed=args.seed,
+        skew=profile["skew"],
+        as_of=args.as_of or datetime.now(),
+        workers=args.workers,
+        shards=args.shards,
+        chunk_size=args.chunk_size,
+    )
+
+    # Reference data is generated once, with uniform choices, from the base seed.
+    _seed_shard(args.seed, -1, None, opts["as_of"])
+    ref = create_reference_data(profile)
+
+    # Appointment dates go back a year; make sure those months have
+    # partitions (no-op when appointments is not partitioned).
+    ensure_partitions(
+        "appointments",
+        start=(opts["as_of"] - timedelta(days=365)).date(),
+        end=opts["as_of"].date(),
+    )
+
+    load_sharded(profile["patients"], ref, opts)
+
+    print("Refreshing summary views...")
+    try:
+        refresh_summary_views()
+    except Exception as e:
+        print(f"⚠️  Could not refresh summary views (run init_db.py first?): {e}")
+
+    print("\n🎉 Synthetic data generation completed successfully!")
 
 
-print("\n🎉 Synthetic data generation completed successfully!")
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,61 @@
+import asyncio
+import atexit
+import json
 import os
 import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from typing import Optional, List,Tuple
 import uuid
 import hashlib
 import base64
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from passlib.context import CryptContext
 from datetime import datetime
-import urllib.parse as urlparse
+
+import numpy as np
+import sqlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from sqlalchemy import create_engine, text as sql_text, Column, Integer, String, Text, DateTime
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import create_engine, select, text as sql_text, table as sql_table, column as sql_column, Column, Index, Integer, String, Text, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DataError, IntegrityError, ProgrammingError, SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_community.agent_toolkits.sql.base import create_sql_agent
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from langchain_community.utilities.sql_database import truncate_word
 from langchain_core.callbacks import BaseCallbackHandler
 
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_classic.chains import RetrievalQA
 
 from crewai import Agent as CrewAIAgent, Task, Crew
 from fastapi import FastAPI , HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from intent_classifier import IntentClassifier
+from ndb import SUMMARY_VIEWS, refresh_summary_views
+from rag_cache import CachedEmbeddings, file_sha256, load_pdf_pages
 
 
 load_dotenv()
@@ -56,47 +80,236 @@ class Settings(BaseModel):
         default=DEFAULT_DB_URI,
         description="SQLAlchemy/Postgres URI",
     )
+    pool_size: int = Field(default=5, description="Connections kept open per engine")
+    max_overflow: int = Field(default=10, description="Extra connections allowed under load")
+    pool_timeout: float = Field(default=30, description="Seconds to wait for a free connection")
+    pool_recycle: int = Field(default=1800, description="Reconnect connections older than this (s), -1 = never")
+    pool_pre_ping: bool = Field(default=True, description="Test connections on checkout")
 
 
 def get_settings() -> Settings:
     uri = os.getenv("DB_URI") or DEFAULT_DB_URI
-    return Settings(db_uri=uri)
+    return Settings(
+        db_uri=uri,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    )
 
 
 def get_db() -> SQLDatabase:
-    settings = get_settings()
-    db = SQLDatabase.from_uri(settings.db_uri)
-    return db
+    # Reuse the process-wide engine instead of letting from_uri() build a new one.
+    # view_support so the summary views (ndb.SUMMARY_VIEWS) are visible too
+    return SQLDatabase(get_sql_engine(), view_support=True)
+
+
+# Every connection in this module comes from one of two pools per process:
+# the sync engine (ORM, Text2SQL, psycopg2 endpoints) and the asyncpg engine
+# (async /chat path). Both record how long callers wait for a connection.
+class _PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool) -> None:
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_max * 1000, 3),
+            }
+
+
+# Keyed by pool name rather than stored on the pool: engine.dispose()
+# replaces the pool object, the counters should survive that.
+_pool_stats = {"sync": _PoolStats(), "async": _PoolStats()}
+
+
+class _MeteredPoolMixin:
+    stats_name = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            _pool_stats[self.stats_name].record(time.perf_counter() - start, timed_out=True)
+            raise
+        _pool_stats[self.stats_name].record(time.perf_counter() - start, timed_out=False)
+        return conn
+
+
+class _MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    stats_name = "sync"
+
+
+class _MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    stats_name = "async"
+
+
+def _pool_kwargs(settings: Settings) -> dict:
+    return dict(
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+        pool_pre_ping=settings.pool_pre_ping,
+    )
+
 
 _sql_engine = None  # global cache for SQLAlchemy Engine
 
 
 def get_sql_engine():
-    """Get or create a singleton SQLAlchemy engine using the same DB URI."""
+    """Get or create the process-wide pooled SQLAlchemy engine."""
     global _sql_engine
     if _sql_engine is None:
         settings = get_settings()
-        _sql_engine = create_engine(settings.db_uri)
+        _sql_engine = create_engine(
+            settings.db_uri, poolclass=_MeteredQueuePool, **_pool_kwargs(settings)
+        )
     return _sql_engine
 
 
-# 🔽🔽🔽 PASTE THIS BLOCK HERE 🔽🔽🔽
+_async_engine = None  # global cache for the asyncpg-backed AsyncEngine
+
+
+def get_async_engine():
+    """
+    Get or create a singleton async SQLAlchemy engine (asyncpg driver) for
+    the same database, used by the async /chat path.
+    """
+    global _async_engine
+    if _async_engine is None:
+        settings = get_settings()
+        url = make_url(settings.db_uri).set(drivername="postgresql+asyncpg")
+        _async_engine = create_async_engine(
+            url, poolclass=_MeteredAsyncQueuePool, **_pool_kwargs(settings)
+        )
+    return _async_engine
+
+
+def _pool_status(pool) -> dict:
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
+
+def get_pool_metrics() -> dict:
+    """Current pool occupancy plus checkout wait stats for both engines."""
+    metrics = {}
+    if _sql_engine is not None:
+        metrics["sync"] = {**_pool_status(_sql_engine.pool), **_pool_stats["sync"].snapshot()}
+    if _async_engine is not None:
+        metrics["async"] = {**_pool_status(_async_engine.sync_engine.pool), **_pool_stats["async"].snapshot()}
+    return metrics
+
+
+class _PooledPgConnection:
+    """
+    A pooled DBAPI connection that behaves like the old dedicated one:
+    cursors default to RealDictCursor, close() hands it back to the pool.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", RealDictCursor)
+        return self._raw.cursor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
 
 def get_pg_connection():
     """
     Low-level psycopg2 connection used for auth/search history endpoints.
-    Uses the same DB_URI / DEFAULT_DB_URI as SQLAlchemy.
-    """
-    db_url = os.getenv("DB_URI") or DEFAULT_DB_URI
-    url = urlparse.urlparse(db_url)
-    return psycopg2.connect(
-        database=url.path[1:],          # strip leading '/'
-        user=url.username,
-        password=url.password,
-        host=url.hostname,
-        port=url.port,
-        cursor_factory=RealDictCursor,
-    )
+    Checked out of the shared engine's pool; close() returns it.
+    """
+    return _PooledPgConnection(get_sql_engine().raw_connection())
+
+
+# --------------------------------------------------------------------
+# IN-PROCESS CACHES
+# --------------------------------------------------------------------
+_MISSING = object()
+
+
+class _TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after they
+    were written. max_size <= 0 disables it (every get misses).
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value) -> None:
+        self._store(key, value, overwrite=True)
+
+    def add(self, key, value) -> None:
+        """Store only if no live entry exists (for filling from a slower read)."""
+        self._store(key, value, overwrite=False)
+
+    def _store(self, key, value, overwrite: bool) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            entry = self._data.get(key)
+            if not overwrite and entry is not None and entry[0] > time.monotonic():
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
 
 
 # Password hashing context (bcrypt)
@@ -151,6 +364,9 @@ class ChatMessage(Base):
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, server_default=sql_text("CURRENT_TIMESTAMP"))
 
+    # Serves "last N messages of a chat" (ORDER BY id DESC LIMIT N).
+    __table_args__ = (Index("ix_chat_messages_chat_id_id", "chat_id", "id"),)
+
 # Insert this definition near the top of hospital_backend.py,
 # right after your other Pydantic models (e.g., ChatResponse)
 
@@ -175,42 +391,175 @@ def init_chat_history_tables():
     """
     engine = get_sql_engine()
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add newer indexes explicitly.
+    for index in ChatMessage.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+
+def _context_dict(last_entity_type, last_sql_query, last_patient_ids) -> dict:
+    ids = last_patient_ids.split(",") if last_patient_ids else []
+    ids = [i for i in ids if i]
+    return {
+        "last_entity_type": last_entity_type,
+        "last_sql_query": last_sql_query,
+        "last_patient_ids": ids,
+    }
+
+
+def _merge_history(pending: List[dict], stored, limit: int) -> List[dict]:
+    """
+    Append queued-but-unwritten messages to the stored ones. A queued row
+    may have been committed while we were reading; created_at is set by us,
+    so (role, content, created_at) identifies it in the stored rows.
+    """
+    seen = {(m.role, m.content, m.created_at) for m in stored}
+    msgs = [{"role": m.role, "content": m.content} for m in stored]
+    for r in pending:
+        key = (r["role"], r["content"], r["created_at"])
+        if key not in seen:
+            seen.add(key)
+            msgs.append({"role": r["role"], "content": r["content"]})
+    return msgs[-limit:]
+
+
+# In-process ring buffer of the last CHAT_HISTORY_BUFFER_SIZE messages per
+# chat, for the CHAT_HISTORY_BUFFER_CHATS most recently used chats. It is
+# filled from the database on the first read of a chat and kept current by
+# save_chat_turn, so later turns read history without touching Postgres.
+# This assumes a chat's requests reach the same process (one worker or
+# sticky sessions); set CHAT_HISTORY_BUFFER_CHATS=0 otherwise.
+CHAT_HISTORY_BUFFER_SIZE = int(os.getenv("CHAT_HISTORY_BUFFER_SIZE", "20"))
+CHAT_HISTORY_BUFFER_CHATS = int(os.getenv("CHAT_HISTORY_BUFFER_CHATS", "1000"))
+
+
+class _RecentMessages:
+    def __init__(self, size: int, max_chats: int):
+        self.size = size
+        self.max_chats = max_chats
+        # Held by save_chat_turn around enqueue + append, and by readers
+        # around their final pending snapshot + put, so no turn slips
+        # between a chat being loaded and being buffered.
+        self.lock = threading.RLock()
+        self._chats: "OrderedDict[str, deque]" = OrderedDict()
+
+    def get(self, chat_id: str, limit: int) -> Optional[List[dict]]:
+        if limit > self.size:
+            return None
+        with self.lock:
+            buf = self._chats.get(chat_id)
+            if buf is None:
+                return None
+            self._chats.move_to_end(chat_id)
+            return list(buf)[-limit:]
+
+    def put(self, chat_id: str, messages: List[dict]) -> None:
+        if self.max_chats <= 0:
+            return
+        with self.lock:
+            self._chats[chat_id] = deque(messages, maxlen=self.size)
+            self._chats.move_to_end(chat_id)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+
+    def append(self, chat_id: str, messages: List[dict]) -> None:
+        """Add messages to a chat already in the buffer (others load on next read)."""
+        with self.lock:
+            buf = self._chats.get(chat_id)
+            if buf is not None:
+                buf.extend(messages)
+
+
+recent_messages = _RecentMessages(CHAT_HISTORY_BUFFER_SIZE, CHAT_HISTORY_BUFFER_CHATS)
+
+
+def _buffer_history(chat_id: str, pending: List[dict], stored, limit: int) -> List[dict]:
+    """Merge a database read with queued rows, buffer it, return the last `limit`."""
+    with recent_messages.lock:
+        # Turns queued while we were reading are only in this second snapshot.
+        pending = pending + chat_writer.pending("message", chat_id)
+        msgs = _merge_history(pending, stored, max(limit, recent_messages.size))
+        recent_messages.put(chat_id, msgs)
+    return msgs[-limit:]
 
 
 def get_chat_history(chat_id: str, limit: int = 10) -> List[dict]:
     """
     Return the last `limit` messages for this chat_id as:
       [{"role": "user"|"assistant", "content": "..."}]
+    Includes messages still waiting in the write-behind queue.
     """
+    cached = recent_messages.get(chat_id, limit)
+    if cached is not None:
+        return cached
+
+    pending = chat_writer.pending("message", chat_id)
     session = SessionLocal()
     try:
-        q = (
+        msgs = (
             session.query(ChatMessage)
             .filter(ChatMessage.chat_id == chat_id)
-            .order_by(ChatMessage.id.asc())
+            .order_by(ChatMessage.id.desc())
+            .limit(max(limit, recent_messages.size))
+            .all()
         )
-        msgs = q.all()
-        msgs = msgs[-limit:]
-        return [{"role": m.role, "content": m.content} for m in msgs]
     finally:
         session.close()
+    return _buffer_history(chat_id, pending, msgs[::-1], limit)
+
+
+def _chat_turn_rows(chat_id: str, user_q: str, answer: str) -> List[dict]:
+    now = datetime.now()
+    return [
+        dict(chat_id=chat_id, role="user", content=user_q, created_at=now),
+        dict(chat_id=chat_id, role="assistant", content=answer, created_at=now),
+    ]
 
 
 def save_chat_turn(chat_id: str, user_q: str, answer: str) -> None:
-    """Save one user → assistant turn into chat_messages."""
-    session = SessionLocal()
-    try:
-        session.add(ChatMessage(chat_id=chat_id, role="user", content=user_q))
-        session.add(ChatMessage(chat_id=chat_id, role="assistant", content=answer))
-        session.commit()
-    finally:
-        session.close()
+    """Queue one user → assistant turn for chat_messages."""
+    rows = _chat_turn_rows(chat_id, user_q, answer)
+    with recent_messages.lock:
+        chat_writer.enqueue("message", rows)
+        recent_messages.append(chat_id, [{"role": r["role"], "content": r["content"]} for r in rows])
+
+
+# Write-through cache of chat_context rows (as _context_dict results, {}
+# for chats without one). update_last_context writes it before queueing
+# the upsert; the TTL bounds staleness when several workers share a chat.
+CHAT_CONTEXT_CACHE_SIZE = int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", "1000"))
+CHAT_CONTEXT_CACHE_TTL = float(os.getenv("CHAT_CONTEXT_CACHE_TTL", "300"))
+
+context_cache = _TTLCache(CHAT_CONTEXT_CACHE_SIZE, CHAT_CONTEXT_CACHE_TTL)
+
+
+def _cached_context(chat_id: str) -> Optional[dict]:
+    """Context from the cache or the write-behind queue, None if neither has it."""
+    ctx = context_cache.get(chat_id)
+    if ctx is not None:
+        return ctx
+    pending = chat_writer.pending("context", chat_id)
+    if pending:
+        row = pending[-1]
+        return _context_dict(row["last_entity_type"], row["last_sql_query"], row["last_patient_ids"])
+    return None
+
+
+def _stored_context(chat_id: str, ctx) -> dict:
+    result = _context_dict(ctx.last_entity_type, ctx.last_sql_query, ctx.last_patient_ids) if ctx else {}
+    # add(), not set(): an update that landed while we were reading wins.
+    context_cache.add(chat_id, result)
+    return result
 
 
 def get_last_context(chat_id: str) -> dict:
     """
     Return last context dict for this chat_id, or {} if nothing stored.
+    Served from context_cache when possible.
     """
+    cached = _cached_context(chat_id)
+    if cached is not None:
+        return cached
+
     session = SessionLocal()
     try:
         ctx = (
@@ -218,19 +567,20 @@ def get_last_context(chat_id: str) -> dict:
             .filter(ChatContext.chat_id == chat_id)
             .first()
         )
-        if not ctx:
-            return {}
-        ids = ctx.last_patient_ids.split(",") if ctx.last_patient_ids else []
-        ids = [i for i in ids if i]
-        return {
-            "last_entity_type": ctx.last_entity_type,
-            "last_sql_query": ctx.last_sql_query,
-            "last_patient_ids": ids,
-        }
+        return _stored_context(chat_id, ctx)
     finally:
         session.close()
 
 
+def _context_row(chat_id, entity_type, sql_query, patient_ids) -> dict:
+    return dict(
+        chat_id=chat_id,
+        last_entity_type=entity_type,
+        last_sql_query=sql_query,
+        last_patient_ids=",".join(str(p) for p in (patient_ids or [])),
+    )
+
+
 def update_last_context(
     chat_id: str,
     *,
@@ -239,31 +589,418 @@ def update_last_context(
     patient_ids: Optional[List[int]],
 ) -> None:
     """
-    Upsert row in chat_context for this chat_id.
+    Update context_cache and queue the chat_context upsert
+    (INSERT ... ON CONFLICT (chat_id) DO UPDATE, see ChatWriteBehind).
     """
-    session = SessionLocal()
-    try:
-        ctx = (
-            session.query(ChatContext)
-            .filter(ChatContext.chat_id == chat_id)
-            .first()
+    row = _context_row(chat_id, entity_type, sql_query, patient_ids)
+    context_cache.set(
+        chat_id, _context_dict(row["last_entity_type"], row["last_sql_query"], row["last_patient_ids"])
+    )
+    chat_writer.enqueue("context", [row])
+
+
+# Async twins of the chat history helpers above. Reads go through the
+# asyncpg engine; writes only enqueue, so they never wait on the database.
+_async_session_factory = None
+
+
+def AsyncSessionLocal():
+    global _async_session_factory
+    if _async_session_factory is None:
+        _async_session_factory = async_sessionmaker(
+            bind=get_async_engine(), expire_on_commit=False
+        )
+    return _async_session_factory()
+
+
+async def get_chat_history_async(chat_id: str, limit: int = 10) -> List[dict]:
+    cached = recent_messages.get(chat_id, limit)
+    if cached is not None:
+        return cached
+
+    pending = chat_writer.pending("message", chat_id)
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(ChatMessage)
+            .where(ChatMessage.chat_id == chat_id)
+            .order_by(ChatMessage.id.desc())
+            .limit(max(limit, recent_messages.size))
+        )
+        msgs = result.scalars().all()
+    return _buffer_history(chat_id, pending, msgs[::-1], limit)
+
+
+async def save_chat_turn_async(chat_id: str, user_q: str, answer: str) -> None:
+    save_chat_turn(chat_id, user_q, answer)
+
+
+async def get_last_context_async(chat_id: str) -> dict:
+    cached = _cached_context(chat_id)
+    if cached is not None:
+        return cached
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(ChatContext).where(ChatContext.chat_id == chat_id)
         )
-        ids_str = ",".join(str(p) for p in (patient_ids or []))
-        if ctx is None:
-            ctx = ChatContext(
-                chat_id=chat_id,
-                last_entity_type=entity_type,
-                last_sql_query=sql_query,
-                last_patient_ids=ids_str,
+        return _stored_context(chat_id, result.scalars().first())
+
+
+async def update_last_context_async(
+    chat_id: str,
+    *,
+    entity_type: Optional[str],
+    sql_query: Optional[str],
+    patient_ids: Optional[List[int]],
+) -> None:
+    update_last_context(chat_id, entity_type=entity_type, sql_query=sql_query, patient_ids=patient_ids)
+
+
+chat_history_table = sql_table(
+    "chat_history",
+    sql_column("chat_id"),
+    sql_column("user_email"),
+    sql_column("sender"),
+    sql_column("message"),
+    sql_column("route"),
+    sql_column("timestamp"),
+    sql_column("username"),
+)
+
+
+def _chat_history_rows(chat_id, user_email, name, user_message, bot_reply, route) -> List[dict]:
+    """The user + bot rows /chat logs into chat_history for one turn."""
+    # chat_history.chat_id is numeric (the UI sends Date.now()); pass digits
+    # as an int so the insert doesn't depend on server-side casting.
+    cid = int(chat_id) if str(chat_id).isdigit() else chat_id
+    base = dict(chat_id=cid, user_email=user_email, route=route, username=name)
+    return [
+        dict(base, sender="user", message=user_message, timestamp=datetime.now()),
+        dict(base, sender="bot", message=bot_reply, timestamp=datetime.now()),
+    ]
+
+
+async def save_chat_history_rows_async(rows: List[dict]) -> None:
+    chat_writer.enqueue("history", rows)
+
+
+# --------------------------------------------------------------------
+# WRITE-BEHIND QUEUE FOR CHAT PERSISTENCE
+# --------------------------------------------------------------------
+# Chat turns (chat_messages), the follow-up context (chat_context) and the
+# UI log (chat_history) are queued here instead of written on the request
+# path. A background thread flushes every CHAT_WRITE_FLUSH_SECONDS or
+# CHAT_WRITE_BATCH_SIZE rows, whichever comes first, with one transaction
+# per table: a multi-row INSERT for messages and history, and a single
+# ON CONFLICT upsert for the contexts (last one per chat_id wins).
+# If a table's batch is rejected for its data (IntegrityError/DataError),
+# its rows are retried one by one so a bad row only costs itself; rows
+# that still fail go to the CHAT_WRITE_DEAD_LETTER_PATH file. Rows that
+# fail for any other reason (database down, pool timeout) are appended to
+# a JSONL spool file. The spool is replayed on start and ahead of every
+# later batch, in one write with it, so rows land in the order they were
+# queued. Whatever is queued at shutdown is flushed.
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "200"))
+CHAT_WRITE_FLUSH_SECONDS = float(os.getenv("CHAT_WRITE_FLUSH_SECONDS", "0.5"))
+CHAT_WRITE_SPOOL_PATH = os.getenv("CHAT_WRITE_SPOOL_PATH", "chat_write_spool.jsonl")
+CHAT_WRITE_DEAD_LETTER_PATH = os.getenv("CHAT_WRITE_DEAD_LETTER_PATH", "chat_write_dead_letter.jsonl")
+
+
+def _spool_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot spool {type(value).__name__}")
+
+
+def _spool_object_hook(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class ChatWriteBehind:
+    def __init__(self, batch_size: int, flush_seconds: float, spool_path: str, dead_letter_path: str):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[str, dict]] = []  # (kind, row), oldest first
+        self._in_flight: List[Tuple[str, dict]] = []  # batch the writer thread is writing
+        self._enqueued = 0
+        self._handled = 0  # rows written or spooled
+        self._flush_requested = False
+        self._stopping = False
+        self._thread = None
+
+    # ---- producer side ----
+    def enqueue(self, kind: str, rows: List[dict]) -> None:
+        self.start()
+        with self._cond:
+            self._pending.extend((kind, row) for row in rows)
+            self._enqueued += len(rows)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def pending(self, kind: str, chat_id) -> List[dict]:
+        """Queued rows of one kind for one chat, oldest first."""
+        with self._cond:
+            return [
+                row
+                for k, row in self._in_flight + self._pending
+                if k == kind and row["chat_id"] == chat_id
+            ]
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is written (or spooled)."""
+        with self._cond:
+            if self._thread is None:
+                batch, self._pending = self._pending, []
+            else:
+                target = self._enqueued
+                self._flush_requested = True
+                self._cond.notify_all()
+                return self._cond.wait_for(
+                    lambda: self._handled >= target or self._thread is None, timeout
+                ) and self._handled >= target
+        if batch:
+            self._write_safely(batch)
+        return True
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """Flush what is queued and stop the writer thread."""
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._cond:
+            self._thread = None
+            # The in-flight batch isn't in _pending: if the writer is still
+            # on it, it writes or spools it itself, so it is never doubled.
+            leftover, self._pending = self._pending, []
+        if leftover:
+            # Writer didn't finish in time; keep the rows for the next start.
+            self._spool(leftover)
+
+    # ---- writer thread ----
+    def _run(self):
+        try:
+            self._write_safely([])  # replay what an earlier run spooled
+            while self._run_once():
+                pass
+        except Exception as e:
+            print(f"[ChatWriteBehind] Writer thread crashed: {e}")
+        finally:
+            with self._cond:
+                self._in_flight = []
+                if self._thread is threading.current_thread():
+                    # Lets the next enqueue() start a fresh writer.
+                    self._thread = None
+                self._cond.notify_all()
+
+    def _run_once(self) -> bool:
+        """Write one batch; False once stopping with nothing left."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._stopping
+                or self._flush_requested
+                or len(self._pending) >= self.batch_size,
+                timeout=self.flush_seconds,
             )
-            session.add(ctx)
-        else:
-            ctx.last_entity_type = entity_type
-            ctx.last_sql_query = sql_query
-            ctx.last_patient_ids = ids_str
-        session.commit()
-    finally:
-        session.close()
+            batch = self._pending[: self.batch_size]
+            del self._pending[: len(batch)]
+            self._in_flight = batch
+            stopping = self._stopping
+        if not batch:
+            return not stopping
+
+        self._write_safely(batch)
+        with self._cond:
+            self._in_flight = []
+            self._handled += len(batch)
+            if not self._pending:
+                self._flush_requested = False
+            self._cond.notify_all()
+        return True
+
+    def _write_batch(self, batch) -> None:
+        """
+        Write a batch, spooling whatever can't be written now. If a spool
+        exists its rows go in ahead of the batch, so an older message can't
+        land after a newer one and an older context can't overwrite a newer
+        one.
+        """
+        if not os.path.exists(self.spool_path):
+            if batch:
+                self._write_or_spool(batch)
+            return
+        # Held across the write so another worker process can't replay the
+        # same file; rows are only dropped from it once written (or
+        # dead-lettered), the rest stay for the next replay.
+        with _file_lock(self.spool_path):
+            spooled = self._read_spool() if os.path.exists(self.spool_path) else []
+            rows = spooled + list(batch)
+            retry = self._write(rows) if rows else []
+            # Rewritten in place: _spool() would wait on the lock we hold.
+            self._rewrite_spool(retry)
+            if retry:
+                print(f"[ChatWriteBehind] {len(retry)} of {len(rows)} rows not written, left in {self.spool_path}")
+            elif spooled:
+                print(f"[ChatWriteBehind] Replayed {len(spooled)} spooled rows")
+
+    def _write_safely(self, batch) -> None:
+        # Anything _write() doesn't handle itself (spool lock, unreadable
+        # spool file) must not take the writer thread down with it.
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            print(f"[ChatWriteBehind] Writing {len(batch)} rows failed: {e}")
+            if batch:
+                self._spool(batch)
+
+    def _write_or_spool(self, batch) -> None:
+        retry = self._write(batch)
+        if retry:
+            print(f"[ChatWriteBehind] {len(retry)} of {len(batch)} rows not written, spooling to {self.spool_path}")
+            self._spool(retry)
+
+    def _write(self, batch) -> List[Tuple[str, dict]]:
+        """
+        Write a batch, one transaction per kind. Returns the rows to retry
+        later; rows the database rejects for their data are dead-lettered.
+        """
+        contexts = {}
+        for kind, row in batch:
+            if kind == "context":
+                contexts[row["chat_id"]] = row
+        groups = [
+            ("message", [row for kind, row in batch if kind == "message"]),
+            ("context", list(contexts.values())),
+            ("history", [row for kind, row in batch if kind == "history"]),
+        ]
+
+        retry = []
+        for kind, rows in groups:
+            if not rows:
+                continue
+            try:
+                self._write_rows(kind, rows)
+            except (IntegrityError, DataError) as e:
+                print(f"[ChatWriteBehind] {kind} batch rejected, writing rows one by one: {e}")
+                retry.extend(self._write_each(kind, rows))
+            except Exception as e:
+                print(f"[ChatWriteBehind] Writing {len(rows)} {kind} rows failed: {e}")
+                retry.extend((kind, row) for row in rows)
+        return retry
+
+    def _write_each(self, kind: str, rows: List[dict]) -> List[Tuple[str, dict]]:
+        retry, dead = [], []
+        for row in rows:
+            try:
+                self._write_rows(kind, [row])
+            except (IntegrityError, DataError) as e:
+                dead.append([kind, row, str(e)])
+            except Exception:
+                retry.append((kind, row))
+        if dead:
+            print(f"[ChatWriteBehind] {len(dead)} {kind} rows rejected, moved to {self.dead_letter_path}")
+            self._dead_letter(dead)
+        return retry
+
+    def _dead_letter(self, entries) -> None:
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                _write_jsonl(f, entries)
+        except Exception as e:
+            print(f"[ChatWriteBehind] Could not dead-letter {len(entries)} rows, they are lost: {e}")
+
+    @staticmethod
+    def _write_rows(kind: str, rows: List[dict]) -> None:
+        with get_sql_engine().begin() as conn:
+            if kind == "message":
+                conn.execute(ChatMessage.__table__.insert(), rows)
+            elif kind == "context":
+                stmt = pg_insert(ChatContext.__table__).values(rows)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["chat_id"],
+                    set_={
+                        c: stmt.excluded[c]
+                        for c in ("last_entity_type", "last_sql_query", "last_patient_ids")
+                    },
+                )
+                conn.execute(stmt)
+            else:
+                conn.execute(chat_history_table.insert(), rows)
+
+    # ---- spool file ----
+    def _spool(self, batch) -> None:
+        try:
+            with _file_lock(self.spool_path), open(self.spool_path, "a", encoding="utf-8") as f:
+                _write_jsonl(f, batch)
+        except Exception as e:
+            print(f"[ChatWriteBehind] Could not spool {len(batch)} rows, they are lost: {e}")
+
+    def _read_spool(self) -> List[Tuple[str, dict]]:
+        """Spooled rows, oldest first. Lines that don't parse (e.g. a write
+        cut short by a crash) are dead-lettered as ("unparsed", line)."""
+        rows, bad = [], []
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    kind, row = json.loads(line, object_hook=_spool_object_hook)
+                except ValueError as e:
+                    bad.append(["unparsed", line.rstrip("\n"), str(e)])
+                    continue
+                rows.append((kind, row))
+        if bad:
+            print(f"[ChatWriteBehind] {len(bad)} spool lines unreadable, moved to {self.dead_letter_path}")
+            self._dead_letter(bad)
+        return rows
+
+    def _rewrite_spool(self, rows) -> None:
+        # Caller holds the spool lock.
+        if rows:
+            with open(self.spool_path, "w", encoding="utf-8") as f:
+                _write_jsonl(f, rows)
+        elif os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+def _write_jsonl(f, entries) -> None:
+    for entry in entries:
+        f.write(json.dumps(list(entry), default=_spool_default) + "\n")
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive lock on <path>.lock (no-op where fcntl isn't available)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+chat_writer = ChatWriteBehind(
+    CHAT_WRITE_BATCH_SIZE, CHAT_WRITE_FLUSH_SECONDS, CHAT_WRITE_SPOOL_PATH, CHAT_WRITE_DEAD_LETTER_PATH
+)
+atexit.register(chat_writer.stop)
 
 
 def infer_entity_and_ids(
@@ -303,68 +1040,31 @@ def infer_entity_and_ids(
     return entity_type, ids
 
 
+def _is_select(sql_query: Optional[str]) -> bool:
+    return bool(sql_query) and sql_query.strip().lower().startswith("select")
 
-# def build_table_from_sql(sql_query: str):
-#     """
-#     Execute a SELECT SQL query and convert the result into
-#     { "columns": [...], "values": [[...], ...] }.
-#     Returns None if SQL is empty / not SELECT / execution fails.
-#     """
-#     if not sql_query:
-#         return None
-
-#     normalized = sql_query.strip().lower()
-#     if not normalized.startswith("select"):
-#         # We only build table data for SELECT queries
-#         return None
-
-#     try:
-#         engine = get_sql_engine()
-#         with engine.connect() as conn:
-#             result = conn.execute(sql_text(sql_query))
-#             rows = result.fetchall()
-#             columns = list(result.keys())
-#     except SQLAlchemyError as e:
-#         print(f"[FastAPI/Text2SQL] Error executing SQL for table data: {e}")
-#         return None
-#     except Exception as e:
-#         print(f"[FastAPI/Text2SQL] Unexpected error executing SQL for table data: {e}")
-#         return None
-
-#     # Convert every row to a list of strings so JSON is clean
-#     values = [[str(cell) for cell in row] for row in rows]
-#     return {"columns": columns, "values": values}
-
-
-def build_table_from_sql(sql_query: str):
-    """
-    Execute a SELECT SQL query and convert result to proper structured table:
-    {
-        "columns": [...],
-        "values": [...]
-    }
+
+def run_select(sql_query: str):
+    """Execute a query on the shared engine; returns (columns, rows), raises on error."""
+    with get_sql_engine().connect() as conn:
+        result = conn.execute(sql_text(sql_query))
+        return list(result.keys()), result.fetchall()
+
+
+async def run_select_async(sql_query: str):
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(sql_text(sql_query))
+        return list(result.keys()), result.fetchall()
+
+
+def _rows_to_table(columns, rows):
+    """
+    Turn a result set into the {"columns", "values"} dict the UI renders.
     Also auto-splits single-column rows like:
         "Christopher Cain - 2020-02-06"
     into:
         ["Christopher Cain", "2020-02-06"]
     """
-    if not sql_query:
-        return None
-
-    normalized = sql_query.strip().lower()
-    if not normalized.startswith("select"):
-        return None
-
-    try:
-        engine = get_sql_engine()
-        with engine.connect() as conn:
-            result = conn.execute(sql_text(sql_query))
-            rows = result.fetchall()
-            columns = list(result.keys())
-    except Exception as e:
-        print("[FastAPI/Text2SQL] Error executing SQL:", e)
-        return None
-
     # ----------- CASE 1: Proper SQL table returned -----------
     if len(columns) > 1:
         # Convert rows normally
@@ -405,15 +1105,17 @@ def build_table_from_sql(sql_query: str):
     return None
 
 
-def get_llm() -> ChatOpenAI:
+def get_llm(streaming: bool = False) -> ChatOpenAI:
     """
     Create ChatOpenAI LLM for both Text2SQL and Intent Agent.
+    streaming=True makes the model emit tokens to astream_events callers
+    (invoke() still returns the whole message).
     """
     model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     return ChatOpenAI(
         model=model_name,
         temperature=0,
-        streaming=False,
+        streaming=streaming,
     )
 
 
@@ -423,21 +1125,183 @@ class SQLQueryResult(BaseModel):
     final_answer: str
 
 
-def build_text2sql_agent():
-    db = get_db()
-    llm = get_llm()
+# --------------------------
+# SCHEMA SNAPSHOT (inlined into the Text2SQL prompt)
+# --------------------------
+# The schema is read from pg_catalog once and written into the agent prompt,
+# so the agent can go straight to sql_db_query instead of calling
+# sql_db_list_tables / sql_db_schema on every question. A fingerprint of
+# the columns and keys is re-checked every SCHEMA_CHECK_SECONDS; when it
+# changes, the snapshot and the agents are rebuilt.
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "3"))
+SCHEMA_SAMPLE_MAX_CHARS = 40
+SCHEMA_CHECK_SECONDS = int(os.getenv("SCHEMA_CHECK_SECONDS", "60"))
+# App bookkeeping tables the agent has no business querying.
+SCHEMA_EXCLUDE_TABLES = {
+    t.strip()
+    for t in os.getenv(
+        "SCHEMA_EXCLUDE_TABLES", "user_login,chat_history,chat_messages,chat_context"
+    ).split(",")
+    if t.strip()
+}
+
+_SCHEMA_COLUMNS_SQL = """
+SELECT c.relname, c.relkind, a.attname, format_type(a.atttypid, a.atttypmod)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid
+WHERE n.nspname = 'public'
+  AND c.relkind IN ('r', 'p', 'v', 'm')
+  AND NOT c.relispartition
+  AND a.attnum > 0
+  AND NOT a.attisdropped
+ORDER BY c.relname, a.attnum
+"""
+
+_SCHEMA_KEYS_SQL = """
+SELECT con.contype, c.relname, a.attname, rc.relname, ra.attname
+FROM pg_constraint con
+JOIN pg_class c ON c.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL unnest(con.conkey, COALESCE(con.confkey, con.conkey)) AS k(attnum, refnum)
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+LEFT JOIN pg_class rc ON rc.oid = con.confrelid
+LEFT JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.refnum
+WHERE n.nspname = 'public'
+  AND con.contype IN ('p', 'f')
+  AND NOT c.relispartition
+ORDER BY c.relname, con.conname, a.attname
+"""
+
+_SAMPLE_TYPES = ("character", "text")
 
-    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+_schema_lock = threading.Lock()
+_schema_snapshot = {"fingerprint": None, "summary": None, "built_at": None}
 
-    sql_prefix = """
+
+def _read_schema_catalog(conn):
+    """(columns, keys) rows for the public schema, minus excluded tables."""
+    columns = [
+        tuple(r) for r in conn.execute(sql_text(_SCHEMA_COLUMNS_SQL))
+        if r[0] not in SCHEMA_EXCLUDE_TABLES
+    ]
+    keys = [
+        tuple(r) for r in conn.execute(sql_text(_SCHEMA_KEYS_SQL))
+        if r[1] not in SCHEMA_EXCLUDE_TABLES
+    ]
+    return columns, keys
+
+
+def _schema_fingerprint(columns, keys) -> str:
+    return hashlib.sha256(repr((columns, keys)).encode("utf-8")).hexdigest()
+
+
+def _sample_values(conn, table: str, column_names: List[str]) -> dict:
+    """{column: [a few distinct non-null values]} from the first rows of `table`."""
+    if not column_names or SCHEMA_SAMPLE_ROWS <= 0:
+        return {}
+    quote = conn.dialect.identifier_preparer.quote
+    rows = conn.execute(sql_text(
+        f"SELECT {', '.join(quote(c) for c in column_names)} FROM {quote(table)} "
+        f"LIMIT {SCHEMA_SAMPLE_ROWS * 4}"
+    )).fetchall()
+    samples = {}
+    for i, name in enumerate(column_names):
+        values = []
+        for row in rows:
+            value = row[i]
+            if value is None:
+                continue
+            # create_sql_agent runs the prompt through str.format(), so no braces.
+            value = str(value).replace("{", "(").replace("}", ")").replace("\n", " ")
+            value = value[:SCHEMA_SAMPLE_MAX_CHARS]
+            if value not in values:
+                values.append(value)
+            if len(values) == SCHEMA_SAMPLE_ROWS:
+                break
+        if values:
+            samples[name] = values
+    return samples
+
+
+def _format_schema(conn, columns, keys) -> str:
+    """
+    One line per table/view, e.g.
+      appointments: appointment_id integer PK, patient_id integer -> patients.patient_id,
+                    status character varying e.g. 'finished', 'planned', ...
+    """
+    tables = OrderedDict()
+    kinds = {}
+    for table, kind, column, type_name in columns:
+        tables.setdefault(table, []).append((column, type_name))
+        kinds[table] = kind
+    primary = {(t, c) for kind, t, c, _, _ in keys if kind == "p"}
+    foreign = {(t, c): f"{rt}.{rc}" for kind, t, c, rt, rc in keys if kind == "f"}
+
+    lines = []
+    for table, cols in tables.items():
+        samples = {}
+        if kinds[table] != "v":  # views may be arbitrarily expensive to read
+            text_cols = [c for c, type_name in cols if type_name.startswith(_SAMPLE_TYPES)]
+            try:
+                samples = _sample_values(conn, table, text_cols)
+            except SQLAlchemyError as e:
+                print(f"[Schema] Could not sample {table}: {e}")
+                conn.rollback()
+        parts = []
+        for column, type_name in cols:
+            part = f"{column} {type_name}"
+            if (table, column) in primary:
+                part += " PK"
+            if (table, column) in foreign:
+                part += f" -> {foreign[(table, column)]}"
+            if column in samples:
+                part += " e.g. " + ", ".join(f"'{v}'" for v in samples[column])
+            parts.append(part)
+        label = {"v": " (view)", "m": " (materialized view)"}.get(kinds[table], "")
+        lines.append(f"- {table}{label}: " + ", ".join(parts))
+    return "\n".join(lines)
+
+
+def get_schema_summary(force: bool = False) -> str:
+    """
+    Compact schema text for the Text2SQL prompt. Rebuilt only when the
+    catalog fingerprint changes (or `force`).
+    """
+    with _schema_lock:
+        with get_sql_engine().connect() as conn:
+            columns, keys = _read_schema_catalog(conn)
+            fingerprint = _schema_fingerprint(columns, keys)
+            if force or fingerprint != _schema_snapshot["fingerprint"]:
+                summary = _format_schema(conn, columns, keys)
+                _schema_snapshot.update(fingerprint=fingerprint, summary=summary, built_at=time.time())
+                print(f"[Schema] Snapshot built: {len(summary.splitlines())} tables/views, {len(summary)} chars")
+        return _schema_snapshot["summary"]
+
+
+def schema_changed() -> bool:
+    """True if the catalog no longer matches the snapshot in the prompt."""
+    with get_sql_engine().connect() as conn:
+        columns, keys = _read_schema_catalog(conn)
+    return _schema_fingerprint(columns, keys) != _schema_snapshot["fingerprint"]
+
+
+def _text2sql_guide(schema_summary: str) -> str:
+    """Schema, rules and example queries shared by the agent and single-shot prompts."""
+    return """
 You are a STRICT PostgreSQL text-to-SQL agent for a hospital database.
 
 REAL DATABASE TABLES (schema: public) and KEY COLUMNS (VERY IMPORTANT):
+Each line is: table: column type [PK] [-> referenced_table.column] [e.g. sample values]
+
+""" + schema_summary + """
 
 GENERAL RULES (VERY IMPORTANT):
-- ALWAYS inspect the real schema using tools (sql_db_list_tables, sql_db_schema)
-  before writing SQL.
-- NEVER invent columns. Use ONLY columns that actually exist in the schema output.
+- The schema above is complete and current. Do NOT call sql_db_list_tables or
+  sql_db_schema; write the SQL and go straight to sql_db_query. Only inspect
+  the schema with sql_db_schema if a query fails because a table or column
+  does not exist.
+- NEVER invent columns. Use ONLY columns that actually exist in the schema above.
 - NEVER assume generic "id" columns on these tables:
   * patients uses patient_id
   * doctors uses doctor_id
@@ -499,6 +1363,9 @@ For questions like:
   - "how many patients have asthma?"
   - "list all patients who have hypertension"
 
+(A plain per-disease patient count with no other filter is the one
+exception: answer it from mv_patients_per_disease, see PRE-AGGREGATED
+SUMMARY VIEWS below.) For everything else about diseases or conditions,
 YOU MUST USE THIS RELATIONSHIP:
 
   patients.patient_id
@@ -596,6 +1463,49 @@ MULTI-TABLE / GROUPING EXAMPLES (for complex queries):
   JOIN diseases d ON d.disease_id = pc.disease_id
   ORDER BY pc.onset_date DESC;
 
+----------------------------------------------------------------------
+PRE-AGGREGATED SUMMARY VIEWS (PREFER THESE FOR PLAIN AGGREGATES):
+
+These materialized views answer in milliseconds but are refreshed only
+every few minutes, so they can be that far behind the base tables. When
+the question is a plain aggregate with no extra filters (gender, date
+range, status, ...), query the view instead of re-aggregating the base
+tables; for plain aggregates this rule takes precedence over the JOIN
+patterns and examples above. If the user asks for live or up-to-the-minute
+figures, use the base tables instead.
+
+- mv_patients_per_disease(disease_id, disease_name, patient_count)
+    "how many patients have asthma?"
+      SELECT patient_count FROM mv_patients_per_disease
+      WHERE LOWER(disease_name) = LOWER('asthma');
+- mv_appointments_per_doctor(doctor_id, doctor_name, specialization,
+                             total_appointments, last_appointment)
+    "for each doctor, show their name and total number of appointments"
+      SELECT doctor_name, total_appointments FROM mv_appointments_per_doctor
+      ORDER BY total_appointments DESC;
+- mv_appointments_per_patient(patient_id, patient_name,
+                              total_appointments, last_appointment)
+    "for each patient, show their name and total number of appointments"
+- mv_appointments_per_month(month, total_appointments)
+    "how many appointments were there in January 2025?"
+      SELECT total_appointments FROM mv_appointments_per_month
+      WHERE month = '2025-01-01';
+- mv_billing_summary(payment_status, bill_count,
+                     total_amount_before_adjustments, total_discount,
+                     total_tax, total_revenue, average_bill)
+    "total revenue from billing"
+      SELECT SUM(total_revenue) FROM mv_billing_summary;
+    "how many bills are pending payment?"
+      SELECT bill_count FROM mv_billing_summary WHERE payment_status = 'pending';
+- mv_monthly_revenue(month, bill_count, total_revenue, paid_revenue,
+                     pending_revenue)
+    "total revenue from billing last month"
+      SELECT total_revenue FROM mv_monthly_revenue
+      WHERE month = date_trunc('month', NOW() - INTERVAL '1 month')::date;
+
+If the question needs filters or columns the views do not have, fall back
+to the JOIN patterns above on the base tables.
+
 ----------------------------------------------------------------------
 COUNT RULES:
 
@@ -605,18 +1515,14 @@ COUNT RULES:
 
 - Do NOT add LIMIT or ORDER BY to pure COUNT queries, unless absolutely necessary.
 
-----------------------------------------------------------------------
-TOOL FORMAT (STRICT):
+"""
 
-Thought: I should inspect the tables.
-Action: sql_db_list_tables
-Action Input: 
 
-Thought: I should inspect the schema of the patients table.
-Action: sql_db_schema
-Action Input: patients
+_TEXT2SQL_TOOL_FORMAT = """
+----------------------------------------------------------------------
+TOOL FORMAT (STRICT):
 
-Thought: I now know the schema, I can query.
+Thought: The schema above has what I need, I can query.
 Action: sql_db_query
 Action Input: SELECT COUNT(*) FROM patients;
 
@@ -629,9 +1535,93 @@ Rules:
 - NEVER append tool outputs or extra sentences on the same line as Action Input.
 - After thinking, ALWAYS run the SQL through the sql_db_query tool.
 - If a SQL query fails because a column does not exist, DO NOT retry the same query.
-  Instead, re-check the schema and fix the column name or answer describing the issue.
+  Instead, check the schema (sql_db_schema) and fix the column name or answer describing the issue.
 """
 
+
+# --------------------------
+# RESULT CAPTURE (sql_db_query)
+# --------------------------
+# The agent's sql_db_query tool keeps the full typed result set of its last
+# successful query in the holder set up by capture_sql_results(), so the
+# UI table is built from those rows instead of running the SQL again.
+SQL_TOOL_MAX_STRING_LENGTH = 300  # same per-value cut SQLDatabase.run applies
+
+_sql_capture: ContextVar[Optional[dict]] = ContextVar("sql_capture", default=None)
+
+
+@contextmanager
+def capture_sql_results():
+    """Collect what sql_db_query runs inside this block: {"sql", "columns", "rows"}."""
+    holder = {"sql": None, "columns": None, "rows": None}
+    token = _sql_capture.set(holder)
+    try:
+        yield holder
+    finally:
+        try:
+            _sql_capture.reset(token)
+        except ValueError:  # an async generator closed from another context
+            pass
+
+
+class CapturingQuerySQLTool(QuerySQLDatabaseTool):
+    """sql_db_query that runs on our engines and records its result set."""
+
+    def _run(self, query: str, run_manager=None) -> str:
+        try:
+            columns, rows = run_select(query)
+        except SQLAlchemyError as e:
+            return f"Error: {e}"
+        return self._record(query, columns, rows)
+
+    async def _arun(self, query: str, run_manager=None) -> str:
+        try:
+            columns, rows = await run_select_async(query)
+        except SQLAlchemyError as e:
+            return f"Error: {e}"
+        return self._record(query, columns, rows)
+
+    @staticmethod
+    def _record(query: str, columns, rows) -> str:
+        holder = _sql_capture.get()
+        if holder is not None:
+            holder.update(sql=query, columns=columns, rows=rows)
+        # What the LLM sees is unchanged: SQLDatabase.run's str() of tuples.
+        if not rows:
+            return ""
+        return str([
+            tuple(truncate_word(value, length=SQL_TOOL_MAX_STRING_LENGTH) for value in row)
+            for row in rows
+        ])
+
+
+class CapturingSQLDatabaseToolkit(SQLDatabaseToolkit):
+    def get_tools(self):
+        return [
+            CapturingQuerySQLTool(db=self.db, description=tool.description)
+            if tool.name == "sql_db_query" else tool
+            for tool in super().get_tools()
+        ]
+
+
+def _with_captured_rows(sql_result: SQLQueryResult, captured: dict):
+    """(sql_result, result_set) using what sql_db_query captured, if anything."""
+    if captured["rows"] is None:
+        return sql_result, None
+    sql_result.sql_query = captured["sql"]
+    return sql_result, (captured["columns"], captured["rows"])
+
+
+def build_text2sql_agent(streaming: bool = False, schema_summary: Optional[str] = None):
+    db = get_db()
+    llm = get_llm(streaming=streaming)
+
+    toolkit = CapturingSQLDatabaseToolkit(db=db, llm=llm)
+    if schema_summary is None:
+        schema_summary = get_schema_summary()
+
+    sql_prefix = _text2sql_guide(schema_summary) + _TEXT2SQL_TOOL_FORMAT
+
     agent = create_sql_agent(
         llm=llm,
         toolkit=toolkit,
@@ -642,7 +1632,7 @@ Rules:
     return agent
 
 
-def ask_text2sql_question(agent, question: str) -> SQLQueryResult:
+def ask_text2sql_question(agent, question: str, callbacks=None) -> SQLQueryResult:
     """
     Run the Text2SQL agent on a natural-language question and attempt to
     pull out the SQL query + final answer.
@@ -652,7 +1642,7 @@ def ask_text2sql_question(agent, question: str) -> SQLQueryResult:
     """
     try:
         # Normal path: agent returns a dict with "output" + "intermediate_steps"
-        result = agent.invoke({"input": question})
+        result = agent.invoke({"input": question}, config={"callbacks": callbacks})
     except Exception as e:
         print(f"[TEXT2SQL] Agent error while invoking: {e}")
         fallback_answer = _extract_answer_from_parsing_error(e)
@@ -669,34 +1659,124 @@ def ask_text2sql_question(agent, question: str) -> SQLQueryResult:
         # No usable answer – re-raise so the caller can show a generic error.
         raise
 
-    # If we get here, result is a normal successful agent output
-    final_answer = result["output"]
+    return _sql_result_from_agent_output(question, result)
 
-    # Try to reconstruct the SQL query from intermediate_steps
-    thoughts = result.get("intermediate_steps", [])
-    # sql_query = ""
-    # for step in thoughts:
-    #     action = step[0]
-    #     if hasattr(action, "tool") and action.tool == "sql_db_query":
-    #         sql_query = action.tool_input
-    sql_query = ""
 
-    for step in thoughts:
-        action = step[0]
+async def ask_text2sql_question_async(agent, question: str, callbacks=None) -> SQLQueryResult:
+    """Async version of ask_text2sql_question (agent.ainvoke)."""
+    try:
+        result = await agent.ainvoke({"input": question}, config={"callbacks": callbacks})
+    except Exception as e:
+        print(f"[TEXT2SQL] Agent error while invoking: {e}")
+        fallback_answer = _extract_answer_from_parsing_error(e)
+        if fallback_answer:
+            return SQLQueryResult(
+                question=question,
+                sql_query="(unavailable due to output parsing error)",
+                final_answer=fallback_answer,
+            )
+        raise
 
-    # 1) Directly from action
-        if hasattr(action, "tool") and action.tool == "sql_db_query":
-            sql_query = getattr(action, "tool_input", "")
-            continue
+    return _sql_result_from_agent_output(question, result)
 
-    # 2) If action is dict-like (newer LC versions)
-        if isinstance(action, dict):
-            if action.get("tool") == "sql_db_query":
-                sql_query = action.get("tool_input", "")
-                continue
 
-    return SQLQueryResult(
-        question=question,
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+class _FinalAnswerFilter:
+    """
+    The ReAct agent's LLM calls stream Thought/Action text as well as the
+    answer. Feed it chunks per LLM run; it returns only what follows
+    "Final Answer:".
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self._answering = set()
+
+    def feed(self, run_id, text: str) -> str:
+        if run_id in self._answering:
+            return text
+        buf = self._buffers.get(run_id, "") + text
+        idx = buf.find(FINAL_ANSWER_MARKER)
+        if idx == -1:
+            self._buffers[run_id] = buf
+            return ""
+        self._answering.add(run_id)
+        self._buffers.pop(run_id, None)
+        return buf[idx + len(FINAL_ANSWER_MARKER):].lstrip()
+
+
+async def stream_text2sql_question(agent, question: str, callbacks=None):
+    """
+    Run a (streaming) Text2SQL agent via astream_events. Async generator of
+    ("sql", {"sql": ...}) each time the agent runs sql_db_query,
+    ("token", {"text": ...}) for the final answer, and last
+    ("result", SQLQueryResult).
+    """
+    answer_filter = _FinalAnswerFilter()
+    sql_query = ""
+    final_answer = ""
+    try:
+        async for event in agent.astream_events({"input": question}, config={"callbacks": callbacks}, version="v2"):
+            kind = event["event"]
+            if kind == "on_tool_start" and event["name"] == "sql_db_query":
+                tool_input = event["data"].get("input")
+                if isinstance(tool_input, dict):
+                    tool_input = tool_input.get("query", "")
+                sql_query = str(tool_input or "")
+                yield "sql", {"sql": sql_query}
+            elif kind == "on_chat_model_stream":
+                text = answer_filter.feed(event["run_id"], event["data"]["chunk"].content or "")
+                if text:
+                    yield "token", {"text": text}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"].get("output")
+                final_answer = output.get("output", "") if isinstance(output, dict) else str(output or "")
+    except Exception as e:
+        print(f"[TEXT2SQL] Agent error while streaming: {e}")
+        fallback_answer = _extract_answer_from_parsing_error(e)
+        if not fallback_answer:
+            raise
+        yield "result", SQLQueryResult(
+            question=question,
+            sql_query="(unavailable due to output parsing error)",
+            final_answer=fallback_answer,
+        )
+        return
+
+    yield "result", SQLQueryResult(question=question, sql_query=sql_query, final_answer=final_answer)
+
+
+def _sql_result_from_agent_output(question: str, result: dict) -> SQLQueryResult:
+    """Pull the final answer and the executed SQL out of an agent result."""
+    final_answer = result["output"]
+
+    # Try to reconstruct the SQL query from intermediate_steps
+    thoughts = result.get("intermediate_steps", [])
+    # sql_query = ""
+    # for step in thoughts:
+    #     action = step[0]
+    #     if hasattr(action, "tool") and action.tool == "sql_db_query":
+    #         sql_query = action.tool_input
+    sql_query = ""
+
+    for step in thoughts:
+        action = step[0]
+
+    # 1) Directly from action
+        if hasattr(action, "tool") and action.tool == "sql_db_query":
+            sql_query = getattr(action, "tool_input", "")
+            continue
+
+    # 2) If action is dict-like (newer LC versions)
+        if isinstance(action, dict):
+            if action.get("tool") == "sql_db_query":
+                sql_query = action.get("tool_input", "")
+                continue
+
+    return SQLQueryResult(
+        question=question,
         sql_query=sql_query,
         final_answer=final_answer,
     )
@@ -723,39 +1803,557 @@ def _extract_answer_from_parsing_error(err: Exception) -> Optional[str]:
     return extracted or None
 
 
+# --------------------------
+# SEMANTIC SQL CACHE
+# --------------------------
+# Questions the Text2SQL agent answered are embedded and stored with the SQL
+# it ran. A new question close enough to a stored one (cosine similarity
+# >= SQL_CACHE_THRESHOLD) re-runs that SQL on live data and only asks the LLM
+# to phrase the answer, skipping the ReAct loop. Entries whose SQL starts
+# failing (e.g. after a schema change) are evicted.
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "500"))
+SQL_CACHE_THRESHOLD = float(os.getenv("SQL_CACHE_THRESHOLD", "0.95"))
+SQL_CACHE_MAX_FAILURES = int(os.getenv("SQL_CACHE_MAX_FAILURES", "3"))
+SQL_CACHE_SUMMARY_ROWS = int(os.getenv("SQL_CACHE_SUMMARY_ROWS", "50"))
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Follow-ups ("their appointments", "same for last month") depend on the
+# conversation, so their SQL can't be reused for another chat.
+_FOLLOW_UP = re.compile(
+    r"\b(them|their|those|these|it|its|he|she|him|his|her|they|same|above|previous|earlier|"
+    r"again|instead|what about|how about|and for)\b",
+    re.I,
+)
+
+
+def _is_self_contained(question: str) -> bool:
+    return not _FOLLOW_UP.search(question)
+
+
+# Paraphrases that differ only in a value ("appointments in 2023" / "in
+# 2024", "doctor 12" / "doctor 13", "diabetes" / "asthma") embed almost
+# identically, so a hit also needs the same literals: numbers, dates,
+# double-quoted text and capitalised names in the question, plus every SQL
+# string/number literal that was taken from the cached question's words.
+_QUESTION_LITERALS = re.compile(
+    r"\d{4}-\d{1,2}-\d{1,2}|\d+(?:\.\d+)?|\"[^\"]{1,80}\"|“[^”]{1,80}”|(?<=\s)[A-Z][\w'-]*"
+)
+
+
+def _question_literals(question: str) -> frozenset:
+    return frozenset(m.group(0).strip('"“”').casefold() for m in _QUESTION_LITERALS.finditer(question))
+
+
+def _sql_literals(sql: str) -> frozenset:
+    literals = set()
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.ttype in sqlparse.tokens.Literal.String.Single or token.ttype in sqlparse.tokens.Number:
+                value = token.value.strip("'").strip("%").casefold()
+                if value:
+                    literals.add(value)
+    return frozenset(literals)
+
+
+class _SQLCacheEntry:
+    __slots__ = ("question", "sql", "vector", "literals", "sql_literals", "hits", "successes", "failures", "last_error")
+
+    def __init__(self, question: str, sql: str, vector):
+        self.question = question
+        self.sql = sql
+        self.vector = vector
+        self.literals = _question_literals(question)
+        # Only the SQL literals that came from the question's own words.
+        asked = question.casefold()
+        self.sql_literals = frozenset(l for l in _sql_literals(sql) if l in asked)
+        self.hits = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+
+class SemanticSQLCache:
+    """LRU of (question embedding -> SQL), searched by cosine similarity."""
+
+    def __init__(self, maxsize: int = SQL_CACHE_SIZE, threshold: float = SQL_CACHE_THRESHOLD,
+                 max_failures: int = SQL_CACHE_MAX_FAILURES):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _SQLCacheEntry]" = OrderedDict()
+        self._matrix = None  # rows follow self._entries; rebuilt lazily after changes
+        self._embeddings = None
+        self.hits = 0
+        self.misses = 0
+        self.literal_mismatches = 0
+        self.evictions = 0
+
+    def embed(self, question: str):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = get_embeddings()
+        vector = np.asarray(self._embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _same_literals(entry: _SQLCacheEntry, question: str) -> bool:
+        asked = question.casefold()
+        return entry.literals == _question_literals(question) and all(l in asked for l in entry.sql_literals)
+
+    def lookup(self, vector, question: str) -> Optional[_SQLCacheEntry]:
+        """Closest entry at or above the threshold with the same literals as `question`, or None."""
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([e.vector for e in self._entries.values()])
+            scores = self._matrix @ vector
+            keys = list(self._entries)
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    break
+                entry = self._entries[keys[i]]
+                if not self._same_literals(entry, question):
+                    self.literal_mismatches += 1
+                    continue
+                self._entries.move_to_end(keys[i])
+                self._matrix = None
+                entry.hits += 1
+                self.hits += 1
+                print(f"[SQLCache] Hit ({scores[i]:.3f}) for: {entry.question}")
+                return entry
+            self.misses += 1
+            return None
+
+    def store(self, question: str, sql: str, vector) -> None:
+        key = question.strip().lower()
+        with self._lock:
+            # A near-duplicate keeps only the newest SQL.
+            if self._entries:
+                matrix = self._matrix if self._matrix is not None else np.stack(
+                    [e.vector for e in self._entries.values()]
+                )
+                scores = matrix @ vector
+                best = int(scores.argmax())
+                key_best = list(self._entries)[best]
+                if scores[best] >= self.threshold and self._same_literals(self._entries[key_best], question):
+                    self._entries.pop(key_best)
+            self._entries.pop(key, None)
+            self._entries[key] = _SQLCacheEntry(question, sql, vector)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def record_success(self, entry: _SQLCacheEntry) -> None:
+        with self._lock:
+            entry.successes += 1
+            entry.failures = 0
+
+    def record_failure(self, entry: _SQLCacheEntry, error: Exception) -> None:
+        """
+        Count a failed re-run. SQL the database rejects outright (missing
+        table/column after a schema change) is evicted at once; anything
+        else (timeouts, dropped connections) after max_failures in a row.
+        """
+        with self._lock:
+            entry.failures += 1
+            entry.last_error = str(error)
+            if isinstance(error, ProgrammingError) or entry.failures >= self.max_failures:
+                for key, cached in self._entries.items():
+                    if cached is entry:
+                        del self._entries[key]
+                        self._matrix = None
+                        self.evictions += 1
+                        print(f"[SQLCache] Evicted after error: {entry.question}: {error}")
+                        break
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "literal_mismatches": self.literal_mismatches,
+                "evictions": self.evictions,
+            }
+
+
+sql_cache = SemanticSQLCache()
+
+
+def _sql_summary_prompt(question: str, sql: str, columns, rows) -> str:
+    shown = rows[:SQL_CACHE_SUMMARY_ROWS]
+    lines = [" | ".join(str(c) for c in columns)]
+    lines += [" | ".join("" if v is None else str(v) for v in row) for row in shown]
+    more = f"\n({len(rows) - len(shown)} more rows not shown)" if len(rows) > len(shown) else ""
+    return f"""
+You are a hospital database assistant. The SQL below was run for the user's
+question; answer the question from its result only.
+If the result is a list, give one item per line without numbering.
+If the result is empty, say no matching records were found.
+
+Question: {question}
+SQL: {sql}
+Result ({len(rows)} rows):
+{chr(10).join(lines)}{more}
+
+Answer:
+"""
+
+
+def summarize_sql_result(question: str, sql: str, columns, rows, callbacks=None) -> str:
+    prompt = _sql_summary_prompt(question, sql, columns, rows)
+    return _message_text(get_llm().invoke(prompt, config={"callbacks": callbacks}))
+
+
+async def summarize_sql_result_async(question: str, sql: str, columns, rows, callbacks=None) -> str:
+    prompt = _sql_summary_prompt(question, sql, columns, rows)
+    return _message_text(await get_llm().ainvoke(prompt, config={"callbacks": callbacks}))
+
+
+# --------------------------
+# SINGLE-SHOT TEXT2SQL
+# --------------------------
+# TEXT2SQL_MODE=single_shot asks the LLM for the SQL in one structured-output
+# call, runs it, and phrases the answer from the rows (two LLM calls in all,
+# against 4-6+ for the ReAct agent). SQL that is not a single SELECT, or that
+# fails to run, falls back to the agent. TEXT2SQL_MODE=agent (the default)
+# always uses the agent. /metrics/text2sql compares the two.
+TEXT2SQL_MODES = ("agent", "single_shot")
+TEXT2SQL_MODE = os.getenv("TEXT2SQL_MODE", "agent").strip().lower()
+if TEXT2SQL_MODE not in TEXT2SQL_MODES:
+    print(f"[TEXT2SQL] Unknown TEXT2SQL_MODE={TEXT2SQL_MODE!r}, using 'agent'")
+    TEXT2SQL_MODE = "agent"
+
+
+class GeneratedSQL(BaseModel):
+    sql: str = Field(description="One PostgreSQL SELECT statement that answers the question")
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Counts LLM calls made under one Text2SQL request."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_llm_start(self, *args, **kwargs):
+        self.calls += 1
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self.calls += 1
+
+
+class _Text2SQLStats:
+    """Per-mode request count, LLM calls and latency."""
+
+    def __init__(self, window: int = 1000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.modes = {}
+
+    def record(self, mode: str, llm_calls: int, seconds: float) -> None:
+        with self.lock:
+            stats = self.modes.setdefault(
+                mode, {"requests": 0, "llm_calls": 0, "seconds": 0.0, "recent": deque(maxlen=self.window)}
+            )
+            stats["requests"] += 1
+            stats["llm_calls"] += llm_calls
+            stats["seconds"] += seconds
+            stats["recent"].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            report = {}
+            for mode, stats in self.modes.items():
+                recent = sorted(stats["recent"])
+                n = stats["requests"]
+                report[mode] = {
+                    "requests": n,
+                    "llm_calls_avg": round(stats["llm_calls"] / n, 2),
+                    "latency_ms_avg": round(stats["seconds"] / n * 1000, 1),
+                    "latency_ms_p50": round(recent[len(recent) // 2] * 1000, 1),
+                    "latency_ms_p95": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 1),
+                }
+            return {"mode": TEXT2SQL_MODE, "modes": report}
+
+
+# "single_shot_fallback" is a single-shot attempt that ended up in the agent;
+# its numbers include both.
+text2sql_stats = _Text2SQLStats()
+
+
+def _single_shot_prompt(question: str) -> str:
+    schema_summary = _schema_snapshot["summary"] or get_schema_summary()
+    return _text2sql_guide(schema_summary) + f"""
+----------------------------------------------------------------------
+Write ONE PostgreSQL SELECT statement that answers the question below.
+Do not use any tools; return only the SQL.
+
+Question: {question}
+"""
+
+
+def validate_select(sql: str) -> str:
+    """The statement without a trailing ';' if it is a single SELECT, else ValueError."""
+    sql = (sql or "").strip().rstrip(";").strip()
+    statements = [st for st in sqlparse.parse(sql) if st.value.strip()]
+    if len(statements) != 1:
+        raise ValueError(f"expected one SQL statement, got {len(statements)}")
+    if statements[0].get_type() != "SELECT":
+        raise ValueError(f"expected a SELECT, got {statements[0].get_type()}")
+    return sql
+
+
+def generate_sql(question: str, callbacks=None) -> str:
+    llm = get_llm().with_structured_output(GeneratedSQL)
+    generated = llm.invoke(_single_shot_prompt(question), config={"callbacks": callbacks})
+    return validate_select(generated.sql)
+
+
+async def generate_sql_async(question: str, callbacks=None) -> str:
+    llm = get_llm().with_structured_output(GeneratedSQL)
+    generated = await llm.ainvoke(_single_shot_prompt(question), config={"callbacks": callbacks})
+    return validate_select(generated.sql)
+
+
+def ask_text2sql(agent, question: str, user_q: str):
+    """
+    Answer a DB question in the configured TEXT2SQL_MODE. Returns
+    (SQLQueryResult, result_set): result_set is the (columns, rows) the SQL
+    returned when it ran, else None.
+    """
+    mode = TEXT2SQL_MODE
+    counter = LLMCallCounter()
+    start = time.perf_counter()
+    try:
+        if mode == "single_shot":
+            try:
+                sql = generate_sql(question, callbacks=[counter])
+                columns, rows = run_select(sql)
+            except Exception as e:
+                print(f"[TEXT2SQL] Single-shot failed, falling back to the agent: {e}")
+                mode = "single_shot_fallback"
+            else:
+                answer = summarize_sql_result(user_q, sql, columns, rows, callbacks=[counter])
+                return SQLQueryResult(question=question, sql_query=sql, final_answer=answer), (columns, rows)
+        with capture_sql_results() as captured:
+            sql_result = ask_text2sql_question(agent, question, callbacks=[counter])
+        return _with_captured_rows(sql_result, captured)
+    finally:
+        text2sql_stats.record(mode, counter.calls, time.perf_counter() - start)
+
+
+async def ask_text2sql_async(agent, question: str, user_q: str):
+    mode = TEXT2SQL_MODE
+    counter = LLMCallCounter()
+    start = time.perf_counter()
+    try:
+        if mode == "single_shot":
+            try:
+                sql = await generate_sql_async(question, callbacks=[counter])
+                columns, rows = await run_select_async(sql)
+            except Exception as e:
+                print(f"[TEXT2SQL] Single-shot failed, falling back to the agent: {e}")
+                mode = "single_shot_fallback"
+            else:
+                answer = await summarize_sql_result_async(user_q, sql, columns, rows, callbacks=[counter])
+                return SQLQueryResult(question=question, sql_query=sql, final_answer=answer), (columns, rows)
+        with capture_sql_results() as captured:
+            sql_result = await ask_text2sql_question_async(agent, question, callbacks=[counter])
+        return _with_captured_rows(sql_result, captured)
+    finally:
+        text2sql_stats.record(mode, counter.calls, time.perf_counter() - start)
+
+
+async def stream_text2sql(agent, question: str, user_q: str):
+    """
+    stream_text2sql_question in the configured TEXT2SQL_MODE. The last event
+    is ("result", (SQLQueryResult, result_set)) as from ask_text2sql.
+    """
+    mode = TEXT2SQL_MODE
+    counter = LLMCallCounter()
+    start = time.perf_counter()
+    try:
+        if mode == "single_shot":
+            try:
+                sql = await generate_sql_async(question, callbacks=[counter])
+                columns, rows = await run_select_async(sql)
+            except Exception as e:
+                print(f"[TEXT2SQL] Single-shot failed, falling back to the agent: {e}")
+                mode = "single_shot_fallback"
+            else:
+                yield "sql", {"sql": sql}
+                answer = await summarize_sql_result_async(user_q, sql, columns, rows, callbacks=[counter])
+                yield "token", {"text": answer}
+                yield "result", (SQLQueryResult(question=question, sql_query=sql, final_answer=answer), (columns, rows))
+                return
+        with capture_sql_results() as captured:
+            async for event, data in stream_text2sql_question(agent, question, callbacks=[counter]):
+                yield event, _with_captured_rows(data, captured) if event == "result" else data
+    finally:
+        text2sql_stats.record(mode, counter.calls, time.perf_counter() - start)
+
+
 # RAG SETUP FOR APOLLO POLICY DOCUMENTS
+POLICY_CHUNK_SIZE = 1500
+POLICY_CHUNK_OVERLAP = 200
+POLICY_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+# FAISS index + docstore (index.faiss / index.pkl) and manifest.json live here.
+POLICY_INDEX_DIR = os.getenv("POLICY_INDEX_DIR", "policy_faiss_index")
+POLICY_INDEX_VERSION = 1
+
+
 def load_policy_documents() -> List:
     """
     Load multiple policy PDFs and return a list of LangChain Documents.
+    Pages come from the rag_cache page cache; uncached PDFs are parsed in parallel.
     """
-    all_docs = []
+    paths = []
     for pdf_path in APOLLO_POLICY_FILES:
         if not os.path.exists(pdf_path):
             print(f"⚠️  Warning: Policy file not found: {pdf_path}")
             continue
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load()
-        all_docs.extend(docs)
-    return all_docs
+        paths.append(pdf_path)
+    pages = load_pdf_pages(paths)
+    return [doc for path in paths for doc in pages[path]]
+
+
+def _split_policy_documents(docs: List) -> List:
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=POLICY_CHUNK_SIZE,
+        chunk_overlap=POLICY_CHUNK_OVERLAP,
+    )
+    return splitter.split_documents(docs)
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """OpenAI embeddings behind the rag_cache SQLite cache (documents and queries)."""
+    return CachedEmbeddings(OpenAIEmbeddings(model=POLICY_EMBEDDING_MODEL), POLICY_EMBEDDING_MODEL)
+
+
+def _policy_index_settings() -> dict:
+    """Anything that changes the vectors; a mismatch means a full rebuild."""
+    return {
+        "version": POLICY_INDEX_VERSION,
+        "chunk_size": POLICY_CHUNK_SIZE,
+        "chunk_overlap": POLICY_CHUNK_OVERLAP,
+        "embedding_model": POLICY_EMBEDDING_MODEL,
+    }
+
+
+def _read_policy_manifest() -> Optional[dict]:
+    path = os.path.join(POLICY_INDEX_DIR, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[PolicyIndex] Ignoring unreadable manifest {path}: {e}")
+        return None
+
+
+def _write_policy_manifest(manifest: dict) -> None:
+    path = os.path.join(POLICY_INDEX_DIR, "manifest.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _update_policy_index(vectorstore, indexed: dict, current: dict, embeddings):
+    """
+    Bring `vectorstore` (None = start empty) in line with `current`
+    ({path: sha256}). `indexed` is the manifest's {path: {sha256, ids}}.
+    Returns (vectorstore, files) with files in manifest form.
+    """
+    files = {p: e for p, e in indexed.items() if current.get(p) == e["sha256"]}
+    stale_ids = [i for p, e in indexed.items() if p not in files for i in e["ids"]]
+    if stale_ids:
+        vectorstore.delete(stale_ids)
+
+    changed = {p: sha for p, sha in current.items() if p not in files}
+    pages = load_pdf_pages(list(changed), hashes=changed)
+    for path, sha in changed.items():
+        print(f"[PolicyIndex] Embedding {path}")
+        chunks = _split_policy_documents(pages[path])
+        ids = [uuid.uuid4().hex for _ in chunks]
+        if chunks:
+            if vectorstore is None:
+                vectorstore = FAISS.from_documents(chunks, embeddings, ids=ids)
+            else:
+                vectorstore.add_documents(chunks, ids=ids)
+        files[path] = {"sha256": sha, "ids": ids}
+    return vectorstore, files
 
 
 def build_policy_vectorstore():
     """
-    Build a FAISS vectorstore from Apollo policy documents.
+    Load the FAISS vectorstore for the Apollo policy documents from
+    POLICY_INDEX_DIR. Only PDFs that are new or whose content hash changed
+    since the index was saved are parsed and embedded; removed or changed
+    files have their old chunks deleted. A different splitter or embedding
+    model rebuilds the whole index.
     """
-    docs = load_policy_documents()
-    if not docs:
-        raise RuntimeError("No Apollo policy documents could be loaded.")
+    embeddings = get_embeddings()
+    settings = _policy_index_settings()
+    os.makedirs(POLICY_INDEX_DIR, exist_ok=True)
+
+    # Serialise workers starting together so only one of them embeds.
+    with _file_lock(POLICY_INDEX_DIR):
+        current = {}
+        for pdf_path in APOLLO_POLICY_FILES:
+            if not os.path.exists(pdf_path):
+                print(f"⚠️  Warning: Policy file not found: {pdf_path}")
+                continue
+            current[pdf_path] = file_sha256(pdf_path)
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1500,
-        chunk_overlap=200,
-    )
-    split_docs = splitter.split_documents(docs)
+        vectorstore = None
+        indexed = {}
+        manifest = _read_policy_manifest()
+        if manifest and manifest.get("settings") == settings:
+            try:
+                # Our own pickle, written by save_local below.
+                vectorstore = FAISS.load_local(
+                    POLICY_INDEX_DIR, embeddings, allow_dangerous_deserialization=True
+                )
+                indexed = manifest["files"]
+            except Exception as e:
+                print(f"[PolicyIndex] Could not load saved index, rebuilding: {e}")
+        elif manifest:
+            print("[PolicyIndex] Splitter/embedding settings changed, rebuilding")
+
+        if vectorstore is not None and {p: e["sha256"] for p, e in indexed.items()} == current:
+            return vectorstore
+
+        try:
+            vectorstore, files = _update_policy_index(vectorstore, indexed, current, embeddings)
+        except Exception as e:
+            if vectorstore is None:
+                raise
+            print(f"[PolicyIndex] Incremental update failed, rebuilding: {e}")
+            vectorstore, files = _update_policy_index(None, {}, current, embeddings)
 
-    embeddings = OpenAIEmbeddings()
-    vectorstore = FAISS.from_documents(split_docs, embeddings)
-    return vectorstore
+        if vectorstore is None or vectorstore.index.ntotal == 0:
+            raise RuntimeError("No Apollo policy documents could be loaded.")
+
+        vectorstore.save_local(POLICY_INDEX_DIR)
+        _write_policy_manifest({"settings": settings, "files": files})
+        return vectorstore
 
 
 def build_policy_rag_chain() -> RetrievalQA:
@@ -768,7 +2366,9 @@ def build_policy_rag_chain() -> RetrievalQA:
         search_kwargs={"k": 4},
     )
 
-    llm = get_llm()
+    # Streaming model so /chat/stream can forward answer tokens; invoke()
+    # from /chat still gets the complete answer.
+    llm = get_llm(streaming=True)
 
     system_prompt = """
 You are an assistant that answers questions strictly based on Apollo policy documents,
@@ -813,7 +2413,15 @@ def ask_policy_question(qa_chain: RetrievalQA, question: str) -> str:
     """
     Ask a question about Apollo policy documents via the RAG chain.
     """
-    result = qa_chain.invoke({"query": question})
+    return _policy_answer(qa_chain.invoke({"query": question}))
+
+
+async def ask_policy_question_async(qa_chain: RetrievalQA, question: str) -> str:
+    """Async version of ask_policy_question (chain.ainvoke)."""
+    return _policy_answer(await qa_chain.ainvoke({"query": question}))
+
+
+def _policy_answer(result) -> str:
     if isinstance(result, dict) and "result" in result:
         return result["result"]
     if isinstance(result, str):
@@ -837,9 +2445,16 @@ def generate_other_agent_reply(user_q: str) -> str:
     All behaviour here is controlled by the prompt; there is NO hard-coded
     greeting logic elsewhere.
     """
-    llm = get_llm()
+    return _message_text(get_llm().invoke(_other_agent_prompt(user_q)))
+
 
-    prompt = f"""
+async def generate_other_agent_reply_async(user_q: str) -> str:
+    """Async version of generate_other_agent_reply (llm.ainvoke)."""
+    return _message_text(await get_llm().ainvoke(_other_agent_prompt(user_q)))
+
+
+def _other_agent_prompt(user_q: str) -> str:
+    return f"""
 You are the 'Other Agent' for a hospital + Apollo policy chatbot.
 
 Your job now:
@@ -887,7 +2502,8 @@ User message:
 Now write ONE friendly assistant reply:
 """
 
-    response = llm.invoke(prompt)
+
+def _message_text(response) -> str:
     # ChatOpenAI returns an AIMessage; fall back to str() if needed.
     try:
         return response.content.strip()
@@ -1073,15 +2689,131 @@ Just a single label on its own line.
     return crew
 
 
-def route_with_intent(crew: Crew, user_query: str) -> str:
+_intent_classifier = None
+routing_stats = {"cache": 0, "local": 0, "crew": 0}
+_routing_stats_lock = threading.Lock()
+
+
+def _count_route(source: str) -> None:
+    with _routing_stats_lock:
+        routing_stats[source] += 1
+
+# Routing cache: raw user question (normalised) → route, shared by all chats.
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "5000"))
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "3600"))
+ROUTE_CACHE_MASK_ENTITIES = os.getenv("ROUTE_CACHE_MASK_ENTITIES", "true").lower() in ("1", "true", "yes")
+
+route_cache = _TTLCache(ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL)
+
+# Literals that don't change where a question goes, masked before caching
+# so "patients seen on 2024-01-05" and "... on 2024-03-09" share an entry.
+_ENTITY_PATTERNS = [
+    (re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.]+\b"), " <email> "),
+    (re.compile(r"\b\d{4}-\d{1,2}-\d{1,2}\b|\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b"), " <date> "),
+    (re.compile(r"\"[^\"]{1,80}\"|“[^”]{1,80}”"), " <text> "),
+    (re.compile(r"\b((?i:dr|mr|mrs|ms))\.?\s+[A-Z][\w'-]*(\s+[A-Z][\w'-]*)?"), r" \1 <name> "),
+    (re.compile(r"\b\d+(\.\d+)?\b"), " <num> "),
+]
+_PUNCTUATION = re.compile(r"[^\w<>\s]+")
+
+
+def normalize_route_key(user_message: str, mask_entities: bool = ROUTE_CACHE_MASK_ENTITIES) -> str:
+    """Case-folded, punctuation-free, single-spaced (and optionally masked) question."""
+    text = user_message
+    if mask_entities:
+        for pattern, replacement in _ENTITY_PATTERNS:
+            text = pattern.sub(replacement, text)
+    text = _PUNCTUATION.sub(" ", text.casefold())
+    return " ".join(text.split())
+
+
+def get_intent_classifier() -> IntentClassifier:
+    """Keyword rules + the model trained by `python intent_classifier.py train`."""
+    global _intent_classifier
+    if _intent_classifier is None:
+        _intent_classifier = IntentClassifier.load()
+    return _intent_classifier
+
+
+def _local_route(user_message: Optional[str]) -> Optional[str]:
+    """The local classifier's label for the raw message, if it is confident."""
+    if not user_message:
+        return None
+    try:
+        label, confidence, source = get_intent_classifier().predict(user_message)
+    except Exception as e:
+        print(f"[IntentClassifier] Prediction failed, using CrewAI: {e}")
+        return None
+    if label is None:
+        return None
+    print(f"[IntentClassifier] {label} ({source}, {confidence:.2f})")
+    _count_route("local")
+    return label
+
+
+def route_with_intent(crew: Crew, user_query: str, user_message: Optional[str] = None) -> str:
     """
     Run the Intent Agent via CrewAI to classify the user query.
     Returns one of:
       - "TEXT2SQL_AGENT"
       - "RAG_AGENT"
       - "OTHER_AGENT"
+    If the raw `user_message` is given, it is looked up in route_cache
+    first (keyed by normalize_route_key, so the same question in any chat
+    hits), then the local intent classifier is tried; CrewAI only runs when
+    neither has an answer. A CrewAI label is only cached when it can't have
+    depended on this chat's history (see _route_is_cacheable).
+    """
+    key = normalize_route_key(user_message) if user_message else None
+    if key:
+        cached = route_cache.get(key)
+        if cached:
+            _count_route("cache")
+            return cached
+
+    label = _local_route(user_message)
+    local = bool(label)
+    if not local:
+        _count_route("crew")
+        label = _route_from_label(crew.kickoff(inputs={"user_query": user_query}))
+    if key and _route_is_cacheable(local, user_query, user_message):
+        route_cache.set(key, label)
+    return label
+
+
+async def route_with_intent_async(crew: Crew, user_query: str, user_message: Optional[str] = None) -> str:
+    """
+    Async version of route_with_intent. CrewAI has no native async LLM path;
+    kickoff_async runs the crew in a worker thread so the event loop stays free.
+    """
+    key = normalize_route_key(user_message) if user_message else None
+    if key:
+        cached = route_cache.get(key)
+        if cached:
+            _count_route("cache")
+            return cached
+
+    label = _local_route(user_message)
+    local = bool(label)
+    if not local:
+        _count_route("crew")
+        label = _route_from_label(await crew.kickoff_async(inputs={"user_query": user_query}))
+    if key and _route_is_cacheable(local, user_query, user_message):
+        route_cache.set(key, label)
+    return label
+
+
+def _route_is_cacheable(local: bool, user_query: str, user_message: str) -> bool:
+    """
+    The cache is keyed by the raw message and shared by every chat, so only
+    keep labels that came from the message alone: the local classifier's,
+    or CrewAI's when there was no history in the query or the message
+    doesn't refer back to it ("what about last month?", "show them again").
     """
-    result = crew.kickoff(inputs={"user_query": user_query})
+    return local or user_query == user_message or _is_self_contained(user_message)
+
+
+def _route_from_label(result) -> str:
     label = str(result).strip().upper()
 
     if "TEXT2SQL_AGENT" in label:
@@ -1091,41 +2823,247 @@ def route_with_intent(crew: Crew, user_query: str) -> str:
     return "OTHER_AGENT"
 
 
+# SUMMARY VIEW REFRESH (materialized views from ndb.SUMMARY_VIEWS)
+SUMMARY_REFRESH_SECONDS = int(os.getenv("SUMMARY_REFRESH_SECONDS", "300"))
+
+_summary_refresh_stop = threading.Event()
+_summary_refresh_thread = None
+
+
+def refresh_summary_views_now() -> bool:
+    """
+    Refresh all summary views once on a connection from our engine. Every
+    uvicorn worker runs the refresher; a transaction-level advisory lock
+    makes the others skip while one is refreshing. Returns False if skipped.
+    """
+    raw = get_sql_engine().raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('summary_view_refresh'));")
+        if not cur.fetchone()[0]:
+            cur.close()
+            raw.rollback()
+            return False
+        refresh_summary_views(cur)
+        cur.close()
+        raw.commit()
+        return True
+    finally:
+        raw.close()
+
+
+def _summary_refresh_loop():
+    while not _summary_refresh_stop.wait(SUMMARY_REFRESH_SECONDS):
+        try:
+            refresh_summary_views_now()
+        except Exception as e:
+            print(f"[SummaryViews] Refresh failed: {e}")
+
+
+def start_summary_view_refresher() -> None:
+    """Start the background thread that keeps the summary views fresh."""
+    global _summary_refresh_thread
+    if SUMMARY_REFRESH_SECONDS <= 0 or _summary_refresh_thread is not None:
+        return
+    _summary_refresh_stop.clear()
+    _summary_refresh_thread = threading.Thread(
+        target=_summary_refresh_loop, name="summary-view-refresh", daemon=True
+    )
+    _summary_refresh_thread.start()
+    print(f"[SummaryViews] Refreshing {len(SUMMARY_VIEWS)} views every {SUMMARY_REFRESH_SECONDS}s")
+
+
+def stop_summary_view_refresher() -> None:
+    global _summary_refresh_thread
+    _summary_refresh_stop.set()
+    _summary_refresh_thread = None
+
+
+# SCHEMA WATCH (rebuild the Text2SQL prompt when the schema changes)
+_schema_watch_stop = threading.Event()
+_schema_watch_thread = None
+
+
+def refresh_schema_if_changed() -> bool:
+    """
+    Rebuild the schema snapshot and the Text2SQL agents if the catalog
+    changed. Cached SQL was written against the old schema, so it goes too.
+    """
+    global _text2sql_agent_fastapi, _text2sql_stream_agent_fastapi
+    if _schema_snapshot["fingerprint"] is None or not schema_changed():
+        return False
+    summary = get_schema_summary(force=True)
+    agent = build_text2sql_agent(schema_summary=summary)
+    stream_agent = build_text2sql_agent(streaming=True, schema_summary=summary)
+    with _agents_lock:
+        _text2sql_agent_fastapi = agent
+        _text2sql_stream_agent_fastapi = stream_agent
+    sql_cache.clear()
+    print("[Schema] Schema changed; Text2SQL agents rebuilt and SQL cache cleared")
+    return True
+
+
+def _schema_watch_loop():
+    while not _schema_watch_stop.wait(SCHEMA_CHECK_SECONDS):
+        try:
+            refresh_schema_if_changed()
+        except Exception as e:
+            print(f"[Schema] Schema check failed: {e}")
+
+
+def start_schema_watch() -> None:
+    global _schema_watch_thread
+    if SCHEMA_CHECK_SECONDS <= 0 or _schema_watch_thread is not None:
+        return
+    _schema_watch_stop.clear()
+    _schema_watch_thread = threading.Thread(
+        target=_schema_watch_loop, name="schema-watch", daemon=True
+    )
+    _schema_watch_thread.start()
+
+
+def stop_schema_watch() -> None:
+    global _schema_watch_thread
+    _schema_watch_stop.set()
+    _schema_watch_thread = None
+
+
 # SINGLE-QUERY ENTRY POINT + FASTAPI BACKEND (for UI integration)
 
 _intent_crew_fastapi = None
 _text2sql_agent_fastapi = None
 _policy_rag_chain_fastapi = None
+_text2sql_stream_agent_fastapi = None
+
+
+def _ensure_text2sql_stream_agent():
+    """Lazy-init the streaming-LLM Text2SQL agent used by /chat/stream."""
+    global _text2sql_stream_agent_fastapi
+    if _text2sql_stream_agent_fastapi is None:
+        _text2sql_stream_agent_fastapi = build_text2sql_agent(streaming=True)
+    return _text2sql_stream_agent_fastapi
+
+
+_agents_lock = threading.Lock()
+_agents_ready = False
 
 
 def _ensure_fastapi_agents_ready():
-    """Lazy-init crews and chains used by the FastAPI /chat endpoint."""
-    global _intent_crew_fastapi, _text2sql_agent_fastapi, _policy_rag_chain_fastapi
-    
+    """
+    Build the crews and chains used by /chat and /chat/stream, once per
+    process. warm_up() does this at startup; requests that arrive earlier
+    wait for it instead of building their own.
+    """
+    global _intent_crew_fastapi, _text2sql_agent_fastapi, _agents_ready
+    if _agents_ready:
+        return
+
+    with _agents_lock:
+        if _agents_ready:
+            return
+
+        try:
+            init_chat_history_tables()
+        except Exception as e:
+            print(f"[FastAPI] Could not initialize chat history tables: {e}")
+
+        if _text2sql_agent_fastapi is None:
+            _text2sql_agent_fastapi = build_text2sql_agent()
+        _ensure_text2sql_stream_agent()
+
+        _ensure_policy_rag_chain()
+
+        if _intent_crew_fastapi is None:
+            llm = get_llm()
+            _intent_crew_fastapi = build_intent_crew(llm)
+        get_intent_classifier()
+
+        _agents_ready = True
+
+
+async def _ensure_fastapi_agents_ready_async():
+    if not _agents_ready:
+        await asyncio.to_thread(_ensure_fastapi_agents_ready)
+
 
+# The policy RAG chain is optional: if it can't be built (missing PDFs,
+# embeddings API down), the rest of the app still starts, and the build is
+# retried from RAG requests with exponential backoff up to
+# RAG_RETRY_MAX_SECONDS between attempts.
+RAG_RETRY_MAX_SECONDS = float(os.getenv("RAG_RETRY_MAX_SECONDS", "300"))
+
+_rag_lock = threading.Lock()
+_rag_state = {"failures": 0, "retry_at": 0.0, "error": None}
+
+
+def _ensure_policy_rag_chain():
+    """The policy RAG chain, building it if it is missing and not backing off; else None."""
+    global _policy_rag_chain_fastapi
+    if _policy_rag_chain_fastapi is not None or time.monotonic() < _rag_state["retry_at"]:
+        return _policy_rag_chain_fastapi
+    # One build at a time; other requests answer RAG_NOT_READY_REPLY meanwhile.
+    if not _rag_lock.acquire(blocking=False):
+        return _policy_rag_chain_fastapi
     try:
-        init_chat_history_tables()
+        if _policy_rag_chain_fastapi is None:
+            _policy_rag_chain_fastapi = build_policy_rag_chain()
+            _rag_state.update(failures=0, retry_at=0.0, error=None)
     except Exception as e:
-        print(f"[FastAPI] Could not initialize chat history tables: {e}")
+        _rag_state["failures"] += 1
+        delay = min(RAG_RETRY_MAX_SECONDS, 2 ** _rag_state["failures"])
+        _rag_state.update(retry_at=time.monotonic() + delay, error=str(e))
+        print(
+            "⚠️  Warning: Could not initialize Apollo policies RAG chain in FastAPI mode.\n"
+            f"   Reason: {e}\n"
+            f"   RAG_AGENT route will not work until this is fixed; retrying in {delay:.0f}s.\n"
+        )
+    finally:
+        _rag_lock.release()
+    return _policy_rag_chain_fastapi
+
 
+# STARTUP WARM-UP + READINESS (driven by the FastAPI lifespan below)
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "60"))
 
-    if _text2sql_agent_fastapi is None:
-        _text2sql_agent_fastapi = build_text2sql_agent()
+_readiness = {"state": "starting", "error": None, "warmup_seconds": None}
+_warmup_stop = threading.Event()
 
-    if _policy_rag_chain_fastapi is None:
+
+def _warm_up_once() -> None:
+    # Schema check: a pooled connection that can see our tables.
+    with get_sql_engine().connect() as conn:
+        conn.execute(sql_text("SELECT 1 FROM patients LIMIT 1"))
+    _ensure_fastapi_agents_ready()
+    # One LLM round trip so the OpenAI client and its connection are warm.
+    get_llm().invoke("Reply with the single word: ready")
+
+
+def warm_up() -> None:
+    """
+    Build and warm everything /chat needs, retrying with backoff until it
+    works (or the app shuts down). /readyz reports the outcome.
+    """
+    start = time.perf_counter()
+    attempt = 0
+    _readiness.update(state="warming", error=None)
+    while not _warmup_stop.is_set():
         try:
-            _policy_rag_chain_fastapi = build_policy_rag_chain()
+            _warm_up_once()
         except Exception as e:
-            print(
-                "⚠️  Warning: Could not initialize Apollo policies RAG chain in FastAPI mode.\n"
-                f"   Reason: {e}\n"
-                "   RAG_AGENT route will not work until this is fixed.\n"
-            )
-            _policy_rag_chain_fastapi = None
+            attempt += 1
+            delay = min(WARMUP_RETRY_MAX_SECONDS, 2 ** attempt)
+            _readiness.update(state="warming", error=str(e))
+            print(f"[Startup] Warm-up failed (attempt {attempt}), retrying in {delay:.0f}s: {e}")
+            _warmup_stop.wait(delay)
+            continue
+        _readiness.update(
+            state="ready",
+            error=None,
+            warmup_seconds=round(time.perf_counter() - start, 2),
+        )
+        print(f"[Startup] Ready after {_readiness['warmup_seconds']}s")
+        return
 
-    if _intent_crew_fastapi is None:
-        llm = get_llm()
-        _intent_crew_fastapi = build_intent_crew(llm)
 
 def _clean_list_style_answer(text: str) -> str:
     """
@@ -1250,18 +3188,236 @@ def _parse_list_to_table_data(cleaned_text: str) -> dict:
         "values": parsed_rows
     }
 
-#jflgjhawiurhgo
-def answer_hospital_query(user_q: str, chat_id: Optional[str] = None) -> "ChatResponse":
-    """Single entry point used by the FastAPI backend for each user query."""
+def _build_augmented_query(user_q: str, history: List[dict], last_ctx: dict) -> str:
+    """Prefix the question with recent history + last DB context as a hint."""
+    if not history and not last_ctx:
+        return user_q
+
+    history_lines = [
+        f"{m['role']}: {m['content']}"
+        for m in history[-6:]
+    ]
+    history_block = "\n".join(history_lines)
+    ctx_block = ""
+    if last_ctx:
+        ctx_block = (
+            "\n\nLast DB context (may be useful, but can be ignored if irrelevant): "
+            f"entity_type={last_ctx.get('last_entity_type')}, "
+            f"last_sql_query={last_ctx.get('last_sql_query')}, "
+            f"last_patient_ids={last_ctx.get('last_patient_ids')}"
+        )
+
+    return (
+        f"{history_block}{ctx_block}\n\nCurrent user question: {user_q}"
+        if history_block or ctx_block
+        else user_q
+    )
+
+
+def _text2sql_answer(sql_result: SQLQueryResult):
+    """
+    Clean the agent's answer. Returns (final_answer, sql_for_table);
+    sql_for_table is None when the answer is a single line and should go to
+    the UI as-is.
+    """
+    # sql_result is SQLQueryResult(question, sql_query, final_answer)
+    print("RAW SQL RESULT OBJECT:", sql_result)
+    print("SQL QUERY:", sql_result.sql_query)
+    final_answer = _clean_list_style_answer(sql_result.final_answer)
+    answer_lines = [line.strip() for line in final_answer.split("\n") if line.strip()]
+
+    # If ONLY ONE LINE → Do NOT parse, return immediately
+    if len(answer_lines) <= 1:
+        print("Single-line answer → sending directly to UI")
+        return final_answer, None
+
+    return final_answer, sql_result.sql_query or ""
+
+
+def _text2sql_table_response(final_answer: str, table_dict, route: str) -> "ChatResponse":
+    tables: List[TableData] = []
+    if table_dict:
+        tables.append(TableData(
+            columns=table_dict["columns"],
+            values=table_dict["values"]
+        ))
+    else:
+        # FALLBACK: Try to parse the cleaned text into a table
+        parsed_table = _parse_list_to_table_data(final_answer)
+        if parsed_table:
+            tables.append(parsed_table)
+            print("Generated table data by parsing LLM text output as a single column list.")
+
+    response = ChatResponse(
+        result=final_answer,
+        data=tables,
+        route=route,
+    )
+    print("=== FINAL CHAT RESPONSE FOR UI ===")
+    print(f"Result (Cleaned Answer): {response.result[:70]}...")
+    print(f"Route: {response.route}")
+    print(f"Number of tables in 'data': {len(response.data)}")
+    if response.data:
+        # Print structure of the first table
+        first_table = response.data[0]
+        print(f"First Table Columns: {first_table.columns}")
+        print(f"First Table Row 1: {first_table.values[0] if first_table.values else 'No data rows'}")
+    return response
+
+
+def _text2sql_error_response(e: Exception, route: str):
+    """
+    Turn a Text2SQL failure into a response. Returns (response, persist):
+    parsing errors salvage the LLM's answer and are saved to the chat,
+    anything else gets a generic message that is not.
+    """
+    msg = str(e)
+    if "OUTPUT_PARSING_FAILURE" in msg or "Could not parse LLM output" in msg:
+        extracted = None
+
+        # Often the raw LLM output is wrapped in backticks `...`
+        if "`" in msg:
+            parts = msg.split("`")
+            if len(parts) >= 3:
+                extracted = parts[1]
+
+        fallback_answer = extracted or (
+            "I ran a database query but there was a formatting error while "
+            "parsing the answer. Here is the raw message:\n" + msg
+        )
+        return ChatResponse(result=fallback_answer, data=[], route=route), True
+
+    print(f"[FastAPI/TEXT2SQL_AGENT] Error: {e}")
+    return ChatResponse(
+        result=(
+            "There was an error while querying the hospital database. "
+            "Please rephrase your question or try again."
+        ),
+        data=[],
+        route=route,
+    ), False
+
+
+def _context_update(sql_for_table: str, table_dict) -> dict:
+    entity_type, patient_ids = infer_entity_and_ids(sql_for_table, table_dict)
+    return dict(entity_type=entity_type, sql_query=sql_for_table, patient_ids=patient_ids)
+
+
+def _sql_cache_vector(user_q: str):
+    """Normalised embedding of a self-contained question, or None (skip the cache)."""
+    if not SQL_CACHE_ENABLED or not _is_self_contained(user_q):
+        return None
+    try:
+        return sql_cache.embed(user_q)
+    except Exception as e:
+        print(f"[SQLCache] Embedding failed, skipping cache: {e}")
+        return None
+
+
+def _sql_cache_response(user_q: str, sql: str, answer: str, columns, rows, route: str):
+    """(response, context) for an answer built from re-running cached SQL."""
+    sql_result = SQLQueryResult(question=user_q, sql_query=sql, final_answer=answer)
+    final_answer, sql_for_table = _text2sql_answer(sql_result)
+    if sql_for_table is None:
+        return ChatResponse(result=final_answer, data=[], route=route), None
+    table_dict = _rows_to_table(columns, rows)
+    response = _text2sql_table_response(final_answer, table_dict, route)
+    return response, _context_update(sql_for_table, table_dict)
+
+
+def _answer_from_sql_cache(user_q: str, vector, route: str):
+    """
+    Re-run the SQL cached for the closest earlier question. Returns
+    (response, context, sql), or None on a miss or when the SQL fails (the
+    caller then asks the agent).
+    """
+    entry = sql_cache.lookup(vector, user_q) if vector is not None else None
+    if entry is None:
+        return None
+    try:
+        columns, rows = run_select(entry.sql)
+    except Exception as e:
+        sql_cache.record_failure(entry, e)
+        return None
+    sql_cache.record_success(entry)
+    answer = summarize_sql_result(user_q, entry.sql, columns, rows)
+    return (*_sql_cache_response(user_q, entry.sql, answer, columns, rows, route), entry.sql)
+
+
+async def _answer_from_sql_cache_async(user_q: str, vector, route: str):
+    entry = sql_cache.lookup(vector, user_q) if vector is not None else None
+    if entry is None:
+        return None
+    try:
+        columns, rows = await run_select_async(entry.sql)
+    except Exception as e:
+        sql_cache.record_failure(entry, e)
+        return None
+    sql_cache.record_success(entry)
+    answer = await summarize_sql_result_async(user_q, entry.sql, columns, rows)
+    return (*_sql_cache_response(user_q, entry.sql, answer, columns, rows, route), entry.sql)
+
+
+def _remember_sql(user_q: str, sql_result: SQLQueryResult, vector) -> None:
+    """Cache the SQL the agent ran for this question (plain SELECTs only)."""
+    if vector is not None and _is_select(sql_result.sql_query):
+        sql_cache.store(user_q, sql_result.sql_query, vector)
+
+
+RAG_NOT_READY_REPLY = (
+    "RAG is not initialized (policy documents are not loaded or there "
+    "was an error in setup). Please contact the administrator."
+)
+RAG_ERROR_REPLY = (
+    "Sorry, there was an error while looking up the policy documents. "
+    "Please try again."
+)
+OTHER_AGENT_ERROR_REPLY = (
+    "I’m here to help with hospital database information and Apollo "
+    "policy documents. Please try asking a hospital or policy question."
+)
+
+
+def _persist_turn(chat_id, user_q: str, response: "ChatResponse", context: Optional[dict] = None) -> None:
+    """Save the turn (and the Text2SQL context, if any) for follow-up questions."""
+    if not chat_id:
+        return
+    try:
+        save_chat_turn(chat_id, user_q, response.result)
+    except Exception as e:
+        print(f"[FastAPI] Failed to save chat turn for {response.route}: {e}")
+    if context is not None:
+        try:
+            update_last_context(chat_id=chat_id, **context)
+        except Exception as e:
+            print(f"[FastAPI] Failed to update last context: {e}")
+
+
+async def _persist_turn_async(chat_id, user_q: str, response: "ChatResponse", context: Optional[dict] = None) -> None:
+    if not chat_id:
+        return
+    try:
+        await save_chat_turn_async(chat_id, user_q, response.result)
+    except Exception as e:
+        print(f"[FastAPI] Failed to save chat turn for {response.route}: {e}")
+    if context is not None:
+        try:
+            await update_last_context_async(chat_id=chat_id, **context)
+        except Exception as e:
+            print(f"[FastAPI] Failed to update last context: {e}")
+
+
+def answer_hospital_query(user_q: str, chat_id: Optional[str] = None):
+    """
+    Single entry point used by the FastAPI backend for each user query.
+    Returns (ChatResponse, route).
+    """
     _ensure_fastapi_agents_ready()
 
     # Normalise the text
     user_q = user_q.strip()
     if not user_q:
-        return ChatResponse(
-            result="Please enter a non-empty question.",
-            data=[],
-        )
+        return ChatResponse(result="Please enter a non-empty question.", data=[], route="UNKNOWN"), "UNKNOWN"
 
     # --- Load recent history + last context (if we have a chat_id) ---
     history: List[dict] = []
@@ -1273,219 +3429,254 @@ def answer_hospital_query(user_q: str, chat_id: Optional[str] = None) -> "ChatRe
         except Exception as e:
             print(f"[FastAPI] Failed to load chat history for chat_id={chat_id}: {e}")
 
-    # Build an augmented query that includes recent history + last context as hint
-    augmented_q = user_q
-    if history or last_ctx:
-        history_lines = [
-            f"{m['role']}: {m['content']}"
-            for m in history[-6:]
-        ]
-        history_block = "\n".join(history_lines)
-        ctx_block = ""
-        if last_ctx:
-            ctx_block = (
-                "\n\nLast DB context (may be useful, but can be ignored if irrelevant): "
-                f"entity_type={last_ctx.get('last_entity_type')}, "
-                f"last_sql_query={last_ctx.get('last_sql_query')}, "
-                f"last_patient_ids={last_ctx.get('last_patient_ids')}"
-            )
-
-        augmented_q = (
-            f"{history_block}{ctx_block}\n\nCurrent user question: {user_q}"
-            if history_block or ctx_block
-            else user_q
-        )
+    augmented_q = _build_augmented_query(user_q, history, last_ctx)
 
     # -------- INTENT AGENT ROUTING --------
-    route = route_with_intent(_intent_crew_fastapi, augmented_q)
+    route = route_with_intent(_intent_crew_fastapi, augmented_q, user_message=user_q)
     print(route)
+
     # TEXT2SQL route
     if route == "TEXT2SQL_AGENT":
         try:
-            sql_result = ask_text2sql_question(_text2sql_agent_fastapi, augmented_q)
-            # sql_result is SQLQueryResult(question, sql_query, final_answer)
-            print("RAW SQL RESULT OBJECT:", sql_result)
-            print("SQL QUERY:", sql_result.sql_query)
-            final_answer = _clean_list_style_answer(sql_result.final_answer)
-            # --- NEW: Single-line or Multi-line decision ---
-            answer_lines = [line.strip() for line in final_answer.split("\n") if line.strip()]
-
-# If ONLY ONE LINE → Do NOT parse, return immediately
-            if len(answer_lines) <= 1:
-                response = ChatResponse(
-                    result=final_answer,
-                    data=[],           # No table
-                    route=route,
-                )
-                print("Single-line answer → sending directly to UI")
-    
-                if chat_id:
-                    try:
-                        save_chat_turn(chat_id, user_q, response.result)
-                    except Exception as e:
-                        print(f"[FastAPI] Failed to save chat turn: {e}")
-
+            vector = _sql_cache_vector(user_q)
+            cached = _answer_from_sql_cache(user_q, vector, route)
+            if cached:
+                response, context, _ = cached
+                _persist_turn(chat_id, user_q, response, context)
                 return response, route
 
-            sql_for_table = sql_result.sql_query
-            if not sql_for_table:
-                sql_for_table = last_ctx.get("last_sql_query") or ""
-                print(f"SQL QUERY was empty, falling back to context SQL: {sql_for_table}")
-            table_dict = build_table_from_sql(sql_for_table)
-            
-            tables: List[TableData] = []
-            if table_dict:
-                tables.append(TableData(
-                columns=table_dict["columns"],
-                values=table_dict["values"]
-            ))
-            else:
-                # 4. FALLBACK: Try to parse the cleaned text into a table
-                parsed_table = _parse_list_to_table_data(final_answer)
-                if parsed_table:
-                    tables.append(parsed_table)
-                    print("Generated table data by parsing LLM text output as a single column list.")
-            # tables: List[TableData] = []
-            # if table_dict is not None:
-            #     tables.append(TableData(**table_dict))
-            response = ChatResponse(
-                result=final_answer,
-                data=tables,
-                route=route,
-            )
-            print("=== FINAL CHAT RESPONSE FOR UI ===")
-            print(f"Result (Cleaned Answer): {response.result[:70]}...")
-            print(f"Route: {response.route}")
-            print(f"Number of tables in 'data': {len(response.data)}")
-            if response.data:
-                # Print structure of the first table
-                first_table = response.data[0]
-                print(f"First Table Columns: {first_table.columns}")
-                print(f"First Table Row 1: {first_table.values[0] if first_table.values else 'No data rows'}")
-            # --- END VERIFICATION STEP ---
-
-            # Persist conversation + context
-            if chat_id:
-                try:
-                    save_chat_turn(chat_id, user_q, response.result)
-                except Exception as e:
-                    print(f"[FastAPI] Failed to save chat turn: {e}")
+            sql_result, result_set = ask_text2sql(_text2sql_agent_fastapi, augmented_q, user_q)
+            _remember_sql(user_q, sql_result, vector)
+            final_answer, sql_for_table = _text2sql_answer(sql_result)
+            if sql_for_table is None:
+                response = ChatResponse(result=final_answer, data=[], route=route)
+                _persist_turn(chat_id, user_q, response)
+                return response, route
 
-                try:
-                    entity_type, patient_ids = infer_entity_and_ids(
-                        sql_for_table,
-                        table_dict,
-                    )
-                    update_last_context(
-                        chat_id=chat_id,
-                        entity_type=entity_type,
-                        sql_query=sql_for_table,
-                        patient_ids=patient_ids,
-                    )
-                except Exception as e:
-                    print(f"[FastAPI] Failed to update last context: {e}")
-            print("=== SQL AGENT RESPONSE SENT TO UI ===")
-            print(response.model_dump_json(indent=2))
-            return response,route
+            table_dict = _rows_to_table(*result_set) if result_set else None
+            response = _text2sql_table_response(final_answer, table_dict, route)
+            _persist_turn(chat_id, user_q, response, _context_update(sql_for_table, table_dict))
+            return response, route
         except Exception as e:
-            # ✅ NEW: try to salvage the natural-language answer from parsing errors
-            msg = str(e)
-            if "OUTPUT_PARSING_FAILURE" in msg or "Could not parse LLM output" in msg:
-                extracted = None
-
-                # Often the raw LLM output is wrapped in backticks `...`
-                if "`" in msg:
-                    parts = msg.split("`")
-                    if len(parts) >= 3:
-                        extracted = parts[1]
-
-                fallback_answer = extracted or (
-                    "I ran a database query but there was a formatting error while "
-                    "parsing the answer. Here is the raw message:\n" + msg
-                )
-
-                response = ChatResponse(result=fallback_answer, data=[],route=route,)
-                if chat_id:
-                    try:
-                        save_chat_turn(chat_id, user_q, response.result)
-                    except Exception as e2:
-                        print(f"[FastAPI] Failed to save chat turn after parsing error: {e2}")
-                return response,route
-
-            # If it's some other kind of error, keep the old behaviour
-            print(f"[FastAPI/TEXT2SQL_AGENT] Error: {e}")
-            return ChatResponse(
-                result=(
-                    "There was an error while querying the hospital database. "
-                    "Please rephrase your question or try again."
-                ),
-                data=[],
-                route=route,
-            )
+            response, persist = _text2sql_error_response(e, route)
+            if persist:
+                _persist_turn(chat_id, user_q, response)
+            return response, route
 
     # RAG route
     if route == "RAG_AGENT":
-        if _policy_rag_chain_fastapi is None:
-            response = ChatResponse(
-                result=(
-                    "RAG is not initialized (policy documents are not loaded or there "
-                    "was an error in setup). Please contact the administrator."
-                ),
-              route=route,
-            )
-            if chat_id:
-                try:
-                    save_chat_turn(chat_id, user_q, response.result)
-                except Exception as e:
-                    print(f"[FastAPI] Failed to save chat turn for RAG_AGENT: {e}")
-            return response,route
+        if _ensure_policy_rag_chain() is None:
+            response = ChatResponse(result=RAG_NOT_READY_REPLY, data=[], route=route)
+            _persist_turn(chat_id, user_q, response)
+            return response, route
 
         try:
             answer = ask_policy_question(_policy_rag_chain_fastapi, augmented_q)
-            response = ChatResponse(result=answer, data=[],route=route,)
-            if chat_id:
-                try:
-                    save_chat_turn(chat_id, user_q, response.result)
-                except Exception as e:
-                    print(f"[FastAPI] Failed to save chat turn for RAG_AGENT: {e}")
-            return response,route
         except Exception as e:
             print(f"[FastAPI/RAG] Error: {e}")
-            return ChatResponse(
-                result=(
-                    "Sorry, there was an error while looking up the policy documents. "
-                    "Please try again."
-                ),
-                data=[],
-                route=route,
-            )
+            return ChatResponse(result=RAG_ERROR_REPLY, data=[], route=route), route
+        response = ChatResponse(result=answer, data=[], route=route)
+        _persist_turn(chat_id, user_q, response)
+        return response, route
 
     # OTHER_AGENT route (greetings, small talk, out-of-scope)
-    if route == "OTHER_AGENT":
+    try:
+        reply = generate_other_agent_reply(augmented_q)
+    except Exception as e:
+        print(f"[FastAPI/OTHER_AGENT] Error: {e}")
+        return ChatResponse(result=OTHER_AGENT_ERROR_REPLY, data=[], route=route), route
+    response = ChatResponse(result=reply, data=[], route=route)
+    _persist_turn(chat_id, user_q, response)
+    return response, route
+
+
+async def answer_hospital_query_async(user_q: str, chat_id: Optional[str] = None):
+    """
+    Async version of answer_hospital_query used by /chat: LLM calls go
+    through ainvoke and history/persistence through the asyncpg engine, so
+    a request waiting on OpenAI or Postgres does not hold a worker thread.
+    Returns (ChatResponse, route).
+    """
+    # Building the agents is slow, blocking work; do it off the event loop.
+    await _ensure_fastapi_agents_ready_async()
+
+    user_q = user_q.strip()
+    if not user_q:
+        return ChatResponse(result="Please enter a non-empty question.", data=[], route="UNKNOWN"), "UNKNOWN"
+
+    history: List[dict] = []
+    last_ctx: dict = {}
+    if chat_id:
         try:
-            reply = generate_other_agent_reply(augmented_q)
-            response = ChatResponse(result=reply, data=[],route=route)
-            if chat_id:
-                try:
-                    save_chat_turn(chat_id, user_q, response.result)
-                except Exception as e:
-                    print(f"[FastAPI] Failed to save chat turn for OTHER_AGENT: {e}")
-            return response,route
+            history, last_ctx = await asyncio.gather(
+                get_chat_history_async(chat_id, limit=10),
+                get_last_context_async(chat_id),
+            )
         except Exception as e:
-            print(f"[FastAPI/OTHER_AGENT] Error: {e}")
-            return ChatResponse(
-                result=(
-                    "I’m here to help with hospital database information and Apollo "
-                    "policy documents. Please try asking a hospital or policy question."
-                ),
-                data=[],
-                route=route,
+            print(f"[FastAPI] Failed to load chat history for chat_id={chat_id}: {e}")
+
+    augmented_q = _build_augmented_query(user_q, history, last_ctx)
+
+    route = await route_with_intent_async(_intent_crew_fastapi, augmented_q, user_message=user_q)
+    print(route)
+
+    if route == "TEXT2SQL_AGENT":
+        try:
+            vector = await asyncio.to_thread(_sql_cache_vector, user_q)
+            cached = await _answer_from_sql_cache_async(user_q, vector, route)
+            if cached:
+                response, context, _ = cached
+                await _persist_turn_async(chat_id, user_q, response, context)
+                return response, route
+
+            sql_result, result_set = await ask_text2sql_async(_text2sql_agent_fastapi, augmented_q, user_q)
+            _remember_sql(user_q, sql_result, vector)
+            final_answer, sql_for_table = _text2sql_answer(sql_result)
+            if sql_for_table is None:
+                response = ChatResponse(result=final_answer, data=[], route=route)
+                await _persist_turn_async(chat_id, user_q, response)
+                return response, route
+
+            table_dict = _rows_to_table(*result_set) if result_set else None
+            response = _text2sql_table_response(final_answer, table_dict, route)
+            await _persist_turn_async(chat_id, user_q, response, _context_update(sql_for_table, table_dict))
+            return response, route
+        except Exception as e:
+            response, persist = _text2sql_error_response(e, route)
+            if persist:
+                await _persist_turn_async(chat_id, user_q, response)
+            return response, route
+
+    if route == "RAG_AGENT":
+        if await asyncio.to_thread(_ensure_policy_rag_chain) is None:
+            response = ChatResponse(result=RAG_NOT_READY_REPLY, data=[], route=route)
+            await _persist_turn_async(chat_id, user_q, response)
+            return response, route
+
+        try:
+            answer = await ask_policy_question_async(_policy_rag_chain_fastapi, augmented_q)
+        except Exception as e:
+            print(f"[FastAPI/RAG] Error: {e}")
+            return ChatResponse(result=RAG_ERROR_REPLY, data=[], route=route), route
+        response = ChatResponse(result=answer, data=[], route=route)
+        await _persist_turn_async(chat_id, user_q, response)
+        return response, route
+
+    try:
+        reply = await generate_other_agent_reply_async(augmented_q)
+    except Exception as e:
+        print(f"[FastAPI/OTHER_AGENT] Error: {e}")
+        return ChatResponse(result=OTHER_AGENT_ERROR_REPLY, data=[], route=route), route
+    response = ChatResponse(result=reply, data=[], route=route)
+    await _persist_turn_async(chat_id, user_q, response)
+    return response, route
+
+
+
+
+
+async def answer_hospital_query_stream(user_q: str, chat_id: Optional[str] = None):
+    """
+    Streaming version of answer_hospital_query_async for /chat/stream.
+    Async generator of (event, data) pairs, in order:
+      route   as soon as the intent agent decides
+      sql     each query the Text2SQL agent runs
+      token   pieces of the answer as the LLM produces them
+      table   the table payload (possibly empty)
+      done    the final ChatResponse (same content /chat returns)
+    """
+    await _ensure_fastapi_agents_ready_async()
+
+    user_q = user_q.strip()
+    if not user_q:
+        yield "done", ChatResponse(result="Please enter a non-empty question.", data=[], route="UNKNOWN")
+        return
+
+    history: List[dict] = []
+    last_ctx: dict = {}
+    if chat_id:
+        try:
+            history, last_ctx = await asyncio.gather(
+                get_chat_history_async(chat_id, limit=10),
+                get_last_context_async(chat_id),
             )
+        except Exception as e:
+            print(f"[FastAPI] Failed to load chat history for chat_id={chat_id}: {e}")
 
+    augmented_q = _build_augmented_query(user_q, history, last_ctx)
 
+    route = await route_with_intent_async(_intent_crew_fastapi, augmented_q, user_message=user_q)
+    yield "route", {"route": route}
 
+    if route == "TEXT2SQL_AGENT":
+        try:
+            vector = await asyncio.to_thread(_sql_cache_vector, user_q)
+            cached = await _answer_from_sql_cache_async(user_q, vector, route)
+            if cached:
+                response, context, cached_sql = cached
+                yield "sql", {"sql": cached_sql}
+                yield "token", {"text": response.result}
+            else:
+                agent = _ensure_text2sql_stream_agent()
+                sql_result = result_set = None
+                async for event, data in stream_text2sql(agent, augmented_q, user_q):
+                    if event == "result":
+                        sql_result, result_set = data
+                    else:
+                        yield event, data
+
+                _remember_sql(user_q, sql_result, vector)
+                final_answer, sql_for_table = _text2sql_answer(sql_result)
+                context = None
+                if sql_for_table is None:
+                    response = ChatResponse(result=final_answer, data=[], route=route)
+                else:
+                    table_dict = _rows_to_table(*result_set) if result_set else None
+                    response = _text2sql_table_response(final_answer, table_dict, route)
+                    context = _context_update(sql_for_table, table_dict)
+            await _persist_turn_async(chat_id, user_q, response, context)
+        except Exception as e:
+            response, persist = _text2sql_error_response(e, route)
+            if persist:
+                await _persist_turn_async(chat_id, user_q, response)
+
+    elif route == "RAG_AGENT":
+        if await asyncio.to_thread(_ensure_policy_rag_chain) is None:
+            response = ChatResponse(result=RAG_NOT_READY_REPLY, data=[], route=route)
+            await _persist_turn_async(chat_id, user_q, response)
+        else:
+            try:
+                answer = ""
+                async for event in _policy_rag_chain_fastapi.astream_events(
+                    {"query": augmented_q}, version="v2"
+                ):
+                    if event["event"] == "on_chat_model_stream":
+                        text = event["data"]["chunk"].content
+                        if text:
+                            yield "token", {"text": text}
+                    elif event["event"] == "on_chain_end" and not event.get("parent_ids"):
+                        answer = _policy_answer(event["data"].get("output"))
+                response = ChatResponse(result=answer, data=[], route=route)
+                await _persist_turn_async(chat_id, user_q, response)
+            except Exception as e:
+                print(f"[FastAPI/RAG] Error: {e}")
+                response = ChatResponse(result=RAG_ERROR_REPLY, data=[], route=route)
 
+    else:
+        try:
+            parts = []
+            async for chunk in get_llm(streaming=True).astream(_other_agent_prompt(augmented_q)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield "token", {"text": chunk.content}
+            response = ChatResponse(result="".join(parts).strip(), data=[], route=route)
+            await _persist_turn_async(chat_id, user_q, response)
+        except Exception as e:
+            print(f"[FastAPI/OTHER_AGENT] Error: {e}")
+            response = ChatResponse(result=OTHER_AGENT_ERROR_REPLY, data=[], route=route)
 
+    yield "table", {"data": [t.model_dump() for t in response.data]}
+    yield "done", response
 
 
 # ----------------------- FastAPI app definition -----------------------
@@ -1541,7 +3732,33 @@ class LoginRequest(BaseModel):
 
 
 
-app = FastAPI(title="Hospital + Apollo Policy Chatbot Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start background jobs and warm up in the background; the server accepts
+    connections right away so /healthz answers while /readyz says 503.
+    """
+    start_summary_view_refresher()
+    start_schema_watch()
+    chat_writer.start()
+    _warmup_stop.clear()
+    warmup_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    try:
+        yield
+    finally:
+        _warmup_stop.set()
+        stop_summary_view_refresher()
+        stop_schema_watch()
+        chat_writer.stop()
+        if warmup_task.done() and not warmup_task.cancelled() and warmup_task.exception():
+            print(f"[Startup] Warm-up crashed: {warmup_task.exception()}")
+
+
+app = FastAPI(
+    title="Hospital + Apollo Policy Chatbot Backend",
+    version="1.0.0",
+    lifespan=lifespan,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1556,8 +3773,39 @@ app.add_middleware(
 )
 
 
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 once warm-up finished, 503 until then."""
+    body = {
+        "status": _readiness["state"],
+        "error": _readiness["error"],
+        "warmup_seconds": _readiness["warmup_seconds"],
+        "rag_available": _policy_rag_chain_fastapi is not None,
+        "rag_error": _rag_state["error"],
+    }
+    if _readiness["state"] != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+CHAT_ERROR_REPLY = (
+    "Sorry, something went wrong while processing your request. "
+    "Please try again in a moment."
+)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest):
     """Endpoint used by the React UI (MedicalBotUI.tsx)."""
     user_message = req.message.strip()
     # Use chat_id from the UI if provided; otherwise create a new one
@@ -1565,40 +3813,88 @@ def chat_endpoint(req: ChatRequest):
     user_email = req.email
     name = req.username
     try:
-        response,route = answer_hospital_query(user_message, chat_id=chat_id)
+        response, route = await answer_hospital_query_async(user_message, chat_id=chat_id)
     except Exception as e:
         print(f"[FastAPI] Unhandled error while answering query: {e}")
-        response = ChatResponse(
-            result=(
-                "Sorry, something went wrong while processing your request. "
-                "Please try again in a moment."
-            ),
-            data=[],
-        )
         route = "UNKNOWN"
-    conn = get_pg_connection()
-    cursor = conn.cursor()
-    try:
-        # Save USER message
-        cursor.execute(
-            "INSERT INTO chat_history (chat_id, user_email, sender, message,route, timestamp,username) VALUES (%s,%s, %s, %s, %s, %s, %s)",
-            (chat_id, user_email, "user", user_message,route, datetime.now(),name)
-        )
-        # Save BOT reply ← bot_reply is the parameter/variable name
-        cursor.execute(
-            "INSERT INTO chat_history (chat_id, user_email, sender, message,route, timestamp,username) VALUES (%s,%s, %s, %s, %s, %s, %s)",
-            (chat_id, user_email, "bot", response.result,route, datetime.now(),name)
-        )
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
+        response = ChatResponse(result=CHAT_ERROR_REPLY, data=[], route=route)
+    # Save USER message + BOT reply
+    await save_chat_history_rows_async(
+        _chat_history_rows(chat_id, user_email, name, user_message, response.result, route)
+    )
     return ChatResponse(
         chat_id=chat_id,
-    result=response.result,
-    data=response.data,
-    route=route
-)
+        result=response.result,
+        data=response.data,
+        route=route
+    )
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """
+    Same request as /chat, answered as server-sent events (see
+    answer_hospital_query_stream). The closing "done" event carries the
+    same JSON body /chat would have returned.
+    """
+    user_message = req.message.strip()
+    chat_id = req.chat_id or str(uuid.uuid4())
+
+    async def events():
+        route = "UNKNOWN"
+        response = None
+        try:
+            async for event, data in answer_hospital_query_stream(user_message, chat_id=chat_id):
+                if event == "done":
+                    response = data
+                    continue
+                if event == "route":
+                    route = data["route"]
+                yield _sse(event, data)
+        except Exception as e:
+            print(f"[FastAPI] Unhandled error while streaming answer: {e}")
+            response = ChatResponse(result=CHAT_ERROR_REPLY, data=[], route=route)
+            yield _sse("table", {"data": []})
+
+        route = response.route
+        await save_chat_history_rows_async(
+            _chat_history_rows(chat_id, req.email, req.username, user_message, response.result, route)
+        )
+        final = ChatResponse(chat_id=chat_id, result=response.result, data=response.data, route=route)
+        yield _sse("done", final.model_dump())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics/routing")
+def routing_metrics():
+    """How routes were decided (cache / local classifier / CrewAI) and route cache stats."""
+    with _routing_stats_lock:
+        decisions = dict(routing_stats)
+    return {"decisions": decisions, "route_cache": route_cache.stats()}
+
+
+@app.get("/metrics/sql-cache")
+def sql_cache_metrics():
+    """Semantic Text2SQL cache size, hit rate and evictions."""
+    return sql_cache.stats()
+
+
+@app.get("/metrics/text2sql")
+def text2sql_metrics():
+    """LLM calls and latency per Text2SQL mode (agent / single_shot / single_shot_fallback)."""
+    return text2sql_stats.snapshot()
+
+
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    """Pool occupancy and checkout wait times, for sizing DB_POOL_* per worker."""
+    return get_pool_metrics()
+
 
 @app.post("/signup")
 def signup(req: SignUpRequest):
@@ -1648,7 +3944,7 @@ def login(req: LoginRequest):
 
 
 @app.post("/save-chat")
-async def save_chat_history(chat: ChatRequest, user_email: str = "guest"):
+def save_chat_history(chat: ChatRequest, user_email: str = "guest"):
     conn = get_pg_connection()
     cursor = conn.cursor()
     chat_id = chat.chat_id or int(datetime.now().timestamp() * 1000)
@@ -1666,7 +3962,7 @@ async def save_chat_history(chat: ChatRequest, user_email: str = "guest"):
 
 
 @app.post("/save-search")
-async def save_search(search: SearchQuery):
+def save_search(search: SearchQuery):
     conn = get_pg_connection()
     cursor = conn.cursor()
     try:
@@ -1683,7 +3979,7 @@ async def save_search(search: SearchQuery):
 
 
 @app.get("/load-search-history")
-async def load_search_history(user_email: str = "guest"):
+def load_search_history(user_email: str = "guest"):
     conn = get_pg_connection()
     cursor = conn.cursor()
     try:
@@ -1704,7 +4000,11 @@ async def load_search_history(user_email: str = "guest"):
 
 
 @app.get("/load-chat-history")
-async def load_chat_history(user_email: str = "guest", chat_id: Optional[int] = None):
+def load_chat_history(user_email: str = "guest", chat_id: Optional[int] = None):
+    # Rows for the last turn may still be in the write-behind queue.
+    # Plain def (like the other psycopg2 endpoints) so this wait and the
+    # pool checkout run in FastAPI's threadpool, not on the event loop.
+    chat_writer.flush(timeout=CHAT_WRITE_FLUSH_SECONDS * 4)
     conn = get_pg_connection()
     cursor = conn.cursor()
     try:
@@ -1768,7 +4068,7 @@ def main():
             print("Bye.")
             break
 
-        route = route_with_intent(intent_crew, user_q)
+        route = route_with_intent(intent_crew, user_q, user_message=user_q)
 
         # TEXT2SQL: hospital DB route
         if route == "TEXT2SQL_AGENT":
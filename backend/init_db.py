@@ -1,5 +1,27 @@
-from ndb import create_tables
+import sys
+
+from ndb import (
+    create_tables, create_indexes, ensure_partitions, migrate_to_partitioned,
+    create_summary_views, PARTITIONED_TABLES,
+)
 
 if __name__ == "__main__":
-    create_tables()
-    print("Tables created successfully!")
+    if "--indexes-concurrently" in sys.argv:
+        # Existing database: add missing indexes without blocking writes.
+        create_indexes(concurrently=True)
+        print("Indexes created successfully!")
+    elif "--migrate-partitions" in sys.argv:
+        # Existing database: convert flat appointments/chat_history tables.
+        for table in PARTITIONED_TABLES:
+            migrate_to_partitioned(table)
+    elif "--maintain-partitions" in sys.argv:
+        # Run periodically (e.g. daily cron) to create upcoming months.
+        for table in PARTITIONED_TABLES:
+            created = ensure_partitions(table)
+            print(f"{table}: created {created or 'no new partitions'}")
+    else:
+        # --partitioned only partitions appointments; chat_history isn't
+        # created here, partition an existing one with --migrate-partitions.
+        create_tables(partitioned="--partitioned" in sys.argv)
+        create_summary_views()
+        print("Tables created successfully!")
@@ -0,0 +1,250 @@
+"""
+Local fast path for intent routing.
+
+Keyword rules plus a TF-IDF + logistic regression model trained on the
+routes already logged in chat_history (one row per user message). When a
+rule fires, or the model is at least INTENT_CONFIDENCE_THRESHOLD sure,
+hospital_backend.route_with_intent uses that label and skips the CrewAI
+Intent Agent; otherwise it falls back to CrewAI as before.
+
+Training labels come from chat_history.route. Once this fast path (and
+the route cache) is live, those routes are no longer all CrewAI's: rows
+logged since then include the classifier's own decisions, so retraining
+on them reinforces its mistakes. Retrain on data logged before it was
+enabled, or review the labels first.
+
+Retrain and print an accuracy / latency report:
+
+    python intent_classifier.py train
+    python intent_classifier.py evaluate     # saved model vs. current logs
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+try:
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import classification_report
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import Pipeline
+except ImportError:  # rules still work without scikit-learn
+    joblib = None
+
+load_dotenv()
+
+LABELS = ("TEXT2SQL_AGENT", "RAG_AGENT", "OTHER_AGENT")
+
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.joblib")
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.85"))
+
+
+# --------------------------
+# KEYWORD RULES
+# --------------------------
+# A rule only decides when exactly one label matches; anything ambiguous
+# goes to the model (and then CrewAI).
+_DB_ENTITY = re.compile(
+    r"\b(patients?|doctors?|staff|appointments?|encounters?|bills?|billing|revenue|"
+    r"prescriptions?|medicines?|treatments?|diagnostic reports?|admitted|discharged)\b",
+    re.I,
+)
+# Only phrasings that ask for a figure or a listing; generic words such as
+# "who", "which", "show" or "last" also open policy and small-talk questions
+# ("who should staff report harassment to?") and are left to the model.
+_DB_ASK = re.compile(
+    r"\b(how many|number of|count|list( all)?|total|average|avg|top \d+)\b",
+    re.I,
+)
+_POLICY = re.compile(
+    r"\b(polic(y|ies)|anti[- ]?bribery|corruption|sexual harassment|posh|"
+    r"board diversity|human rights|archival|risk management|code of conduct|compliance)\b",
+    re.I,
+)
+_GREETING = re.compile(
+    r"^\W*(hi+|hello+|hey+( there)?|good (morning|afternoon|evening)|namaste|yo|sup|"
+    r"how are you|what'?s up|thanks?( you)?|thank you|bye)\b(?P<rest>.*)$",
+    re.I,
+)
+_GREETING_REST = re.compile(r"^\W*((i am|i'm|am|this is|my name is)\s+[\w .'-]{1,40})?\W*$", re.I)
+
+
+def rule_label(text):
+    """The label the keyword rules give `text`, or None."""
+    matches = set()
+    if _DB_ENTITY.search(text) and _DB_ASK.search(text):
+        matches.add("TEXT2SQL_AGENT")
+    if _POLICY.search(text):
+        matches.add("RAG_AGENT")
+    greeting = _GREETING.match(text.strip())
+    if greeting and _GREETING_REST.match(greeting.group("rest")):
+        matches.add("OTHER_AGENT")
+    return matches.pop() if len(matches) == 1 else None
+
+
+# --------------------------
+# CLASSIFIER
+# --------------------------
+class IntentClassifier:
+    def __init__(self, model=None, threshold=INTENT_CONFIDENCE_THRESHOLD):
+        self.model = model
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path=INTENT_MODEL_PATH, threshold=INTENT_CONFIDENCE_THRESHOLD):
+        """Saved model if there is one (and scikit-learn is installed), else rules only."""
+        model = None
+        if joblib is not None and os.path.exists(path):
+            model = joblib.load(path)["model"]
+        elif joblib is None:
+            print("[IntentClassifier] scikit-learn not installed, using keyword rules only")
+        return cls(model, threshold)
+
+    def predict(self, text):
+        """(label, confidence, source); label is None when not confident enough."""
+        label = rule_label(text)
+        if label:
+            return label, 1.0, "rules"
+        if self.model is None:
+            return None, 0.0, "none"
+        proba = self.model.predict_proba([text])[0]
+        best = proba.argmax()
+        confidence = float(proba[best])
+        if confidence < self.threshold:
+            return None, confidence, "model"
+        return str(self.model.classes_[best]), confidence, "model"
+
+
+def build_model():
+    return Pipeline([
+        ("tfidf", TfidfVectorizer(lowercase=True, ngram_range=(1, 2), sublinear_tf=True)),
+        ("clf", LogisticRegression(max_iter=1000, class_weight="balanced")),
+    ])
+
+
+# --------------------------
+# TRAINING DATA
+# --------------------------
+def load_logged_routes(db_uri=None):
+    """
+    (message, route) for every user message chat_history logged with a real
+    route. chat_history doesn't record who decided the route (CrewAI, the
+    route cache or this classifier), see the module docstring.
+    """
+    from sqlalchemy import create_engine, text
+
+    # Read DB_URI directly: importing hospital_backend for get_settings()
+    # would build its engines and load crewai/langchain for an offline CLI.
+    db_uri = db_uri or os.getenv("DB_URI")
+    if not db_uri:
+        raise SystemExit("Set DB_URI (or pass --db-uri) to load logged routes")
+    engine = create_engine(db_uri)
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT message, route FROM chat_history "
+                    "WHERE sender = 'user' AND route = ANY(:labels) AND message <> ''"
+                ),
+                {"labels": list(LABELS)},
+            ).fetchall()
+    finally:
+        engine.dispose()
+    return [(message, route) for message, route in rows]
+
+
+# --------------------------
+# REPORT
+# --------------------------
+def evaluate(classifier, texts, labels):
+    """Accuracy overall and on the confidently answered part, plus latency."""
+    latencies = []
+    answered = correct = model_correct = 0
+    sources = {"rules": 0, "model": 0, "none": 0}
+    for text, label in zip(texts, labels):
+        start = time.perf_counter()
+        predicted, _, source = classifier.predict(text)
+        latencies.append(time.perf_counter() - start)
+        if classifier.model is not None:
+            model_correct += classifier.model.predict([text])[0] == label
+        if predicted is not None:
+            answered += 1
+            correct += predicted == label
+            sources[source] += 1
+
+    ordered = sorted(latencies)
+    n = len(texts)
+    return {
+        "samples": n,
+        "threshold": classifier.threshold,
+        "coverage": round(answered / n, 4) if n else None,
+        "accuracy_when_answered": round(correct / answered, 4) if answered else None,
+        "model_accuracy_all": round(model_correct / n, 4) if n and classifier.model is not None else None,
+        "answered_by": sources,
+        "latency_ms_p50": round(ordered[n // 2] * 1000, 3) if n else None,
+        "latency_ms_p99": round(ordered[min(n - 1, int(n * 0.99))] * 1000, 3) if n else None,
+        "latency_ms_mean": round(statistics.fmean(latencies) * 1000, 3) if n else None,
+    }
+
+
+def train(rows, output=INTENT_MODEL_PATH, test_size=0.2, threshold=INTENT_CONFIDENCE_THRESHOLD, seed=42):
+    texts = [t for t, _ in rows]
+    labels = [l for _, l in rows]
+    if len(set(labels)) < 2:
+        raise SystemExit(f"Need logged routes for at least two labels, got {sorted(set(labels))}")
+
+    stratify = labels if min(labels.count(l) for l in set(labels)) >= 2 else None
+    x_train, x_test, y_train, y_test = train_test_split(
+        texts, labels, test_size=test_size, random_state=seed, stratify=stratify
+    )
+    model = build_model().fit(x_train, y_train)
+    held_out = evaluate(IntentClassifier(model, threshold), x_test, y_test)
+    held_out["per_class"] = classification_report(
+        y_test, model.predict(x_test), output_dict=True, zero_division=0
+    )
+
+    # Ship a model trained on everything; the report is from the held-out split.
+    final = build_model().fit(texts, labels)
+    report = {
+        "trained_at": datetime.now().isoformat(timespec="seconds"),
+        "samples": len(texts),
+        "label_counts": {l: labels.count(l) for l in sorted(set(labels))},
+        "held_out": held_out,
+    }
+    joblib.dump({"model": final, "report": report}, output)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train / evaluate the local intent classifier.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--db-uri", help="defaults to $DB_URI (.env is loaded)")
+    parser.add_argument("--model", default=INTENT_MODEL_PATH)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--threshold", type=float, default=INTENT_CONFIDENCE_THRESHOLD)
+    args = parser.parse_args()
+
+    if joblib is None:
+        raise SystemExit("scikit-learn is required: pip install scikit-learn")
+
+    rows = load_logged_routes(args.db_uri)
+    print(f"Loaded {len(rows)} logged user messages")
+
+    if args.command == "train":
+        report = train(rows, output=args.model, test_size=args.test_size, threshold=args.threshold)
+        print(f"Model written to {args.model}")
+    else:
+        classifier = IntentClassifier.load(args.model, threshold=args.threshold)
+        report = evaluate(classifier, [t for t, _ in rows], [l for _, l in rows])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
+import csv
+import io
 import os
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import date
 import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,18 +16,176 @@ DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
+DB_PORT = os.getenv("DB_PORT")
 
-def get_conn():
-    return psycopg2.connect(
-        host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS
+# Pool settings (same .env as the connection settings above)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "30"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_POOL_HEALTH_CHECK = os.getenv("DB_POOL_HEALTH_CHECK", "true").lower() not in ("0", "false", "no")
+
+
+def _connect_kwargs():
+    kwargs = dict(
+        host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+        connect_timeout=DB_CONNECT_TIMEOUT,
     )
+    if DB_PORT:
+        kwargs["port"] = DB_PORT
+    if DB_STATEMENT_TIMEOUT_MS:
+        kwargs["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return kwargs
 
 
-# ---------------------- CREATE TABLES ----------------------
-def create_tables():
-    conn = get_conn()
-    cur = conn.cursor()
+def get_conn():
+    """
+    Open a dedicated (unpooled) connection. The caller owns it and must
+    close it. Use this for DDL/maintenance work that needs its own session
+    (e.g. autocommit); normal reads and writes should go through transaction().
+    """
+    return psycopg2.connect(**_connect_kwargs())
+
+
+# ---------------------- CONNECTION POOL ----------------------
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_inherited_pools = []
+_local = threading.local()
+
+
+def _get_pool():
+    """
+    Return the process-wide pool, creating it on first use. The pool is
+    re-created after a fork so child processes never share sockets with
+    their parent.
+    """
+    global _pool, _pool_pid, _pool_slots
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if _pool is not None:
+                    # Inherited across fork: keep a reference so the parent's
+                    # connections are never finalised (and terminated) here.
+                    _inherited_pools.append(_pool)
+                _pool = pg_pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, **_connect_kwargs()
+                )
+                # ThreadedConnectionPool raises instead of waiting when it is
+                # exhausted, so callers queue on this semaphore first.
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection (e.g. on shutdown or after changing settings)."""
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            if _pool_pid == os.getpid():
+                _pool.closeall()
+            else:
+                _inherited_pools.append(_pool)
+        _pool = None
+        _pool_pid = None
+        _pool_slots = None
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    if not DB_POOL_HEALTH_CHECK:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    pool = _get_pool()
+    slots = _pool_slots
+    if not slots.acquire(timeout=DB_POOL_WAIT_TIMEOUT):
+        raise pg_pool.PoolError(
+            f"Timed out after {DB_POOL_WAIT_TIMEOUT}s waiting for a database connection"
+        )
+    try:
+        conn = pool.getconn()
+        if not _is_healthy(conn):
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        return pool, slots, conn
+    except Exception:
+        slots.release()
+        raise
+
+
+@contextmanager
+def transaction():
+    """
+    Run a block of work on one pooled connection inside one transaction.
+
+        with transaction() as conn, conn.cursor() as cur:
+            cur.execute(...)
+
+    Commits when the block exits normally and rolls back on any exception.
+    Nested transaction() calls on the same thread join the outer
+    transaction, so a caller can group several insert_* calls atomically:
+
+        with transaction():
+            p_id = insert_patient(...)
+            insert_appointment(patient_id=p_id, ...)
+    """
+    outer = getattr(_local, "conn", None)
+    if outer is not None:
+        yield outer
+        return
+
+    pool, slots, conn = _checkout()
+    _local.conn = conn
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        _local.conn = None
+        pool.putconn(conn, close=bool(conn.closed))
+        slots.release()
 
+
+# ---------------------- CREATE TABLES ----------------------
+def create_tables(partitioned=False):
+    """
+    Create every table plus the managed indexes (see INDEXES). On an existing,
+    populated database run create_indexes(concurrently=True) first so the
+    index builds here are no-ops instead of write-blocking builds.
+
+    With partitioned=True a fresh database gets appointments as a monthly
+    range-partitioned table (see PARTITIONING below). Only appointments:
+    chat_history is not created here, so it can only be partitioned with
+    migrate_to_partitioned("chat_history") (`python init_db.py
+    --migrate-partitions`) once it exists.
+    """
+    with transaction() as conn, conn.cursor() as cur:
+        _create_tables(cur, partitioned)
+        for name, table, columns in INDEXES:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {columns};")
+        if partitioned:
+            today = date.today()
+            _ensure_partitions(cur, "appointments", _add_months(today, -PARTITION_MONTHS_BACK), today)
+
+
+def _create_tables(cur, partitioned=False):
     # Patients
     cur.execute("""
         CREATE TABLE IF NOT EXISTS patients (
@@ -55,24 +221,43 @@ def create_tables():
     """)
 
     # Appointments
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS appointments (
-            appointment_id SERIAL PRIMARY KEY,
-            fhir_id VARCHAR(50),
-            patient_id INT REFERENCES patients(patient_id),
-            practitioner_id INT REFERENCES doctors(doctor_id),
-            encounter_date TIMESTAMP,
-            status TEXT,
-            reason TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
+    if partitioned:
+        # The partition key has to be part of the primary key, so
+        # appointment_id alone is no longer unique and encounter_id columns
+        # below cannot carry a foreign key to it.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS appointments (
+                appointment_id SERIAL,
+                fhir_id VARCHAR(50),
+                patient_id INT REFERENCES patients(patient_id),
+                practitioner_id INT REFERENCES doctors(doctor_id),
+                encounter_date TIMESTAMP NOT NULL,
+                status TEXT,
+                reason TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (appointment_id, encounter_date)
+            ) PARTITION BY RANGE (encounter_date);
+        """)
+    else:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS appointments (
+                appointment_id SERIAL PRIMARY KEY,
+                fhir_id VARCHAR(50),
+                patient_id INT REFERENCES patients(patient_id),
+                practitioner_id INT REFERENCES doctors(doctor_id),
+                encounter_date TIMESTAMP,
+                status TEXT,
+                reason TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+    encounter_ref = "" if partitioned else " REFERENCES appointments(appointment_id)"
 
     # Diseases
     cur.execute("""
         CREATE TABLE IF NOT EXISTS diseases (
             disease_id SERIAL PRIMARY KEY,
-            name VARCHAR(200),
+            name VARCHAR(200) UNIQUE,
             description TEXT
         );
     """)
@@ -95,7 +280,7 @@ def create_tables():
     cur.execute("""
         CREATE TABLE IF NOT EXISTS symptoms (
             symptom_id SERIAL PRIMARY KEY,
-            name VARCHAR(200),
+            name VARCHAR(200) UNIQUE,
             description TEXT
         );
     """)
@@ -185,12 +370,12 @@ def create_tables():
     """)
 
     # Diagnostic Reports
-    cur.execute("""
+    cur.execute(f"""
         CREATE TABLE IF NOT EXISTS diagnostic_reports (
             id SERIAL PRIMARY KEY,
             fhir_id VARCHAR(50),
             patient_id INT REFERENCES patients(patient_id),
-            encounter_id INT REFERENCES appointments(appointment_id),
+            encounter_id INT{encounter_ref},
             code TEXT,
             conclusion TEXT,
             issued TIMESTAMP
@@ -198,12 +383,12 @@ def create_tables():
     """)
 
     # Document References
-    cur.execute("""
+    cur.execute(f"""
         CREATE TABLE IF NOT EXISTS document_references (
             id SERIAL PRIMARY KEY,
             fhir_id VARCHAR(50),
             patient_id INT REFERENCES patients(patient_id),
-            encounter_id INT REFERENCES appointments(appointment_id),
+            encounter_id INT{encounter_ref},
             title TEXT,
             content TEXT,
             author TEXT,
@@ -211,320 +396,864 @@ def create_tables():
         );
     """)
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
 
 
+# ---------------------- INDEXES ----------------------
+# Managed index set for the join / filter patterns the Text2SQL prompt uses:
+# every foreign key, LOWER(name) lookups on diseases/symptoms/doctors and
+# date-range scans on appointments.encounter_date.
+INDEXES = (
+    ("idx_appointments_patient_id", "appointments", "(patient_id)"),
+    ("idx_appointments_practitioner_id", "appointments", "(practitioner_id)"),
+    ("idx_appointments_encounter_date", "appointments", "(encounter_date)"),
+    ("idx_patient_conditions_patient_id", "patient_conditions", "(patient_id)"),
+    ("idx_patient_conditions_disease_id", "patient_conditions", "(disease_id)"),
+    ("idx_patient_symptoms_patient_id", "patient_symptoms", "(patient_id)"),
+    ("idx_patient_symptoms_symptom_id", "patient_symptoms", "(symptom_id)"),
+    ("idx_patient_treatments_patient_id", "patient_treatments", "(patient_id)"),
+    ("idx_patient_treatments_treatment_id", "patient_treatments", "(treatment_id)"),
+    ("idx_patient_treatments_doctor_id", "patient_treatments", "(doctor_id)"),
+    ("idx_prescriptions_patient_id", "prescriptions", "(patient_id)"),
+    ("idx_prescriptions_doctor_id", "prescriptions", "(doctor_id)"),
+    ("idx_prescriptions_medicine_id", "prescriptions", "(medicine_id)"),
+    ("idx_billing_patient_id", "billing", "(patient_id)"),
+    ("idx_diagnostic_reports_patient_id", "diagnostic_reports", "(patient_id)"),
+    ("idx_diagnostic_reports_encounter_id", "diagnostic_reports", "(encounter_id)"),
+    ("idx_document_references_patient_id", "document_references", "(patient_id)"),
+    ("idx_document_references_encounter_id", "document_references", "(encounter_id)"),
+    ("idx_diseases_lower_name", "diseases", "(LOWER(name))"),
+    ("idx_symptoms_lower_name", "symptoms", "(LOWER(name))"),
+    ("idx_doctors_lower_name", "doctors", "(LOWER(name))"),
+)
+
+
+def create_indexes(concurrently=True):
+    """
+    Build any missing managed indexes on an existing database.
+
+    With concurrently=True (the default) each index is built with
+    CREATE INDEX CONCURRENTLY on a dedicated autocommit connection, so reads
+    and writes keep flowing while it builds. A concurrent build that failed
+    earlier leaves an INVALID index behind; those are dropped and rebuilt.
+    """
+    if not concurrently:
+        with transaction() as conn, conn.cursor() as cur:
+            for name, table, columns in INDEXES:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {columns};")
+        return
+
+    conn = get_conn()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        for name, table, columns in INDEXES:
+            cur.execute("""
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND pg_table_is_visible(c.oid);
+            """, (name,))
+            row = cur.fetchone()
+            if row and row[0]:
+                continue
+            if row:
+                print(f"Dropping invalid index {name} left by an earlier build...")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+
+            print(f"Creating index {name} on {table} {columns}...")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {columns};")
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ---------------------- SUMMARY VIEWS ----------------------
+# Materialized views for the aggregate questions clinicians ask most (see the
+# summary-view section of the Text2SQL prompt in hospital_backend.py).
+# Each view has a unique index so it can be refreshed CONCURRENTLY, i.e.
+# without blocking readers. hospital_backend refreshes them on a timer
+# (SUMMARY_REFRESH_SECONDS); loaders can call refresh_summary_views() too.
+SUMMARY_VIEWS = {
+    "mv_patients_per_disease": ("""
+        SELECT d.disease_id, d.name AS disease_name,
+               COUNT(DISTINCT pc.patient_id) AS patient_count
+        FROM diseases d
+        LEFT JOIN patient_conditions pc ON pc.disease_id = d.disease_id
+        GROUP BY d.disease_id, d.name
+    """, "disease_id"),
+    "mv_appointments_per_doctor": ("""
+        SELECT doc.doctor_id, doc.name AS doctor_name, doc.specialization,
+               COUNT(a.appointment_id) AS total_appointments,
+               MAX(a.encounter_date) AS last_appointment
+        FROM doctors doc
+        LEFT JOIN appointments a ON a.practitioner_id = doc.doctor_id
+        GROUP BY doc.doctor_id, doc.name, doc.specialization
+    """, "doctor_id"),
+    "mv_appointments_per_patient": ("""
+        SELECT p.patient_id, p.name AS patient_name,
+               COUNT(a.appointment_id) AS total_appointments,
+               MAX(a.encounter_date) AS last_appointment
+        FROM patients p
+        LEFT JOIN appointments a ON a.patient_id = p.patient_id
+        GROUP BY p.patient_id, p.name
+    """, "patient_id"),
+    "mv_appointments_per_month": ("""
+        SELECT date_trunc('month', encounter_date)::date AS month,
+               COUNT(*) AS total_appointments
+        FROM appointments
+        WHERE encounter_date IS NOT NULL
+        GROUP BY 1
+    """, "month"),
+    "mv_billing_summary": ("""
+        SELECT COALESCE(payment_status, 'unknown') AS payment_status,
+               COUNT(*) AS bill_count,
+               SUM(amount) AS total_amount_before_adjustments,
+               SUM(discount) AS total_discount,
+               SUM(tax) AS total_tax,
+               SUM(total_amount) AS total_revenue,
+               AVG(total_amount) AS average_bill
+        FROM billing
+        GROUP BY 1
+    """, "payment_status"),
+    "mv_monthly_revenue": ("""
+        SELECT date_trunc('month', generated_on)::date AS month,
+               COUNT(*) AS bill_count,
+               SUM(total_amount) AS total_revenue,
+               SUM(total_amount) FILTER (WHERE payment_status = 'paid') AS paid_revenue,
+               SUM(total_amount) FILTER (WHERE payment_status = 'pending') AS pending_revenue
+        FROM billing
+        WHERE generated_on IS NOT NULL
+        GROUP BY 1
+    """, "month"),
+}
+
+
+def create_summary_views():
+    """Create any missing summary views (populated) and their unique indexes."""
+    with transaction() as conn, conn.cursor() as cur:
+        for name, (query, key) in SUMMARY_VIEWS.items():
+            cur.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query} WITH DATA;")
+            cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({key});")
+
+
+def refresh_summary_views(cur=None):
+    """
+    Refresh every summary view CONCURRENTLY. Pass a cursor to run on an
+    existing connection (the caller commits); otherwise each view is
+    refreshed in its own pooled transaction.
+    """
+    for name in SUMMARY_VIEWS:
+        if cur is not None:
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name};")
+            continue
+        with transaction() as conn, conn.cursor() as own_cur:
+            own_cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name};")
+
+
+# ---------------------- PARTITIONING ----------------------
+# appointments (filtered by encounter_date ranges in almost every prompt
+# example) and chat_history (two rows per /chat call) can be range
+# partitioned by month. Date-filtered queries then only touch the matching
+# months, and an old month can be detached (and archived/dropped) cheaply.
+#
+# Layout: <table>_pYYYY_MM for each month plus <table>_default, which
+# catches rows outside every monthly range so inserts never fail. Future
+# months are created ahead of time by ensure_partitions(); schedule
+# `python init_db.py --maintain-partitions` (e.g. daily cron) to keep
+# PARTITION_MONTHS_AHEAD months ready.
+PARTITIONED_TABLES = {
+    "appointments": "encounter_date",
+    "chat_history": "timestamp",
+}
+PARTITION_MONTHS_AHEAD = int(os.getenv("DB_PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_MONTHS_BACK = int(os.getenv("DB_PARTITION_MONTHS_BACK", "12"))
+
+
+def _add_months(d, months):
+    month_index = d.year * 12 + d.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(table, month):
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def _relation_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    return cur.fetchone()[0]
+
+
+def is_partitioned(cur, table):
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+        );
+    """, (table,))
+    return cur.fetchone()[0]
+
+
+def _create_month_partition(cur, table, month):
+    name = _partition_name(table, month)
+    if _relation_exists(cur, name):
+        return False
+
+    column = PARTITIONED_TABLES[table]
+    lo, hi = month, _add_months(month, 1)
+    default = f"{table}_default"
+
+    if not _relation_exists(cur, default):
+        cur.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s);",
+            (lo, hi),
+        )
+        return True
+
+    # Rows for this month may already sit in the default partition; move them
+    # into a standalone table first, then attach it (ATTACH only has to
+    # verify the default partition no longer holds any of them).
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {default}
+            WHERE "{column}" >= %s AND "{column}" < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved;
+    """, (lo, hi))
+    cur.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);",
+        (lo, hi),
+    )
+    return True
+
+
+def _ensure_partitions(cur, table, start, end):
+    if not is_partitioned(cur, table):
+        return []
+
+    if not _relation_exists(cur, f"{table}_default"):
+        cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;")
+
+    created = []
+    month = _add_months(start, 0)
+    last = _add_months(end, PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        if _create_month_partition(cur, table, month):
+            created.append(_partition_name(table, month))
+        month = _add_months(month, 1)
+    return created
+
+
+def ensure_partitions(table, start=None, end=None):
+    """
+    Make sure monthly partitions exist from `start` (default: this month) to
+    PARTITION_MONTHS_AHEAD months past `end` (default: today). No-op for a
+    table that is not partitioned. Returns the names of new partitions.
+    """
+    today = date.today()
+    with transaction() as conn, conn.cursor() as cur:
+        return _ensure_partitions(cur, table, start or today, end or today)
+
+
+def detach_partition(table, month, concurrently=False):
+    """
+    Detach one month from `table`. The detached partition becomes a normal
+    table (<table>_pYYYY_MM) that can be archived or dropped without touching
+    the live table.
+
+    A plain DETACH takes an ACCESS EXCLUSIVE lock on `table`, blocking reads
+    and writes for the (short, catalog-only) duration. CONCURRENTLY
+    (PostgreSQL 14+) only takes SHARE UPDATE EXCLUSIVE, but PostgreSQL
+    refuses it while the table has a default partition, which the layout
+    created by ensure_partitions() always has.
+    """
+    name = _partition_name(table, _add_months(month, 0))
+    conn = get_conn()
+    conn.autocommit = concurrently
+    cur = conn.cursor()
+    try:
+        if concurrently and _relation_exists(cur, f"{table}_default"):
+            raise ValueError(
+                f"{table} has a default partition; PostgreSQL cannot DETACH "
+                "PARTITION CONCURRENTLY, use concurrently=False."
+            )
+        suffix = " CONCURRENTLY" if concurrently else ""
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}{suffix};")
+        if not concurrently:
+            conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return name
+
+
+def migrate_to_partitioned(table):
+    """
+    Convert an existing flat `table` into the monthly partitioned layout.
+
+    The flat table is kept as <table>_unpartitioned (as a backup) and a new
+    partitioned table with the same columns, defaults, serial sequences,
+    outgoing foreign keys and non-unique indexes takes its name. The primary
+    key gains the partition column. Foreign keys that point *at* the table
+    (diagnostic_reports/document_references.encounter_id) are dropped,
+    because the old key column alone is no longer unique.
+
+    Runs in one transaction and holds an exclusive lock on the table while
+    it copies, so run it in a maintenance window.
+    """
+    column = PARTITIONED_TABLES[table]
+    legacy = f"{table}_unpartitioned"
+
+    with transaction() as conn, conn.cursor() as cur:
+        if not _relation_exists(cur, table):
+            print(f"{table} does not exist; nothing to migrate.")
+            return
+        if is_partitioned(cur, table):
+            print(f"{table} is already partitioned.")
+            return
+
+        cur.execute(f'SELECT COUNT(*), MIN("{column}"), MAX("{column}") FROM {table};')
+        total, lo, hi = cur.fetchone()
+        cur.execute(f'SELECT COUNT(*) FROM {table} WHERE "{column}" IS NULL;')
+        if cur.fetchone()[0]:
+            raise ValueError(
+                f"{table}.{column} has NULL values; fill them in before partitioning."
+            )
+
+        # Primary key, outgoing/incoming FKs and indexes of the flat table.
+        cur.execute("""
+            SELECT a.attname
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND i.indisprimary;
+        """, (table,))
+        pk_columns = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'p';
+        """, (table,))
+        pk_name = cur.fetchone()
+        cur.execute("""
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f';
+        """, (table,))
+        outgoing_fks = cur.fetchall()
+        cur.execute("""
+            SELECT conrelid::regclass::text, conname
+            FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f';
+        """, (table,))
+        incoming_fks = cur.fetchall()
+        cur.execute("""
+            SELECT c.relname, pg_get_indexdef(i.indexrelid)
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = %s::regclass AND NOT i.indisprimary AND NOT i.indisunique;
+        """, (table,))
+        indexes = cur.fetchall()
+        cur.execute("""
+            SELECT a.attname, pg_get_serial_sequence(%s, a.attname)
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped;
+        """, (table, table))
+        sequences = [(col, seq) for col, seq in cur.fetchall() if seq]
+
+        for child, conname in incoming_fks:
+            print(f"Dropping foreign key {conname} on {child} (references {table})...")
+            cur.execute(f"ALTER TABLE {child} DROP CONSTRAINT {conname};")
+
+        cur.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+        if pk_name:
+            cur.execute(f'ALTER TABLE {legacy} RENAME CONSTRAINT "{pk_name[0]}" TO "{legacy}_pkey";')
+        for index_name, _ in indexes:
+            cur.execute(f'ALTER INDEX "{index_name}" RENAME TO "{index_name[:50]}_unpartitioned";')
+
+        cur.execute(f"""
+            CREATE TABLE {table} (
+                LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE
+            ) PARTITION BY RANGE ("{column}");
+        """)
+        if pk_columns:
+            key = pk_columns + ([column] if column not in pk_columns else [])
+            quoted = ", ".join(f'"{c}"' for c in key)
+            cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({quoted});")
+        for conname, definition in outgoing_fks:
+            cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {conname} {definition};")
+        for index_name, definition in indexes:
+            # Definitions were read before the rename, so they still name `table`.
+            target = definition.split(" ON ", 1)[1]
+            cur.execute(f'CREATE INDEX "{index_name}" ON {target};')
+        for col, seq in sequences:
+            cur.execute(f'ALTER SEQUENCE {seq} OWNED BY {table}."{col}";')
+
+        today = date.today()
+        start = _add_months(lo, 0) if lo else today
+        end = max(_add_months(hi, 0), today) if hi else today
+        _ensure_partitions(cur, table, start, end)
+
+        print(f"Copying {total} rows from {legacy} into partitioned {table}...")
+        cur.execute(f"INSERT INTO {table} SELECT * FROM {legacy};")
+
+    print(f"{table} is now partitioned by month on {column}; old data kept in {legacy}.")
+
+
 # ---------------------- INSERT FUNCTIONS ----------------------
-# (ALL functions below follow same style and always open/close DB)
+# (ALL functions below follow same style and run inside transaction():
+#  on their own they commit straight away, inside an outer transaction()
+#  they join it)
 def insert_patient(
     name, gender, birth_date, phone="", email=None, address="",
     fhir_id=None, emergency_contact_phone=None, blood_group=None,
     created_at=None, updated_at=None
 ):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO patients 
-        (fhir_id, name, gender, birth_date, phone, email, address, 
-        emergency_contact_phone, blood_group, created_at, updated_at)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        RETURNING patient_id;
-    """, (
-        fhir_id, name, gender, birth_date, phone, email, address,
-        emergency_contact_phone, blood_group, created_at, updated_at
-    ))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO patients 
+            (fhir_id, name, gender, birth_date, phone, email, address, 
+            emergency_contact_phone, blood_group, created_at, updated_at)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            RETURNING patient_id;
+        """, (
+            fhir_id, name, gender, birth_date, phone, email, address,
+            emergency_contact_phone, blood_group, created_at, updated_at
+        ))
+        return cur.fetchone()[0]
 
 def insert_doctor(fhir_id, name, specialization, phone, email, department, qualification, years_of_experience):
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO doctors 
-        (fhir_id, name, specialization, phone, email, department, qualification, years_of_experience)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-        RETURNING doctor_id;
-    """, (fhir_id, name, specialization, phone, email, department, qualification, years_of_experience))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO doctors 
+            (fhir_id, name, specialization, phone, email, department, qualification, years_of_experience)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+            RETURNING doctor_id;
+        """, (fhir_id, name, specialization, phone, email, department, qualification, years_of_experience))
+        return cur.fetchone()[0]
 
 
 def insert_appointment(patient_id, practitioner_id, encounter_date, status="finished", fhir_id=None):
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO appointments 
-        (fhir_id, patient_id, practitioner_id, encounter_date, status)
-        VALUES (%s,%s,%s,%s,%s)
-        RETURNING appointment_id;
-    """, (fhir_id, patient_id, practitioner_id, encounter_date, status))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO appointments 
+            (fhir_id, patient_id, practitioner_id, encounter_date, status)
+            VALUES (%s,%s,%s,%s,%s)
+            RETURNING appointment_id;
+        """, (fhir_id, patient_id, practitioner_id, encounter_date, status))
+        return cur.fetchone()[0]
 
 
 def insert_disease(name, description):
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO diseases (name, description)
-        VALUES (%s, %s)
-        RETURNING disease_id;
-    """, (name, description))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO diseases (name, description)
+            VALUES (%s, %s)
+            RETURNING disease_id;
+        """, (name, description))
+        return cur.fetchone()[0]
 
 
 
 def insert_patient_condition(patient_id, disease_id, code, description, onset_date, status="active", fhir_id=None):
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO patient_conditions 
-        (fhir_id, patient_id, disease_id, code, description, onset_date, status)
-        VALUES (%s,%s,%s,%s,%s,%s,%s)
-        RETURNING patient_conditions_id;
-    """, (fhir_id, patient_id, disease_id, code, description, onset_date, status))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO patient_conditions 
+            (fhir_id, patient_id, disease_id, code, description, onset_date, status)
+            VALUES (%s,%s,%s,%s,%s,%s,%s)
+            RETURNING patient_conditions_id;
+        """, (fhir_id, patient_id, disease_id, code, description, onset_date, status))
+        return cur.fetchone()[0]
 
 
 
 def insert_symptom(name, description):
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO symptoms (name, description)
-        VALUES (%s, %s)
-        RETURNING symptom_id;
-    """, (name, description))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO symptoms (name, description)
+            VALUES (%s, %s)
+            RETURNING symptom_id;
+        """, (name, description))
+        return cur.fetchone()[0]
 
 
 
 def insert_patient_symptom(patient_id, symptom_id, noted_on):
 
-    conn = get_conn()
-    cur = conn.cursor()
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO patient_symptoms (patient_id, symptom_id, noted_on)
+            VALUES (%s,%s,%s)
+            RETURNING ps_id;
+        """, (patient_id, symptom_id, noted_on))
+        return cur.fetchone()[0]
 
-    cur.execute("""
-        INSERT INTO patient_symptoms (patient_id, symptom_id, noted_on)
-        VALUES (%s,%s,%s)
-        RETURNING ps_id;
-    """, (patient_id, symptom_id, noted_on))
 
-    new_id = cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+def insert_treatment(name, description):
 
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO treatments (name, description)
+            VALUES (%s,%s)
+            RETURNING treatment_id;
+        """, (name, description))
+        return cur.fetchone()[0]
 
 
-def insert_treatment(name, description):
 
-    conn = get_conn()
-    cur = conn.cursor()
+def insert_patient_treatment(name, description, patient_id, treatment_id, doctor_id, start_date, end_date, notes):
 
-    cur.execute("""
-        INSERT INTO treatments (name, description)
-        VALUES (%s,%s)
-        RETURNING treatment_id;
-    """, (name, description))
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO patient_treatments 
+            (name, description, patient_id, treatment_id, doctor_id, start_date, end_date, notes)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+            RETURNING id;
+        """, (name, description, patient_id, treatment_id, doctor_id, start_date, end_date, notes))
+        return cur.fetchone()[0]
 
-    new_id = cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
 
+def insert_medicine(name, type, description):
 
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO medicines (name, type, description)
+            VALUES (%s,%s,%s)
+            RETURNING medicine_id;
+        """, (name, type, description))
+        return cur.fetchone()[0]
 
-def insert_patient_treatment(name, description, patient_id, treatment_id, doctor_id, start_date, end_date, notes):
 
-    conn = get_conn()
-    cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO patient_treatments 
-        (name, description, patient_id, treatment_id, doctor_id, start_date, end_date, notes)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-        RETURNING id;
-    """, (name, description, patient_id, treatment_id, doctor_id, start_date, end_date, notes))
+def insert_prescription(patient_id, doctor_id, medicine_id, dosage, frequency, duration, instructions, prescribed_on):
 
-    new_id = cur.fetchone()[0]
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO prescriptions 
+            (patient_id, doctor_id, medicine_id, dosage, frequency, duration, instructions, prescribed_on)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+            RETURNING prescription_id;
+        """, (patient_id, doctor_id, medicine_id, dosage, frequency, duration, instructions, prescribed_on))
+        return cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
 
 
+def insert_billing(patient_id, amount, discount, tax, total_amount, payment_status):
 
-def insert_medicine(name, type, description):
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO billing 
+            (patient_id, amount, discount, tax, total_amount, payment_status)
+            VALUES (%s,%s,%s,%s,%s,%s)
+            RETURNING bill_id;
+        """, (patient_id, amount, discount, tax, total_amount, payment_status))
+        return cur.fetchone()[0]
 
-    conn = get_conn()
-    cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO medicines (name, type, description)
-        VALUES (%s,%s,%s)
-        RETURNING medicine_id;
-    """, (name, type, description))
 
-    new_id = cur.fetchone()[0]
+def insert_staff(name, role, phone, email):
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO staff (name, role, phone, email)
+            VALUES (%s,%s,%s,%s)
+            RETURNING staff_id;
+        """, (name, role, phone, email))
+        return cur.fetchone()[0]
 
 
 
-def insert_prescription(patient_id, doctor_id, medicine_id, dosage, frequency, duration, instructions, prescribed_on):
+def insert_diagnostic_report(patient_id, encounter_id, code, conclusion, issued, fhir_id=None):
 
-    conn = get_conn()
-    cur = conn.cursor()
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO diagnostic_reports 
+            (fhir_id, patient_id, encounter_id, code, conclusion, issued)
+            VALUES (%s,%s,%s,%s,%s,%s)
+            RETURNING id;
+        """, (fhir_id, patient_id, encounter_id, code, conclusion, issued))
+        return cur.fetchone()[0]
 
-    cur.execute("""
-        INSERT INTO prescriptions 
-        (patient_id, doctor_id, medicine_id, dosage, frequency, duration, instructions, prescribed_on)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-        RETURNING prescription_id;
-    """, (patient_id, doctor_id, medicine_id, dosage, frequency, duration, instructions, prescribed_on))
 
-    new_id = cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+def insert_document_reference(patient_id, encounter_id, title, content, author, date, fhir_id=None):
 
+    with transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO document_references 
+            (fhir_id, patient_id, encounter_id, title, content, author, date)
+            VALUES (%s,%s,%s,%s,%s,%s,%s)
+            RETURNING id;
+        """, (fhir_id, patient_id, encounter_id, title, content, author, date))
+        return cur.fetchone()[0]
+
+
+
+# ---------------------- BULK INSERT FUNCTIONS ----------------------
+# Batched variants of the insert_* functions above. Each one takes an
+# iterable of rows and writes them in ONE transaction() using multi-row
+# VALUES (psycopg2 execute_values), returning the generated ids in the same
+# order as the input rows.
+#
+# A row may be either:
+#   - a dict using the same keyword names as the single-row function
+#     (missing optional keys fall back to the same defaults), or
+#   - a tuple/list already in column order (see the *_COLUMNS specs).
+
+BULK_PAGE_SIZE = int(os.getenv("DB_BULK_PAGE_SIZE", "1000"))
+
+_REQUIRED = object()
+
+PATIENT_COLUMNS = (
+    ("fhir_id", None), ("name", _REQUIRED), ("gender", _REQUIRED),
+    ("birth_date", _REQUIRED), ("phone", ""), ("email", None), ("address", ""),
+    ("emergency_contact_phone", None), ("blood_group", None),
+    ("created_at", None), ("updated_at", None),
+)
+DOCTOR_COLUMNS = (
+    ("fhir_id", _REQUIRED), ("name", _REQUIRED), ("specialization", _REQUIRED),
+    ("phone", _REQUIRED), ("email", _REQUIRED), ("department", _REQUIRED),
+    ("qualification", _REQUIRED), ("years_of_experience", _REQUIRED),
+)
+APPOINTMENT_COLUMNS = (
+    ("fhir_id", None), ("patient_id", _REQUIRED), ("practitioner_id", _REQUIRED),
+    ("encounter_date", _REQUIRED), ("status", "finished"),
+)
+DISEASE_COLUMNS = (("name", _REQUIRED), ("description", _REQUIRED))
+PATIENT_CONDITION_COLUMNS = (
+    ("fhir_id", None), ("patient_id", _REQUIRED), ("disease_id", _REQUIRED),
+    ("code", _REQUIRED), ("description", _REQUIRED), ("onset_date", _REQUIRED),
+    ("status", "active"),
+)
+SYMPTOM_COLUMNS = (("name", _REQUIRED), ("description", _REQUIRED))
+PATIENT_SYMPTOM_COLUMNS = (
+    ("patient_id", _REQUIRED), ("symptom_id", _REQUIRED), ("noted_on", _REQUIRED),
+)
+TREATMENT_COLUMNS = (("name", _REQUIRED), ("description", _REQUIRED))
+PATIENT_TREATMENT_COLUMNS = (
+    ("name", _REQUIRED), ("description", _REQUIRED), ("patient_id", _REQUIRED),
+    ("treatment_id", _REQUIRED), ("doctor_id", _REQUIRED),
+    ("start_date", _REQUIRED), ("end_date", _REQUIRED), ("notes", _REQUIRED),
+)
+MEDICINE_COLUMNS = (("name", _REQUIRED), ("type", _REQUIRED), ("description", _REQUIRED))
+PRESCRIPTION_COLUMNS = (
+    ("patient_id", _REQUIRED), ("doctor_id", _REQUIRED), ("medicine_id", _REQUIRED),
+    ("dosage", _REQUIRED), ("frequency", _REQUIRED), ("duration", _REQUIRED),
+    ("instructions", _REQUIRED), ("prescribed_on", _REQUIRED),
+)
+BILLING_COLUMNS = (
+    ("patient_id", _REQUIRED), ("amount", _REQUIRED), ("discount", _REQUIRED),
+    ("tax", _REQUIRED), ("total_amount", _REQUIRED), ("payment_status", _REQUIRED),
+)
+STAFF_COLUMNS = (
+    ("name", _REQUIRED), ("role", _REQUIRED), ("phone", _REQUIRED), ("email", _REQUIRED),
+)
+DIAGNOSTIC_REPORT_COLUMNS = (
+    ("fhir_id", None), ("patient_id", _REQUIRED), ("encounter_id", _REQUIRED),
+    ("code", _REQUIRED), ("conclusion", _REQUIRED), ("issued", _REQUIRED),
+)
+DOCUMENT_REFERENCE_COLUMNS = (
+    ("fhir_id", None), ("patient_id", _REQUIRED), ("encounter_id", _REQUIRED),
+    ("title", _REQUIRED), ("content", _REQUIRED), ("author", _REQUIRED),
+    ("date", _REQUIRED),
+)
+
+
+def _row_values(columns, row):
+    """Turn one dict/tuple row into a tuple in column order."""
+    if not isinstance(row, Mapping):
+        values = tuple(row)
+        if len(values) != len(columns):
+            raise ValueError(
+                f"Expected {len(columns)} values, got {len(values)}: {values!r}"
+            )
+        return values
+
+    values = []
+    for name, default in columns:
+        value = row.get(name, default)
+        if value is _REQUIRED:
+            raise ValueError(f"Missing required column '{name}' in row {row!r}")
+        values.append(value)
+    return tuple(values)
+
+
+def _insert_many(table, columns, id_column, rows, page_size=None):
+    """
+    Insert many rows into `table` in a single transaction and return the
+    generated ids in input order.
+
+    Postgres emits RETURNING rows in VALUES order for a plain multi-row
+    INSERT, and execute_values keeps the pages in order, so the ids line
+    up with the input rows.
+    """
+    values = [_row_values(columns, row) for row in rows]
+    if not values:
+        return []
+
+    column_list = ", ".join(name for name, _ in columns)
+    query = f"INSERT INTO {table} ({column_list}) VALUES %s RETURNING {id_column}"
+
+    with transaction() as conn, conn.cursor() as cur:
+        returned = execute_values(
+            cur, query, values,
+            page_size=page_size or BULK_PAGE_SIZE,
+            fetch=True,
+        )
+
+    return [r[0] for r in returned]
+
+
+def insert_patients_many(rows, page_size=None):
+    return _insert_many("patients", PATIENT_COLUMNS, "patient_id", rows, page_size)
+
+
+def insert_doctors_many(rows, page_size=None):
+    return _insert_many("doctors", DOCTOR_COLUMNS, "doctor_id", rows, page_size)
+
+
+def insert_appointments_many(rows, page_size=None):
+    return _insert_many("appointments", APPOINTMENT_COLUMNS, "appointment_id", rows, page_size)
+
+
+def insert_diseases_many(rows, page_size=None):
+    return _insert_many("diseases", DISEASE_COLUMNS, "disease_id", rows, page_size)
+
+
+def insert_patient_conditions_many(rows, page_size=None):
+    return _insert_many(
+        "patient_conditions", PATIENT_CONDITION_COLUMNS, "patient_conditions_id", rows, page_size
+    )
 
 
-def insert_billing(patient_id, amount, discount, tax, total_amount, payment_status):
+def insert_symptoms_many(rows, page_size=None):
+    return _insert_many("symptoms", SYMPTOM_COLUMNS, "symptom_id", rows, page_size)
 
-    conn = get_conn()
-    cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO billing 
-        (patient_id, amount, discount, tax, total_amount, payment_status)
-        VALUES (%s,%s,%s,%s,%s,%s)
-        RETURNING bill_id;
-    """, (patient_id, amount, discount, tax, total_amount, payment_status))
+def insert_patient_symptoms_many(rows, page_size=None):
+    return _insert_many("patient_symptoms", PATIENT_SYMPTOM_COLUMNS, "ps_id", rows, page_size)
 
-    new_id = cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+def insert_treatments_many(rows, page_size=None):
+    return _insert_many("treatments", TREATMENT_COLUMNS, "treatment_id", rows, page_size)
 
 
+def insert_patient_treatments_many(rows, page_size=None):
+    return _insert_many("patient_treatments", PATIENT_TREATMENT_COLUMNS, "id", rows, page_size)
 
-def insert_staff(name, role, phone, email):
 
-    conn = get_conn()
-    cur = conn.cursor()
+def insert_medicines_many(rows, page_size=None):
+    return _insert_many("medicines", MEDICINE_COLUMNS, "medicine_id", rows, page_size)
 
-    cur.execute("""
-        INSERT INTO staff (name, role, phone, email)
-        VALUES (%s,%s,%s,%s)
-        RETURNING staff_id;
-    """, (name, role, phone, email))
 
-    new_id = cur.fetchone()[0]
+def insert_prescriptions_many(rows, page_size=None):
+    return _insert_many("prescriptions", PRESCRIPTION_COLUMNS, "prescription_id", rows, page_size)
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
 
+def insert_billing_many(rows, page_size=None):
+    return _insert_many("billing", BILLING_COLUMNS, "bill_id", rows, page_size)
 
 
-def insert_diagnostic_report(patient_id, encounter_id, code, conclusion, issued, fhir_id=None):
+def insert_staff_many(rows, page_size=None):
+    return _insert_many("staff", STAFF_COLUMNS, "staff_id", rows, page_size)
 
-    conn = get_conn()
-    cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO diagnostic_reports 
-        (fhir_id, patient_id, encounter_id, code, conclusion, issued)
-        VALUES (%s,%s,%s,%s,%s,%s)
-        RETURNING id;
-    """, (fhir_id, patient_id, encounter_id, code, conclusion, issued))
+def insert_diagnostic_reports_many(rows, page_size=None):
+    return _insert_many("diagnostic_reports", DIAGNOSTIC_REPORT_COLUMNS, "id", rows, page_size)
 
-    new_id = cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+def insert_document_references_many(rows, page_size=None):
+    return _insert_many("document_references", DOCUMENT_REFERENCE_COLUMNS, "id", rows, page_size)
 
 
 
-def insert_document_reference(patient_id, encounter_id, title, content, author, date, fhir_id=None):
+# ---------------------- COPY / STREAMING LOAD ----------------------
+# Used by the synthetic data loader (dataa.py --mode copy) to stream large
+# volumes through COPY ... FROM STDIN instead of one INSERT per row.
 
-    conn = get_conn()
-    cur = conn.cursor()
+_COPY_NULL = "\\N"
 
-    cur.execute("""
-        INSERT INTO document_references 
-        (fhir_id, patient_id, encounter_id, title, content, author, date)
-        VALUES (%s,%s,%s,%s,%s,%s,%s)
-        RETURNING id;
-    """, (fhir_id, patient_id, encounter_id, title, content, author, date))
-
-    new_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return new_id
+
+def reserve_ids(cur, table, id_column, count):
+    """
+    Reserve `count` ids from the SERIAL sequence behind table.id_column so the
+    caller can assign primary keys client-side (and reference them as foreign
+    keys) before the rows are written. nextval() is never rolled back, so the
+    ids stay unique even alongside concurrent inserts.
+    """
+    if count <= 0:
+        return []
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+        (table, id_column, count),
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+class _CsvRowStream(io.TextIOBase):
+    """
+    File-like object that renders rows to CSV lazily as COPY reads from it,
+    so a load never materialises the whole CSV payload in memory.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+        self._pending = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow([_COPY_NULL if v is None else v for v in row])
+            self._pending += self._buf.getvalue()
+            self._buf.seek(0)
+            self._buf.truncate()
+
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_rows(cur, table, columns, rows, id_column=None):
+    """
+    Stream rows into `table` with COPY ... FROM STDIN (CSV).
+
+    `columns` is one of the *_COLUMNS specs above and rows use the same
+    dict/tuple format as the insert_*_many functions. Pass `id_column` when
+    the rows carry client-assigned primary keys (see reserve_ids); dict rows
+    then need that key too, tuple rows put it first.
+
+    Runs on the caller's cursor, so it commits with the surrounding
+    transaction(). Returns the number of rows copied.
+    """
+    if id_column:
+        columns = ((id_column, _REQUIRED),) + tuple(columns)
+
+    counter = {"rows": 0}
+
+    def values():
+        for row in rows:
+            counter["rows"] += 1
+            yield _row_values(columns, row)
+
+    column_list = ", ".join(name for name, _ in columns)
+    cur.copy_expert(
+        f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')",
+        _CsvRowStream(values()),
+    )
+    return counter["rows"]
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+# Parsed PDF pages are cached in SQLite, keyed by (file sha256, page number),
+# so a PDF is only parsed again when its content changes. Cache misses are
+# parsed in a process pool, one file per task.
+PAGE_CACHE_PATH = os.getenv("POLICY_PAGE_CACHE_PATH", "policy_page_cache.sqlite3")
+PARSE_WORKERS = int(os.getenv("POLICY_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+# Embeddings are cached in SQLite too, keyed by (model, kind, sha256 of the
+# text). Misses go to the API in batches of EMBED_BATCH_SIZE texts with at
+# most EMBED_CONCURRENCY requests in flight.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --------------------------
+# PAGE CACHE
+# --------------------------
+def _connect(cache_path):
+    conn = sqlite3.connect(cache_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_files (
+            file_sha TEXT PRIMARY KEY,
+            page_count INTEGER NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_pages (
+            file_sha TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            PRIMARY KEY (file_sha, page)
+        );
+    """)
+    return conn
+
+
+def _cached_pages(conn, file_sha):
+    """[(text, metadata), ...] in page order, or None if the file isn't cached."""
+    row = conn.execute(
+        "SELECT page_count FROM pdf_files WHERE file_sha = ?;", (file_sha,)
+    ).fetchone()
+    if row is None:
+        return None
+    pages = conn.execute(
+        "SELECT text, metadata FROM pdf_pages WHERE file_sha = ? ORDER BY page;",
+        (file_sha,),
+    ).fetchall()
+    if len(pages) != row[0]:
+        return None
+    return [(text, json.loads(metadata)) for text, metadata in pages]
+
+
+def _store_pages(conn, file_sha, pages):
+    with conn:
+        conn.execute("DELETE FROM pdf_pages WHERE file_sha = ?;", (file_sha,))
+        conn.executemany(
+            "INSERT INTO pdf_pages (file_sha, page, text, metadata) VALUES (?, ?, ?, ?);",
+            [(file_sha, i, text, json.dumps(metadata)) for i, (text, metadata) in enumerate(pages)],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO pdf_files (file_sha, page_count) VALUES (?, ?);",
+            (file_sha, len(pages)),
+        )
+
+
+# --------------------------
+# PARSING
+# --------------------------
+def _parse_pdf(path):
+    """Worker: parse one PDF into [(text, metadata), ...], one entry per page."""
+    # Imported here so pool workers only pay for what they use.
+    from langchain_community.document_loaders import PyPDFLoader
+
+    return [(doc.page_content, doc.metadata) for doc in PyPDFLoader(path).load()]
+
+
+def load_pdf_pages(paths, hashes=None, cache_path=PAGE_CACHE_PATH, max_workers=PARSE_WORKERS):
+    """
+    Return {path: [Document, ...]} (one Document per page, as PyPDFLoader
+    gives them) for existing `paths`. Pages come from the cache when the
+    file's hash is known; the rest are parsed in parallel and cached.
+    `hashes` ({path: sha256}) skips re-hashing files the caller already hashed.
+    """
+    hashes = dict(hashes or {})
+    for path in paths:
+        if path not in hashes:
+            hashes[path] = file_sha256(path)
+
+    results = {}
+    with closing(_connect(cache_path)) as conn:
+        misses = []
+        for path in paths:
+            pages = _cached_pages(conn, hashes[path])
+            if pages is None:
+                misses.append(path)
+            else:
+                results[path] = pages
+
+        if misses:
+            if len(misses) == 1 or max_workers <= 1:
+                parsed = [_parse_pdf(path) for path in misses]
+            else:
+                # spawn, not fork: the API process has background threads running.
+                with ProcessPoolExecutor(
+                    max_workers=min(max_workers, len(misses)),
+                    mp_context=multiprocessing.get_context("spawn"),
+                ) as pool:
+                    parsed = list(pool.map(_parse_pdf, misses))
+            for path, pages in zip(misses, parsed):
+                _store_pages(conn, hashes[path], pages)
+                results[path] = pages
+
+    if misses:
+        print(f"[PageCache] Parsed {len(misses)} PDF(s), {len(paths) - len(misses)} from cache")
+    return {
+        path: [
+            # The cache is keyed by content, so the same PDF may have been
+            # cached under another path; report where it is now.
+            Document(page_content=text, metadata={**metadata, "source": path})
+            for text, metadata in results[path]
+        ]
+        for path in paths
+    }
+
+
+# --------------------------
+# EMBEDDING CACHE
+# --------------------------
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _connect_embeddings(cache_path):
+    conn = sqlite3.connect(cache_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            text_sha TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (model, kind, text_sha)
+        );
+    """)
+    return conn
+
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that looks every text up in the SQLite cache first
+    and only sends misses to `underlying`. Document and query embeddings
+    are cached separately ("document" / "query"), since providers may embed
+    them differently.
+    """
+
+    def __init__(
+        self,
+        underlying,
+        model_name,
+        cache_path=EMBEDDING_CACHE_PATH,
+        batch_size=EMBED_BATCH_SIZE,
+        max_concurrency=EMBED_CONCURRENCY,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, conn, kind, shas):
+        found = {}
+        unique = list(dict.fromkeys(shas))
+        for i in range(0, len(unique), 500):  # stay under SQLite's parameter limit
+            chunk = unique[i:i + 500]
+            rows = conn.execute(
+                f"SELECT text_sha, vector FROM embeddings WHERE model = ? AND kind = ? "
+                f"AND text_sha IN ({', '.join('?' * len(chunk))});",
+                [self.model_name, kind, *chunk],
+            ).fetchall()
+            found.update((sha, _unpack(blob)) for sha, blob in rows)
+        return found
+
+    def _store(self, conn, kind, items):
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, kind, text_sha, vector) VALUES (?, ?, ?, ?);",
+                [(self.model_name, kind, sha, _pack(vector)) for sha, vector in items],
+            )
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        shas = [text_sha256(t) for t in texts]
+        with closing(_connect_embeddings(self.cache_path)) as conn:
+            vectors = self._lookup(conn, "document", shas)
+            missing = {}
+            for sha, text in zip(shas, texts):
+                if sha not in vectors:
+                    missing.setdefault(sha, text)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+            items = list(missing.items())
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            if batches:
+                print(f"[EmbeddingCache] {len(texts) - len(missing)} cached, embedding {len(missing)} in {len(batches)} batch(es)")
+                with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as pool:
+                    futures = {
+                        pool.submit(self.underlying.embed_documents, [text for _, text in batch]): batch
+                        for batch in batches
+                    }
+                    # Store each batch as it lands, so a failure later on
+                    # doesn't throw away what was already paid for.
+                    for future in as_completed(futures):
+                        batch = futures[future]
+                        done = [(sha, vector) for (sha, _), vector in zip(batch, future.result())]
+                        self._store(conn, "document", done)
+                        vectors.update(done)
+
+        return [vectors[sha] for sha in shas]
+
+    def embed_query(self, text):
+        sha = text_sha256(text)
+        with closing(_connect_embeddings(self.cache_path)) as conn:
+            vector = self._lookup(conn, "query", [sha]).get(sha)
+            if vector is not None:
+                self.hits += 1
+                return vector
+            self.misses += 1
+            vector = self.underlying.embed_query(text)
+            self._store(conn, "query", [(sha, vector)])
+        return vector
@@ -1,4 +1,5 @@
 import psycopg2
+from psycopg2.extras import execute_values
 
 # -----------------------------------------
 # PostgreSQL Connection Configuration
@@ -103,39 +104,124 @@ REAL_DISEASES = [
 ]
 
 # -----------------------------------------
-# Database Insertion Logic
+# Database Sync Logic
 # -----------------------------------------
-def populate_symptoms():
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        cur = conn.cursor()
+# Reference data is synced, not reloaded: rows are matched on their unique
+# name, only new or changed rows are written, and existing ids never change
+# (patient_symptoms / patient_conditions keep pointing at the same rows).
+# Re-running against an already seeded database writes nothing.
 
-        print("Deleting existing symptoms...")
-        cur.execute("DELETE FROM symptoms;")
-        cur.execute("ALTER SEQUENCE symptoms_id_seq RESTART WITH 1;")
+def _ensure_unique_names(cur, table, id_column, references):
+    """
+    Make sure <table>_name_key (a unique index on name) exists so the sync
+    can use ON CONFLICT (name). Older databases may hold duplicate names
+    from repeated seeding; those are merged into the lowest id first, with
+    the referencing rows re-pointed at the surviving id.
+    """
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (f"{table}_name_key",))
+    if cur.fetchone()[0]:
+        return
 
-        print("Inserting new medical symptoms...")
-        cur.executemany(
-            "INSERT INTO symptoms (name, description) VALUES (%s, %s);",
-            SYMPTOMS,
+    cur.execute(f"""
+        SELECT {id_column}, keep_id FROM (
+            SELECT {id_column}, MIN({id_column}) OVER (PARTITION BY name) AS keep_id
+            FROM {table}
+        ) ranked
+        WHERE {id_column} <> keep_id;
+    """)
+    duplicates = cur.fetchall()
+    if duplicates:
+        print(f"Merging {len(duplicates)} duplicate {table} rows...")
+        for ref_table, ref_column in references:
+            execute_values(cur, f"""
+                UPDATE {ref_table} AS t SET {ref_column} = d.keep_id
+                FROM (VALUES %s) AS d(old_id, keep_id)
+                WHERE t.{ref_column} = d.old_id;
+            """, duplicates)
+        cur.execute(
+            f"DELETE FROM {table} WHERE {id_column} = ANY(%s);",
+            ([old_id for old_id, _ in duplicates],),
         )
 
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_name_key ON {table} (name);")
+
+
+def _sync_reference_rows(cur, table, id_column, rows, references):
+    """Upsert (name, description) rows and return {name: id}."""
+    rows = list(dict(rows).items())  # de-duplicate names, last one wins
+    names = [name for name, _ in rows]
+    _ensure_unique_names(cur, table, id_column, references)
+
+    # Only send new or changed rows, so an unchanged seed does no writes
+    # (and burns no sequence values). ON CONFLICT still covers a concurrent sync.
+    cur.execute(f"SELECT name, description FROM {table} WHERE name = ANY(%s);", (names,))
+    existing = dict(cur.fetchall())
+    changed = [(n, d) for n, d in rows if n not in existing or existing[n] != d]
+    if changed:
+        execute_values(cur, f"""
+            INSERT INTO {table} AS t (name, description) VALUES %s
+            ON CONFLICT (name) DO UPDATE SET description = EXCLUDED.description
+            WHERE t.description IS DISTINCT FROM EXCLUDED.description;
+        """, changed)
+
+    cur.execute(f"SELECT name, {id_column} FROM {table} WHERE name = ANY(%s);", (names,))
+    return dict(cur.fetchall())
+
+
+def sync_symptoms(cur):
+    """Sync SYMPTOMS into the symptoms table. Returns {name: symptom_id}."""
+    return _sync_reference_rows(
+        cur, "symptoms", "symptom_id", SYMPTOMS,
+        references=[("patient_symptoms", "symptom_id")],
+    )
+
+
+def sync_diseases(cur):
+    """Sync REAL_DISEASES into the diseases table. Returns {name: disease_id}."""
+    return _sync_reference_rows(
+        cur, "diseases", "disease_id",
+        [(d, f"A condition known as {d}.") for d in REAL_DISEASES],
+        references=[("patient_conditions", "disease_id")],
+    )
+
+
+def _connect():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+
+def _run_sync(label, sync):
+    conn = None
+    try:
+        conn = _connect()
+        with conn.cursor() as cur:
+            print(f"Syncing {label}...")
+            ids = sync(cur)
         conn.commit()
-        print("Symptoms table updated successfully!")
+        print(f"{label.capitalize()} table in sync ({len(ids)} rows).")
 
     except Exception as e:
+        if conn:
+            conn.rollback()
         print("Error:", e)
     finally:
         if conn:
-            cur.close()
             conn.close()
 
 
+def populate_symptoms():
+    _run_sync("symptoms", sync_symptoms)
+
+
+def populate_diseases():
+    _run_sync("diseases", sync_diseases)
+
+
 if __name__ == "__main__":
     populate_symptoms()
+    populate_diseases()